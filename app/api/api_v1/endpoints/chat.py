@@ -1,19 +1,95 @@
+import asyncio
+import json
+import time
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from app.services.pdf_service import PDFService
+from app.api.deps import get_pdf_service, get_langchain_service, get_pdf_tenant_id, get_tenant_id
 from app.services.langchain_gemini_service import LangchainGeminiService
 from app.utils.logger import logger
-from app.utils.cache import get_cached_response, set_cached_response
+from app.utils.cache import CacheLookup, answer_cache, normalize_question
 from app.utils.metrics import PerformanceMetrics
+from app.utils.single_flight import SingleFlight
 
 router = APIRouter()
 
+# Identical requests in flight at the same time share one LLM answer; indexing runs are shared through the service's index_flight
+answer_flight = SingleFlight("answer")
+
+async def _index_pdf(pdf_id: str, tenant_id: Optional[str], pdf_service: PDFService, langchain_service: LangchainGeminiService):
+  await langchain_service.index_pdf(pdf_id, lambda: pdf_service.iter_pages(pdf_id), tenant_id=tenant_id)
+
+async def _ensure_indexed(pdf_id: str, pdf_service: PDFService, langchain_service: LangchainGeminiService):
+  # Ensure the PDF content is indexed; persisted indexes are loaded lazily on query
+  if pdf_id not in langchain_service.pdf_vectorstores:
+    await _index_pdf(pdf_id, pdf_service.tenant_of(pdf_id), pdf_service, langchain_service)
+
+def _require_pdf(pdf_id: str, pdf_service: PDFService, langchain_service: LangchainGeminiService):
+  # Checked before the answer cache lookup, which embeds the question
+  if pdf_id not in langchain_service.pdf_vectorstores and pdf_service.catalog.get(pdf_id) is None:
+    raise ValueError(f"PDF with id {pdf_id} not found")
+
+async def _ensure_in_global_index(pdf_id: str, tenant_id: str, pdf_service: PDFService, langchain_service: LangchainGeminiService):
+  # Only the tenant's own PDFs can be searched; PDFs indexed before the global index existed are added on first use
+  document = pdf_service.catalog.get(pdf_id)
+  if document is None or document.tenant_id != tenant_id:
+    raise ValueError(f"PDF with id {pdf_id} not found")
+  if await asyncio.to_thread(langchain_service.global_index.contains, tenant_id, pdf_id):
+    return
+  vectorstore = await asyncio.to_thread(langchain_service.pdf_vectorstores.get, pdf_id)
+  if vectorstore is not None:
+    await langchain_service.index_flight.do(("global", pdf_id), lambda: asyncio.to_thread(langchain_service.global_index.add_vectorstore, tenant_id, pdf_id, vectorstore))
+  else:
+    await _index_pdf(pdf_id, tenant_id, pdf_service, langchain_service)
+
+def _sse(event: str, data: dict) -> str:
+  return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("")
+@PerformanceMetrics.measure_time
+async def chat_with_pdfs(
+  question: str = Query(..., min_length=5, max_length=500),
+  pdf_ids: Optional[List[str]] = Query(None),
+  pdf_service: PDFService = Depends(get_pdf_service),
+  langchain_service: LangchainGeminiService = Depends(get_langchain_service),
+  tenant_id: str = Depends(get_tenant_id)
+):
+  """
+  Chat with several PDFs at once, or with all PDFs of the tenant.
+
+  - **question**: The user's question
+  - **pdf_ids**: PDFs to search (repeat the parameter for each); omit to search all of the tenant's PDFs
+
+  Runs a single search over the tenant's shard of the global index instead of one search per PDF.
+  The response includes `context_tokens`, the estimated size of the retrieved context sent to the model.
+  """
+  try:
+    for pdf_id in pdf_ids or []:
+      await _ensure_in_global_index(pdf_id, tenant_id, pdf_service, langchain_service)
+
+    key = (tenant_id, tuple(sorted(set(pdf_ids))) if pdf_ids else None, normalize_question(question))
+    result = await answer_flight.do(key, lambda: langchain_service.answer_across_documents(tenant_id, question, pdf_ids, max_tokens=16392, max_iterations=5))
+
+    logger.info(f"Generated cross-document response for tenant {tenant_id} with question: {question}")
+    return {"response": result.format(), "context_tokens": result.context_tokens}
+  except HTTPException as he:
+    raise he
+  except ValueError as ve:
+    logger.error(f"PDF not found: {str(ve)}")
+    raise HTTPException(status_code=404, detail=str(ve))
+  except Exception as e:
+    logger.error(f"Error during chat for tenant {tenant_id}: {str(e)}")
+    raise HTTPException(status_code=500, detail="An error occurred while generating the response")
+
 @router.post("/{pdf_id}")
 @PerformanceMetrics.measure_time
 async def chat_with_pdf(
   pdf_id: str,
   question: str = Query(..., min_length=5, max_length=500),
-  pdf_service: PDFService = Depends(),
-  langchain_service: LangchainGeminiService = Depends()
+  pdf_service: PDFService = Depends(get_pdf_service),
+  langchain_service: LangchainGeminiService = Depends(get_langchain_service),
+  tenant_id: str = Depends(get_pdf_tenant_id)
 ):
   """
   Chat with the content of a specific PDF using Langchain with Gemini API.
@@ -21,31 +97,114 @@ async def chat_with_pdf(
   - **pdf_id**: The unique identifier of the PDF
   - **question**: The user's question about the PDF content
 
-  Returns the generated response using Langchain's RetrievalQA with Gemini API.
+  Returns the generated response using Langchain's RetrievalQA with Gemini API, and
+  `context_tokens`, the estimated size of the retrieved context sent to the model (0 for a cached answer).
+  Concurrent requests with the same normalized question share one generated answer.
+  LLM calls count against the concurrency limit of the tenant that owns the PDF.
   """
   try:
-    # Check if the response is already cached
-    cached_response = get_cached_response(pdf_id, question)
-    if cached_response:
-      logger.info(f"Returning cached response for PDF {pdf_id} with question: {question}")
-      return {"response": cached_response}
+    _require_pdf(pdf_id, pdf_service, langchain_service)
+    # Check if the same or a similar question was already answered for this PDF
+    cached = await answer_cache.get(pdf_id, question, langchain_service.embeddings.aembed_query)
+    if cached.answer is not None:
+      logger.info(f"Returning cached response for PDF {pdf_id} with question: {question} (cache stats: {answer_cache.stats()})")
+      return {"response": cached.answer, "context_tokens": 0}
       
-    # Ensure the PDF content is in the vector store
-    if pdf_id not in langchain_service.pdf_vectorstores:
-      pdf_text = await pdf_service.get_pdf_text(pdf_id)
-      await langchain_service.process_pdf(pdf_id, pdf_text)
-
-      # Query the PDF using Langchain with Gemini
-      response = await langchain_service.generate_long_answer(pdf_id, question, max_tokens=16392, max_iterations=5)
-        
-      # Cache the response
-      set_cached_response(pdf_id, question, response)
-
-      logger.info(f"Generated response for PDF {pdf_id} with question: {question}")
-      return {"response": response}
+    async def answer():
+      await _ensure_indexed(pdf_id, pdf_service, langchain_service)
+
+      # Query the PDF using Langchain with Gemini, reusing the question vector from the cache lookup
+      result = await langchain_service.answer_long(pdf_id, question, max_tokens=16392, max_iterations=5, query_vector=cached.vector)
+
+      # Cache the response unless the PDF was re-indexed while it was generated
+      answer_cache.set(pdf_id, question, result.format(), cached.vector, version=cached.version)
+      return result
+
+    result = await answer_flight.do((pdf_id, normalize_question(question)), answer)
+
+    logger.info(f"Generated response for PDF {pdf_id} with question: {question}")
+    return {"response": result.format(), "context_tokens": result.context_tokens}
+  except HTTPException as he:
+    raise he
   except ValueError as ve:
     logger.error(f"PDF not found: {str(ve)}")
     raise HTTPException(status_code=404, detail=str(ve))
   except Exception as e:
     logger.error(f"Error during chat with PDF {pdf_id}: {str(e)}")
-    raise HTTPException(status_code=500, detail="An error occurred while generating the response")
\ No newline at end of file
+    raise HTTPException(status_code=500, detail="An error occurred while generating the response")
+
+@router.post("/{pdf_id}/stream")
+async def stream_chat_with_pdf(
+  pdf_id: str,
+  question: str = Query(..., min_length=5, max_length=500),
+  pdf_service: PDFService = Depends(get_pdf_service),
+  langchain_service: LangchainGeminiService = Depends(get_langchain_service),
+  tenant_id: str = Depends(get_pdf_tenant_id)
+):
+  """
+  Chat with a specific PDF, streaming the answer as Server-Sent Events.
+
+  - **pdf_id**: The unique identifier of the PDF
+  - **question**: The user's question about the PDF content
+
+  Events, in order:
+  - **sources**: `{"sources": [...]}` for the retrieved chunks, sent before generation starts
+  - **token**: `{"text": "..."}` for every piece of the answer as the LLM produces it
+  - **done**: `{"time_to_first_token": seconds, "context_tokens": n}` once the answer is complete,
+    where `context_tokens` is the estimated size of the retrieved context sent to the model
+
+  A cached answer is sent as a single **cached** event `{"response": "..."}`; failures
+  after the stream has started are reported as an **error** event.
+  """
+  try:
+    _require_pdf(pdf_id, pdf_service, langchain_service)
+    cached = await answer_cache.get(pdf_id, question, langchain_service.embeddings.aembed_query)
+    if cached.answer is None:
+      await _ensure_indexed(pdf_id, pdf_service, langchain_service)
+  except HTTPException as he:
+    raise he
+  except ValueError as ve:
+    logger.error(f"PDF not found: {str(ve)}")
+    raise HTTPException(status_code=404, detail=str(ve))
+  except Exception as e:
+    logger.error(f"Error preparing streamed chat with PDF {pdf_id}: {str(e)}")
+    raise HTTPException(status_code=500, detail="An error occurred while generating the response")
+
+  return StreamingResponse(
+    _stream_answer_events(pdf_id, question, langchain_service, cached),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  )
+
+async def _stream_answer_events(pdf_id: str, question: str, langchain_service: LangchainGeminiService, cached: CacheLookup):
+  if cached.answer is not None:
+    logger.info(f"Returning cached response for PDF {pdf_id} with question: {question}")
+    yield _sse("cached", {"response": cached.answer})
+    return
+
+  start_time = time.perf_counter()
+  time_to_first_token = None
+  answer = ""
+  sources = []
+  context_tokens = 0
+  try:
+    async for kind, payload in langchain_service.stream_long_answer(pdf_id, question, max_tokens=16392, max_iterations=5, query_vector=cached.vector):
+      if kind == "sources":
+        sources = payload
+        yield _sse("sources", {"sources": payload})
+        continue
+      if kind == "context_tokens":
+        context_tokens = payload
+        continue
+      if time_to_first_token is None:
+        time_to_first_token = time.perf_counter() - start_time
+        logger.info(f"First token for PDF {pdf_id} after {time_to_first_token:.4f} seconds")
+      answer += payload
+      yield _sse("token", {"text": payload})
+
+    answer_cache.set(pdf_id, question, f"Answer: {answer.strip()}\n\nSources: {sources}", cached.vector, version=cached.version)
+    logger.info(f"Streamed response for PDF {pdf_id} with question: {question} in {time.perf_counter() - start_time:.4f} seconds")
+    yield _sse("done", {"time_to_first_token": time_to_first_token, "context_tokens": context_tokens})
+  except Exception as e:
+    logger.error(f"Error during streamed chat with PDF {pdf_id}: {str(e)}")
+    yield _sse("error", {"detail": "An error occurred while generating the response"})
@@ -1,22 +1,32 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Response
 from app.services.pdf_service import PDFService
-from app.schemas.pdf import PDFResponse, PDFListResponse
-from typing import List
+from app.api.deps import get_pdf_service, get_ingestion_queue, get_tenant_id
+from app.services.ingestion_service import IngestionQueue, QueueFullError
+from app.schemas.pdf import PDFResponse, PDFListResponse, IngestionJobResponse
+from typing import List, Literal, Optional
 from app.utils.logger import logger
 from app.utils.metrics import PerformanceMetrics
 
 router = APIRouter()
 
-@router.post("/upload", response_model=PDFResponse)
+@router.post("/upload", response_model=PDFResponse, status_code=202)
 @PerformanceMetrics.measure_time
-async def upload_pdf(file: UploadFile = File(...), pdf_service: PDFService = Depends()):
+async def upload_pdf(
+  response: Response,
+  file: UploadFile = File(...),
+  pdf_service: PDFService = Depends(get_pdf_service),
+  ingestion_queue: IngestionQueue = Depends(get_ingestion_queue),
+  tenant_id: str = Depends(get_tenant_id)
+):
   """
-  Upload a PDF file.
+  Upload a PDF file. The PDF is stored right away and processed in the background.
+  Uploading a file whose content is already stored returns the existing PDF's id with status 200.
 
-  - **file**: The PDF file to upload (max 30MB)
+  - **file**: The PDF file to upload (max 30MB, larger files are rejected with 413)
   
   Returns:
   - **id**: Unique identifier for the uploaded PDF
+  - **job_id**: Identifier of the ingestion job, see `GET /pdf/jobs/{job_id}`
   - **message**: Confirmation message
   """
   if not file.filename.endswith('.pdf'):
@@ -24,9 +34,23 @@ async def upload_pdf(file: UploadFile = File(...), pdf_service: PDFService = Dep
     raise HTTPException(status_code=400, detail="Only PDF files are allowed")
   
   try:
-    pdf_id = await pdf_service.process_pdf(file)
-    logger.info(f"Successfully uploaded PDF with ID: {pdf_id}")
-    return PDFResponse(id=pdf_id, message="PDF successfully uploaded and processed")
+    ingestion_queue.check_capacity(tenant_id)
+    upload = await pdf_service.save_upload(file, tenant_id)
+    if upload.duplicate:
+      response.status_code = 200
+      return PDFResponse(id=upload.pdf_id, message="PDF already uploaded")
+
+    try:
+      job = ingestion_queue.submit(upload.pdf_id, upload.file_path, tenant_id)
+    except QueueFullError:
+      pdf_service.discard_upload(upload.pdf_id)
+      raise
+    logger.info(f"Accepted PDF with ID: {upload.pdf_id} as ingestion job {job.id}")
+    return PDFResponse(id=upload.pdf_id, job_id=job.id, message="PDF accepted for processing")
+
+  except QueueFullError as qe:
+    logger.warning(f"Rejected upload for tenant {tenant_id}: {str(qe)}")
+    raise HTTPException(status_code=503, detail=str(qe), headers={"Retry-After": "30"})
   
   except HTTPException as he:
     # Re-raise HTTP exceptions
@@ -36,20 +60,69 @@ async def upload_pdf(file: UploadFile = File(...), pdf_service: PDFService = Dep
     logger.error(f"Error uploading PDF: {str(e)}")
     raise HTTPException(status_code=500, detail="An unexpected error occurred while processing the PDF")
 
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(job_id: str, ingestion_queue: IngestionQueue = Depends(get_ingestion_queue)):
+  """
+  Get the progress of a PDF ingestion job.
+
+  - **job_id**: The identifier returned by the upload endpoint
+
+  Returns the current stage (queued, extracting, chunking, embedding, indexed or failed)
+  and, while embedding, how many chunks of the total are done.
+  """
+  job = ingestion_queue.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Job not found")
+  return IngestionJobResponse(
+    job_id=job.id,
+    pdf_id=job.pdf_id,
+    stage=job.stage.value,
+    done=job.done,
+    total=job.total,
+    error=job.error,
+    created_at=job.created_at,
+    updated_at=job.updated_at
+  )
+
 @router.get("/list", response_model=List[PDFListResponse])
 @PerformanceMetrics.measure_time
-async def list_pdfs(pdf_service: PDFService = Depends()):
+async def list_pdfs(
+  response: Response,
+  limit: int = Query(100, ge=1, le=1000),
+  cursor: Optional[str] = None,
+  sort: Literal["created_at", "title", "author", "number_of_pages"] = "created_at",
+  order: Literal["asc", "desc"] = "asc",
+  title: Optional[str] = Query(None, max_length=512),
+  author: Optional[str] = Query(None, max_length=512),
+  min_pages: Optional[int] = Query(None, ge=0),
+  max_pages: Optional[int] = Query(None, ge=0),
+  pdf_service: PDFService = Depends(get_pdf_service)
+):
   """
-  List all uploaded PDFs.
+  List uploaded PDFs, one page at a time.
+
+  - **limit**: Maximum number of PDFs to return (default 100)
+  - **cursor**: Value of the `X-Next-Cursor` header from the previous page
+  - **sort**: created_at, title, author or number_of_pages
+  - **order**: asc or desc
+  - **title** / **author**: Case-insensitive prefix filters
+  - **min_pages** / **max_pages**: Page count range
 
   Returns a list of PDFs with their metadata:
   - **id**: Unique identifier of the PDF
   - **title**: Title of the PDF
   - **author**: Author of the PDF
   - **number_of_pages**: Number of pages in the PDF
+
+  When more PDFs match, the cursor of the next page is returned in the `X-Next-Cursor` header.
   """
   try:
-    pdfs = await pdf_service.list_pdfs()
+    pdfs, next_cursor = await pdf_service.list_pdfs(
+      limit=limit, cursor=cursor, sort=sort, order=order,
+      title=title, author=author, min_pages=min_pages, max_pages=max_pages
+    )
+    if next_cursor:
+      response.headers["X-Next-Cursor"] = next_cursor
     logger.info(f"Listed {len(pdfs)} PDFs")
     return pdfs
   
@@ -62,24 +135,118 @@ async def list_pdfs(pdf_service: PDFService = Depends()):
   
 @router.get("/{pdf_id}/text", response_model=str)
 @PerformanceMetrics.measure_time
-async def get_pdf_text(pdf_id: str, pdf_service: PDFService = Depends()):
+async def get_pdf_text(
+  pdf_id: str,
+  start_page: Optional[int] = Query(None, ge=1),
+  end_page: Optional[int] = Query(None, ge=1),
+  pdf_service: PDFService = Depends(get_pdf_service)
+):
   """
   Get the extracted text from a specific PDF.
 
   - **pdf_id**: The unique identifier of the PDF
+  - **start_page**: First page to return (1-based, optional)
+  - **end_page**: Last page to return, inclusive (optional)
 
-  Returns the full text content of the PDF.
+  Returns the text content of the PDF, or of the requested page range.
   """
   try:
-    return await pdf_service.get_pdf_text(pdf_id)
+    return await pdf_service.get_pdf_text(pdf_id, start_page, end_page)
   
   except HTTPException as he:
     # Re-raise HTTP exceptions
     raise he
-  except FileNotFoundError:
+  except FileNotFoundError as e:
     logger.error(f"PDF not found: {str(e)}")
     raise HTTPException(status_code=404, detail="PDF not found")
   
   except Exception as e:
     logger.error(f"Error retrieving text for PDF {pdf_id}: {str(e)}")
-    raise HTTPException(status_code=500, detail="An error occurred while retrieving PDF text")
\ No newline at end of file
+    raise HTTPException(status_code=500, detail="An error occurred while retrieving PDF text")
+
+@router.put("/{pdf_id}", response_model=PDFResponse, status_code=202)
+@PerformanceMetrics.measure_time
+async def replace_pdf(
+  pdf_id: str,
+  response: Response,
+  file: UploadFile = File(...),
+  pdf_service: PDFService = Depends(get_pdf_service),
+  ingestion_queue: IngestionQueue = Depends(get_ingestion_queue),
+  tenant_id: str = Depends(get_tenant_id)
+):
+  """
+  Replace a PDF with a new version and re-index it in the background.
+  Only chunks that changed are embedded again; unchanged content keeps its vectors.
+  Uploading identical content returns status 200 without starting a job.
+
+  - **pdf_id**: The unique identifier of the PDF
+  - **file**: The new version of the PDF file
+
+  Returns:
+  - **id**: The PDF's unchanged identifier
+  - **job_id**: Identifier of the re-indexing job, see `GET /pdf/jobs/{job_id}`
+  - **message**: Confirmation message
+  """
+  if not file.filename.endswith('.pdf'):
+    logger.warning(f"Attempted to upload non-PDF file: {file.filename}")
+    raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+  try:
+    if ingestion_queue.is_pending(pdf_id):
+      raise HTTPException(status_code=409, detail="PDF is still being processed")
+    ingestion_queue.check_capacity(tenant_id)
+    upload = await pdf_service.replace_upload(pdf_id, file, tenant_id)
+    if upload.duplicate:
+      response.status_code = 200
+      return PDFResponse(id=pdf_id, message="PDF content unchanged")
+
+    # Checked again after the upload arrived; nothing is awaited from here until the job is queued,
+    # so the stored PDF is only overwritten once its re-indexing job is certain to be accepted
+    try:
+      if ingestion_queue.is_pending(pdf_id):
+        raise HTTPException(status_code=409, detail="PDF is still being processed")
+      ingestion_queue.check_capacity(tenant_id)
+    except Exception:
+      pdf_service.discard_replacement(upload)
+      raise
+    file_path = pdf_service.commit_replacement(upload)
+    job = ingestion_queue.submit(pdf_id, file_path, tenant_id)
+    logger.info(f"Accepted new version of PDF {pdf_id} as ingestion job {job.id}")
+    return PDFResponse(id=pdf_id, job_id=job.id, message="PDF accepted for re-indexing")
+
+  except QueueFullError as qe:
+    logger.warning(f"Rejected replacement for tenant {tenant_id}: {str(qe)}")
+    raise HTTPException(status_code=503, detail=str(qe), headers={"Retry-After": "30"})
+
+  except HTTPException as he:
+    raise he
+
+  except Exception as e:
+    logger.error(f"Error replacing PDF {pdf_id}: {str(e)}")
+    raise HTTPException(status_code=500, detail="An unexpected error occurred while processing the PDF")
+
+@router.delete("/{pdf_id}", status_code=204)
+@PerformanceMetrics.measure_time
+async def delete_pdf(
+  pdf_id: str,
+  pdf_service: PDFService = Depends(get_pdf_service),
+  ingestion_queue: IngestionQueue = Depends(get_ingestion_queue),
+  tenant_id: str = Depends(get_tenant_id)
+):
+  """
+  Delete a PDF together with its extracted text, indexes and cached answers.
+
+  - **pdf_id**: The unique identifier of the PDF
+  """
+  try:
+    if ingestion_queue.is_pending(pdf_id):
+      raise HTTPException(status_code=409, detail="PDF is still being processed")
+    pdf_service.delete_pdf(pdf_id, tenant_id)
+    return Response(status_code=204)
+
+  except HTTPException as he:
+    raise he
+
+  except Exception as e:
+    logger.error(f"Error deleting PDF {pdf_id}: {str(e)}")
+    raise HTTPException(status_code=500, detail="An error occurred while deleting the PDF")
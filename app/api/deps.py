@@ -0,0 +1,44 @@
+from fastapi import Depends, Header, Request
+from app.core.container import ServiceContainer
+from app.services.langchain_gemini_service import LangchainGeminiService
+from app.services.pdf_service import PDFService
+from app.services.ingestion_service import IngestionQueue
+from app.services.llm_gateway import tenant_context
+
+async def get_container(request: Request) -> ServiceContainer:
+  """
+  Returns the process-wide service container. It is normally built by the
+  startup event; if that has not run (e.g. a TestClient used without a
+  context manager) it is built once here on first use.
+  """
+  container = getattr(request.app.state, "container", None)
+  if container is None:
+    container = ServiceContainer()
+    request.app.state.container = container
+  return container
+
+async def get_pdf_service(container: ServiceContainer = Depends(get_container)) -> PDFService:
+  return await container.aget("pdf_service")
+
+async def get_langchain_service(container: ServiceContainer = Depends(get_container)) -> LangchainGeminiService:
+  return await container.aget("langchain_service")
+
+async def get_ingestion_queue(container: ServiceContainer = Depends(get_container)) -> IngestionQueue:
+  return await container.aget("ingestion_queue")
+
+async def get_tenant_id(x_tenant_id: str = Header("default", max_length=64)) -> str:
+  """
+  Tenant the request acts for, taken from the X-Tenant-ID header. LLM calls
+  made for the request count against this tenant's concurrency limit.
+  """
+  tenant_context.set(x_tenant_id)
+  return x_tenant_id
+
+async def get_pdf_tenant_id(pdf_id: str, pdf_service: PDFService = Depends(get_pdf_service)) -> str:
+  """
+  Tenant that owns the PDF in the path. LLM calls made to answer questions
+  about one PDF count against its owner's concurrency limit.
+  """
+  tenant_id = pdf_service.tenant_of(pdf_id)
+  tenant_context.set(tenant_id)
+  return tenant_id
@@ -1,4 +1,5 @@
 import os
+from typing import Dict
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -8,8 +9,65 @@ class Settings(BaseSettings):
   PDF_STORAGE_DIR: str = os.path.join(os.getcwd(), "pdf_storage")
   LOG_LEVEL: str = "INFO"
   LOG_FILE: str = "app.log"
+  LOG_QUEUE_SIZE: int = 10000
+  LOG_MAX_MESSAGE_LENGTH: int = 2000
+  LOG_DEBUG_SAMPLE_RATE: float = 1.0
+  LOG_SAMPLE_RATES: Dict[str, float] = {}
   MAX_PDF_SIZE: int = 30 * 1024 * 1024
+  UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+  PDF_EXTRACT_WORKERS: int = os.cpu_count() or 1
+  PDF_EXTRACT_PAGES_PER_TASK: int = 32
+  CHUNK_SIZE: int = 1500
+  CHUNK_OVERLAP: int = 150
   FAISS_INDEX_PATH: str = os.path.join(os.getcwd(), "faiss_index")
+  FAISS_INDEX_CACHE_BYTES: int = 512 * 1024 * 1024
+  FAISS_INDEX_MMAP: bool = True
+  FAISS_INDEX_MODE: str = "flat"
+  FAISS_PQ_M: int = 96
+  FAISS_RERANK_FACTOR: int = 4
+  HYBRID_FETCH_K: int = 20
+  HYBRID_RRF_K: int = 60
+  CONTEXT_CANDIDATES: int = 12
+  CONTEXT_MAX_TOKENS: int = 2000
+  CONTEXT_MAX_CHUNKS: int = 8
+  CONTEXT_MIN_RELEVANCE: float = 0.3
+  CONTEXT_MMR_LAMBDA: float = 0.7
+  CONTEXT_DEDUP_SIMILARITY: float = 0.95
+  GLOBAL_INDEX_TYPE: str = "hnsw"
+  GLOBAL_INDEX_ANN_THRESHOLD: int = 20000
+  GLOBAL_INDEX_EXACT_SEARCH_LIMIT: int = 4096
+  GLOBAL_INDEX_HNSW_M: int = 32
+  GLOBAL_INDEX_HNSW_EF_SEARCH: int = 128
+  GLOBAL_INDEX_IVF_NPROBE: int = 16
+  GLOBAL_INDEX_CACHE_BYTES: int = 256 * 1024 * 1024
+  GLOBAL_INDEX_SAVE_DELAY: float = 2.0
+  GEMINI_API_BASE_URL: str = "https://generativelanguage.googleapis.com"
+  LLM_MAX_CONCURRENCY: int = 16
+  LLM_MAX_CONCURRENCY_PER_TENANT: int = 4
+  LLM_TIMEOUT: float = 120.0
+  LLM_CONNECT_TIMEOUT: float = 5.0
+  LLM_MAX_RETRIES: int = 3
+  LLM_RETRY_BACKOFF: float = 1.0
+  EMBEDDING_BATCH_SIZE: int = 100
+  EMBEDDING_MAX_CONCURRENCY: int = 4
+  EMBEDDING_MAX_RETRIES: int = 3
+  EMBEDDING_RETRY_BACKOFF: float = 1.0
+  EMBEDDING_CACHE_ENABLED: bool = True
+  EMBEDDING_CACHE_DIR: str = os.path.join(os.getcwd(), "embedding_cache")
+  INGEST_WORKERS: int = 2
+  INGEST_QUEUE_SIZE: int = 100
+  INGEST_MAX_PENDING_PER_TENANT: int = 20
+  INGEST_JOB_TTL: int = 3600
+  ANSWER_CACHE_MAXSIZE: int = 1000
+  ANSWER_CACHE_TTL: int = 600
+  ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.92
+  RATE_LIMIT_MAX_REQUESTS: int = 100
+  RATE_LIMIT_WINDOW: int = 60
+  RATE_LIMIT_BACKEND: str = "memory"
+  RATE_LIMIT_SQLITE_PATH: str = os.path.join(os.getcwd(), "pdf_storage", "rate_limit.db")
+  RATE_LIMIT_IDLE_TTL: int = 600
+  RATE_LIMIT_ROUTE_COSTS: Dict[str, int] = {"/api/v1/chat": 5, "/api/v1/pdf/upload": 2}
+  WARMUP_ON_STARTUP: bool = False
 
   model_config = SettingsConfigDict(env_file=".env")
 
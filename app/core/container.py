@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from app.core.config import settings
+from app.services.gemini_service import GeminiService
+from app.services.ingestion_service import IngestionQueue
+from app.services.langchain_gemini_service import LangchainGeminiService
+from app.services.llm_gateway import LLMGateway
+from app.services.pdf_service import PDFService
+from app.utils.lazy_import import resolve_all
+from app.utils.logger import logger
+from app.utils.startup import startup_report
+
+class ServiceContainer:
+    """
+    Application-scoped services. Built once per process and shared by every
+    request, so the LLM gateway's connection pool and limits, the embedding
+    client and the vectorstore cache are shared process-wide.
+
+    Services are built on first access rather than in the constructor, so a
+    worker is ready as soon as the app is imported; ``warm_up`` builds them
+    ahead of the first request instead.
+    """
+
+    SERVICES = ("llm_gateway", "langchain_service", "pdf_service", "gemini_service", "ingestion_queue")
+
+    def __init__(
+        self,
+        langchain_service: LangchainGeminiService = None,
+        pdf_service: PDFService = None,
+        gemini_service: GeminiService = None,
+        ingestion_queue: IngestionQueue = None,
+        llm_gateway: LLMGateway = None,
+    ):
+        self._services = {
+            name: service for name, service in (
+                ("llm_gateway", llm_gateway),
+                ("langchain_service", langchain_service),
+                ("pdf_service", pdf_service),
+                ("gemini_service", gemini_service),
+                ("ingestion_queue", ingestion_queue),
+            ) if service is not None
+        }
+        self._lock = threading.RLock()  # building the PDF service also builds the LangChain service
+        # Worker processes are only spawned on the first large PDF
+        self.extract_executor = ProcessPoolExecutor(max_workers=settings.PDF_EXTRACT_WORKERS) if settings.PDF_EXTRACT_WORKERS > 1 else None
+        logger.info("Service container initialized")
+
+    def _service(self, name: str, factory):
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    with startup_report.time_service(name):
+                        service = factory()
+                    self._services[name] = service
+        return service
+
+    def is_built(self, name: str) -> bool:
+        return name in self._services
+
+    async def aget(self, name: str):
+        """
+        Returns a service for use on the event loop, building it in a thread if
+        this is its first use, since building imports LangChain, FAISS and
+        SQLAlchemy and opens the catalog.
+        """
+        service = self._services.get(name)
+        if service is None:
+            service = await asyncio.to_thread(getattr, self, name)
+        return service
+
+    @property
+    def llm_gateway(self) -> LLMGateway:
+        return self._service("llm_gateway", LLMGateway)
+
+    @property
+    def langchain_service(self) -> LangchainGeminiService:
+        return self._service("langchain_service", lambda: LangchainGeminiService(gateway=self.llm_gateway))
+
+    @property
+    def pdf_service(self) -> PDFService:
+        return self._service("pdf_service", lambda: PDFService(self.langchain_service, self.extract_executor))
+
+    @property
+    def gemini_service(self) -> GeminiService:
+        return self._service("gemini_service", lambda: GeminiService(self.llm_gateway))
+
+    @property
+    def ingestion_queue(self) -> IngestionQueue:
+        return self._service("ingestion_queue", lambda: IngestionQueue(self.pdf_service))
+
+    def warm_up(self):
+        """
+        Imports the deferred modules and builds every service. Blocking; run it in a thread.
+        """
+        resolve_all()
+        for name in self.SERVICES:
+            getattr(self, name)
+        logger.info(f"Service container warmed up: {startup_report.as_dict()}")
+
+    async def shutdown(self):
+        if self.is_built("ingestion_queue"):
+            await self.ingestion_queue.stop()
+        if self.is_built("langchain_service"):
+            await asyncio.to_thread(self.langchain_service.global_index.flush)
+        if self.is_built("llm_gateway"):
+            await self.llm_gateway.aclose()
+        if self.extract_executor is not None:
+            self.extract_executor.shutdown(wait=False, cancel_futures=True)
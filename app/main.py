@@ -1,31 +1,69 @@
+import time
+_import_start = time.perf_counter()
+
+import asyncio
 import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.api.api_v1.api import api_router
 from app.core.config import settings
-from app.services.pdf_service import PDFService
-from app.services.gemini_service import GeminiService
+from app.core.container import ServiceContainer
 from app.middleware.timing import TimingMiddleware
 from app.middleware.rate_limit import RateLimitMiddleware
-from app.services.langchain_gemini_service import LangchainGeminiService
+from app.middleware.upload_limit import UploadSizeLimitMiddleware
 from app.middleware.error_handler import error_handler_middleware
+from app.utils.logger import logger
+from app.utils.metrics import INGEST_QUEUE_DEPTH, MetricsRegistry, registry
+from app.utils.startup import startup_report
+
+startup_report.record_import("app.main", time.perf_counter() - _import_start)
 
 app = FastAPI(
   title=settings.PROJECT_NAME,
   openapi_url=f"{settings.API_V1_STR}/openapi.json"
 )
 
+# Innermost, so the 413 raised while reading the body is not wrapped by the BaseHTTPMiddleware task groups
+app.add_middleware(UploadSizeLimitMiddleware)
 app.middleware("http")(error_handler_middleware)
 app.add_middleware(TimingMiddleware)
-app.add_middleware(RateLimitMiddleware, max_requests=100, window=60)
+app.add_middleware(RateLimitMiddleware, max_requests=settings.RATE_LIMIT_MAX_REQUESTS, window=settings.RATE_LIMIT_WINDOW)
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.on_event("startup")
 async def startup_event():
   os.makedirs(os.path.dirname(settings.FAISS_INDEX_PATH), exist_ok=True)
-  app.state.pdf_service = PDFService()
-  app.state.gemini_service = GeminiService()
-  app.state.langchain_service = LangchainGeminiService()
+  if getattr(app.state, "container", None) is None:
+    app.state.container = ServiceContainer()
+  # Services are built on first use; warming up builds them in the background so the worker is ready at once
+  if settings.WARMUP_ON_STARTUP:
+    app.state.warmup = asyncio.create_task(_warm_up(app.state.container))
+  startup_report.ready_seconds = time.perf_counter() - _import_start
+  logger.info(f"Startup report: {startup_report.as_dict()}")
+
+async def _warm_up(container: ServiceContainer):
+  try:
+    await asyncio.to_thread(container.warm_up)
+  except Exception as e:
+    logger.error(f"Warm-up failed, services will be built on first use: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+  container = getattr(app.state, "container", None)
+  if container is not None:
+    await container.shutdown()
 
 @app.get("/")
 async def root():
-  return {"message": "Welcome to PDF Chat API"}
\ No newline at end of file
+  return {"message": "Welcome to PDF Chat API"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+  container = getattr(app.state, "container", None)
+  if container is not None and container.is_built("ingestion_queue"):
+    INGEST_QUEUE_DEPTH.set(container.ingestion_queue.depth)
+  return PlainTextResponse(registry.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
+@app.get("/startup", include_in_schema=False)
+async def startup():
+  return startup_report.as_dict()
@@ -1,37 +1,42 @@
+import math
+from typing import Dict, Optional
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+from app.core.config import settings
 from app.utils.logger import logger
-from time import time
+from app.utils.rate_limiter import RateLimitBackend, create_rate_limit_backend
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    # max 100 request in 60 second
-    def __init__(self, app, max_requests: int = 100, window: int = 60):
+    # Token bucket per client: holds max_requests tokens and refills them over window seconds
+    def __init__(self, app, max_requests: int = 100, window: int = 60, backend: Optional[RateLimitBackend] = None, route_costs: Optional[Dict[str, int]] = None):
         super().__init__(app)
         self.max_requests = max_requests
         self.window = window
-        self.clients = {}
+        self.backend = backend or create_rate_limit_backend()
+        self.route_costs = settings.RATE_LIMIT_ROUTE_COSTS if route_costs is None else route_costs
+
+    def cost(self, path: str) -> int:
+        """
+        Tokens a request takes: the cost of the longest matching route prefix, or 1.
+        """
+        matches = [prefix for prefix in self.route_costs if path == prefix or path.startswith(prefix.rstrip("/") + "/")]
+        if not matches:
+            return 1
+        return min(self.route_costs[max(matches, key=len)], self.max_requests)
 
     async def dispatch(self, request: Request, call_next):
         client_ip = request.client.host
-        current_time = time()
-
-        if client_ip not in self.clients:
-            self.clients[client_ip] = []
+        retry_after = await self.backend.acquire(client_ip, self.cost(request.url.path), self.max_requests, self.max_requests / self.window)
 
-        request_times = self.clients[client_ip]
-        request_times = [t for t in request_times if current_time - t < self.window]
-
-        if len(request_times) >= self.max_requests:
+        if retry_after > 0:
             logger.warning(f"Rate limit exceeded for {client_ip}")
             return JSONResponse(
-                    status_code=429,
-                    content={"detail": "Too many requests"}
+                    status_code=HTTP_429_TOO_MANY_REQUESTS,
+                    content={"detail": "Too many requests"},
+                    headers={"Retry-After": str(math.ceil(retry_after))}
                 )
 
-        request_times.append(current_time)
-        self.clients[client_ip] = request_times
-
-        return await call_next(request)
\ No newline at end of file
+        return await call_next(request)
@@ -3,11 +3,15 @@ from starlette.requests import Request
 from starlette.responses import Response
 import time
 from app.utils.logger import logger
+from app.utils.metrics import HTTP_REQUEST_SECONDS
 
 class TimingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+        start_time = time.perf_counter()
         response = await call_next(request)
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
+        # Label by route template, not the raw path, so PDF ids don't create a series each
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(process_time, method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code)
         logger.info(f"Request: {request.url.path} completed in {process_time:.4f} seconds")
-        return response
\ No newline at end of file
+        return response
@@ -0,0 +1,48 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.utils.logger import logger
+
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects request bodies larger than MAX_PDF_SIZE while they arrive.
+
+    Starlette spools a multipart upload to a temporary file in full before
+    the endpoint runs, so the check in PDFService only bounds the handler's
+    own copy. This middleware answers 413 before reading anything when
+    Content-Length is too large, and counts the bytes of bodies sent
+    without it, stopping the read as soon as the limit is passed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = settings.MAX_PDF_SIZE + MULTIPART_OVERHEAD
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            logger.warning(f"Rejected request body of {int(content_length)} bytes to {scope['path']} before reading it")
+            await JSONResponse(status_code=413, content={"detail": "File too large"})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    logger.warning(f"Stopped reading request body to {scope['path']} after {received} bytes")
+                    # Raised inside body parsing, where FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,34 @@
+import time
+from typing import Optional
+from sqlalchemy import Float, Index, Integer, String
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class PDFDocument(Base):
+    """
+    Catalog entry for an uploaded PDF. Title and author use NOCASE collation so
+    that case-insensitive sorting and prefix filtering can use the indexes.
+    """
+    __tablename__ = "pdf_documents"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    tenant_id: Mapped[str] = mapped_column(String(64), default="default", index=True)
+    title: Mapped[str] = mapped_column(String(512, collation="NOCASE"), default="Unknown")
+    author: Mapped[str] = mapped_column(String(512, collation="NOCASE"), default="Unknown")
+    number_of_pages: Mapped[int] = mapped_column(Integer, default=0)
+    size_bytes: Mapped[int] = mapped_column(Integer, default=0)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[float] = mapped_column(Float, default=time.time)
+
+    __table_args__ = (
+        Index("ix_pdf_documents_title_id", "title", "id"),
+        Index("ix_pdf_documents_author_id", "author", "id"),
+        Index("ix_pdf_documents_pages_id", "number_of_pages", "id"),
+        Index("ix_pdf_documents_created_id", "created_at", "id"),
+        # Uploads are deduplicated within a tenant only
+        Index("ix_pdf_documents_tenant_hash", "tenant_id", "content_hash"),
+    )
@@ -1,11 +1,23 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class PDFResponse(BaseModel):
   id: str
   message: str
+  job_id: Optional[str] = None
 
 class PDFListResponse(BaseModel):
   id: str
   title: str
   author: str
-  number_of_pages: int
\ No newline at end of file
+  number_of_pages: int
+
+class IngestionJobResponse(BaseModel):
+  job_id: str
+  pdf_id: str
+  stage: str
+  done: int
+  total: int
+  error: Optional[str] = None
+  created_at: float
+  updated_at: float
@@ -0,0 +1,193 @@
+import base64
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, create_engine, delete, event, func, or_, select, update
+from sqlalchemy.orm import sessionmaker
+from app.core.config import settings
+from app.models.pdf import Base, PDFDocument
+from app.utils.logger import logger
+
+SORT_COLUMNS = {
+    "created_at": PDFDocument.created_at,
+    "title": PDFDocument.title,
+    "author": PDFDocument.author,
+    "number_of_pages": PDFDocument.number_of_pages,
+}
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not match the sort."""
+
+
+class PDFCatalog:
+    """
+    SQLite-backed catalog of uploaded PDFs.
+
+    Listing uses keyset pagination over (sort column, id) indexes, so the cost of
+    fetching a page does not depend on how many PDFs are stored or how deep
+    into the listing the cursor is.
+    """
+
+    def __init__(self, database_url: Optional[str] = None):
+        if database_url is None:
+            os.makedirs(settings.PDF_STORAGE_DIR, exist_ok=True)
+            database_url = f"sqlite:///{os.path.join(settings.PDF_STORAGE_DIR, 'catalog.db')}"
+        self.engine = create_engine(database_url)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _configure_sqlite)
+        Base.metadata.create_all(self.engine)
+        # create_all skips tables that exist; add indexes introduced since the catalog was created
+        for index in PDFDocument.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        self.Session = sessionmaker(self.engine, expire_on_commit=False)
+
+    def count(self) -> int:
+        with self.Session() as session:
+            return session.scalar(select(func.count()).select_from(PDFDocument))
+
+    def add(self, pdf_id: str, tenant_id: str = "default", content_hash: Optional[str] = None, size_bytes: int = 0, metadata: Optional[Dict] = None, created_at: Optional[float] = None):
+        metadata = metadata or {}
+        document = PDFDocument(
+            id=pdf_id,
+            tenant_id=tenant_id,
+            content_hash=content_hash,
+            size_bytes=size_bytes,
+            title=metadata.get("title", "Unknown"),
+            author=metadata.get("author", "Unknown"),
+            number_of_pages=metadata.get("number_of_pages", 0),
+        )
+        if created_at is not None:
+            document.created_at = created_at
+        with self.Session.begin() as session:
+            session.merge(document)
+
+    def update(self, pdf_id: str, **values):
+        with self.Session.begin() as session:
+            session.execute(update(PDFDocument).where(PDFDocument.id == pdf_id).values(**values))
+
+    def update_metadata(self, pdf_id: str, metadata: Dict):
+        self.update(
+            pdf_id,
+            title=metadata.get("title", "Unknown"),
+            author=metadata.get("author", "Unknown"),
+            number_of_pages=metadata.get("number_of_pages", 0),
+        )
+
+    def remove(self, pdf_id: str):
+        with self.Session.begin() as session:
+            session.execute(delete(PDFDocument).where(PDFDocument.id == pdf_id))
+
+    def get(self, pdf_id: str) -> Optional[PDFDocument]:
+        with self.Session() as session:
+            return session.get(PDFDocument, pdf_id)
+
+    def find_by_hash(self, content_hash: str, tenant_id: str = "default") -> Optional[str]:
+        with self.Session() as session:
+            return session.scalar(
+                select(PDFDocument.id).where(PDFDocument.tenant_id == tenant_id, PDFDocument.content_hash == content_hash).limit(1)
+            )
+
+    def list(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "asc",
+        title: Optional[str] = None,
+        author: Optional[str] = None,
+        min_pages: Optional[int] = None,
+        max_pages: Optional[int] = None,
+    ) -> Tuple[List[PDFDocument], Optional[str]]:
+        """
+        Returns one page of catalog entries and the cursor for the next page.
+
+        Args:
+            limit (int): Maximum number of entries to return.
+            cursor (Optional[str]): Cursor returned by the previous call, or None for the first page.
+            sort (str): One of created_at, title, author, number_of_pages.
+            order (str): asc or desc.
+            title (Optional[str]): Case-insensitive title prefix.
+            author (Optional[str]): Case-insensitive author prefix.
+            min_pages (Optional[int]): Minimum number of pages.
+            max_pages (Optional[int]): Maximum number of pages.
+
+        Returns:
+            Tuple[List[PDFDocument], Optional[str]]: The entries and the next cursor (None on the last page).
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort field: {sort}")
+        column = SORT_COLUMNS[sort]
+        descending = order == "desc"
+
+        query = select(PDFDocument)
+        if title:
+            query = query.where(PDFDocument.title.like(f"{_escape_like(title)}%", escape="\\"))
+        if author:
+            query = query.where(PDFDocument.author.like(f"{_escape_like(author)}%", escape="\\"))
+        if min_pages is not None:
+            query = query.where(PDFDocument.number_of_pages >= min_pages)
+        if max_pages is not None:
+            query = query.where(PDFDocument.number_of_pages <= max_pages)
+        if cursor:
+            value, last_id = _decode_cursor(cursor, sort)
+            if descending:
+                query = query.where(or_(column < value, and_(column == value, PDFDocument.id < last_id)))
+            else:
+                query = query.where(or_(column > value, and_(column == value, PDFDocument.id > last_id)))
+        if descending:
+            query = query.order_by(column.desc(), PDFDocument.id.desc())
+        else:
+            query = query.order_by(column.asc(), PDFDocument.id.asc())
+
+        with self.Session() as session:
+            documents = list(session.scalars(query.limit(limit + 1)))
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            last = documents[-1]
+            next_cursor = _encode_cursor(sort, getattr(last, sort), last.id)
+        return documents, next_cursor
+
+    def sync_from_storage(self, pdf_dir: str, text_store) -> int:
+        """
+        Adds catalog entries for PDFs already in storage, e.g. after upgrading an existing deployment.
+        """
+        added = 0
+        for filename in os.listdir(pdf_dir):
+            if not filename.endswith(".pdf"):
+                continue
+            pdf_id = filename[:-4]
+            if self.get(pdf_id) is not None:
+                continue
+            path = os.path.join(pdf_dir, filename)
+            self.add(pdf_id, size_bytes=os.path.getsize(path), metadata=text_store.load_metadata(pdf_id), created_at=os.path.getmtime(path))
+            added += 1
+        if added:
+            logger.info(f"Added {added} existing PDFs to the catalog")
+        return added
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _encode_cursor(sort: str, value, pdf_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, value, pdf_id]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, sort: str):
+    try:
+        cursor_sort, value, pdf_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise InvalidCursorError("Invalid cursor")
+    if cursor_sort != sort:
+        raise InvalidCursorError("Cursor does not match the requested sort")
+    return value, pdf_id
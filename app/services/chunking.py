@@ -0,0 +1,89 @@
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+from app.core.config import settings
+from app.utils.lazy_import import LazyImport
+
+RecursiveCharacterTextSplitter = LazyImport("langchain_text_splitters", "RecursiveCharacterTextSplitter")
+
+# Split before heading lines first, e.g. "# Scope", "4.2 Payment terms", "Section 7", "TERMINATION"
+HEADING_SEPARATOR = r"\n(?=#{1,6}\s|(?i:section|chapter|article|part)\s+\d|\d+(?:\.\d+)*\.?\s+[A-Z]|[A-Z][A-Z0-9 ,;:'&-]{3,}\n)"
+SEPARATORS = [HEADING_SEPARATOR, r"\n\n", r"\n", r"(?<=[.!?])\s+", r"\s", ""]
+PAGE_BREAK = "\n"
+
+
+class Chunk(NamedTuple):
+    text: str
+    page: int  # 1-based page number
+    start: int  # character offset of the chunk within its page
+    end: int  # character offset of the chunk's end within end_page
+    end_page: Optional[int] = None  # set when the chunk continues onto the next page
+
+    @property
+    def last_page(self) -> int:
+        return self.end_page or self.page
+
+
+def create_text_splitter(chunk_size: int = None, chunk_overlap: int = None) -> RecursiveCharacterTextSplitter:
+    """
+    Recursive splitter that prefers heading, paragraph, line and sentence boundaries, in that order.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size or settings.CHUNK_SIZE,
+        chunk_overlap=settings.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap,
+        separators=SEPARATORS,
+        is_separator_regex=True,
+    )
+
+
+class PageChunker:
+    """
+    Splits PDF text into chunks one page at a time.
+
+    Chunks normally end at a page break, so most chunks have one page to
+    cite and overlap is only repeated within a page. When the last piece of
+    a page is shorter than ``min_chunk_size`` (e.g. a paragraph that runs on
+    to the next page) it is carried over and prepended to the next page's
+    first chunk, which is cut short to make room; that chunk then cites
+    both pages. Pages are consumed and chunks produced lazily, so the text of a
+    long document never has to be held in memory at once.
+    """
+
+    def __init__(self, splitter: RecursiveCharacterTextSplitter = None, min_chunk_size: Optional[int] = None):
+        self.splitter = splitter or create_text_splitter()
+        self.min_chunk_size = self.splitter._chunk_size // 4 if min_chunk_size is None else min_chunk_size
+
+    def iter_chunks(self, pages: Iterable[str]) -> Iterator[Chunk]:
+        """
+        Yields the chunks of each page in order, with their page numbers and character offsets.
+        """
+        carry: Optional[Chunk] = None
+        for number, page in enumerate(pages, start=1):
+            chunks, head = [], None
+            if carry is not None:
+                # Split the page's first piece small enough to share a chunk with the carried piece; splitting both
+                # together would cut at the page break again whenever the page is longer than a chunk
+                budget = self.splitter._chunk_size - len(carry.text) - len(PAGE_BREAK)
+                head = next(self._split(page[:self.splitter._chunk_size], create_text_splitter(budget, 0)), None) if budget > 0 else None
+                if head is None:
+                    yield carry
+                else:
+                    piece, _, end = head
+                    chunks.append(Chunk(f"{carry.text}{PAGE_BREAK}{piece}", carry.page, carry.start, end, number))
+            offset = head[2] if head else 0
+            chunks.extend(Chunk(piece, number, offset + start, offset + end) for piece, start, end in self._split(page[offset:]))
+            carry = None
+            if chunks and chunks[-1].end_page is None and len(chunks[-1].text) < self.min_chunk_size:
+                carry = chunks.pop()
+            yield from chunks
+        if carry is not None:
+            yield carry
+
+    def _split(self, text: str, splitter: RecursiveCharacterTextSplitter = None) -> Iterator[Tuple[str, int, int]]:
+        splitter = splitter or self.splitter
+        position = 0
+        for piece in splitter.split_text(text):
+            # Chunks are stripped substrings of the text; look for each one after the previous chunk's overlap
+            start = text.find(piece, max(0, position - splitter._chunk_overlap))
+            if start < 0:
+                start = position
+            position = start + len(piece)
+            yield piece, start, position
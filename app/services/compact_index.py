@@ -0,0 +1,206 @@
+import mmap
+import os
+from collections.abc import Mapping
+from typing import Iterator, List, Optional, Sequence, Union
+import faiss
+import numpy as np
+import orjson
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from app.core.config import settings
+
+INDEX_FILE = "index.faiss"
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.offsets.npy"
+COMPACT_FILES = (VECTORS_FILE, CHUNKS_FILE, OFFSETS_FILE)
+COMPACT_MODES = ("sq8", "pq")
+
+
+class ChunkStore(Docstore):
+    """
+    Read-only docstore over chunks stored on disk.
+
+    Every chunk is one JSON record in ``chunks.bin``; a memory-mapped array
+    of byte offsets locates record i, so a lookup reads just that record and
+    no chunk text is kept in Python objects. Document ids are index positions.
+    """
+
+    def __init__(self, path: str):
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(path, CHUNKS_FILE), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            position = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        record = orjson.loads(self._data[int(self.offsets[position]):int(self.offsets[position + 1])])
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    @staticmethod
+    def write(path: str, documents: Sequence[Document]):
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        with open(os.path.join(path, f"{CHUNKS_FILE}.tmp"), "wb") as f:
+            for i, doc in enumerate(documents):
+                record = orjson.dumps({"text": doc.page_content, "metadata": doc.metadata})
+                f.write(record)
+                offsets[i + 1] = offsets[i] + len(record)
+        with open(os.path.join(path, f"{OFFSETS_FILE}.tmp"), "wb") as f:
+            np.save(f, offsets)
+
+
+class PositionIds(Mapping):
+    """
+    The identity mapping from index position to docstore id, without a dict entry per chunk.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __getitem__(self, position) -> str:
+        position = int(position)
+        if not 0 <= position < self.count:
+            raise KeyError(position)
+        return str(position)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class CompactIndex:
+    """
+    Quantized FAISS index (int8 scalar or product quantization) with an
+    optional exact re-ranking pass.
+
+    The index holds one small code per chunk in memory. The float32 vectors
+    stay on disk in a memory-mapped array: a search fetches ``rerank_factor``
+    times k candidates from the codes and re-orders them by exact distance,
+    reading only the candidates' rows. Provides the parts of the ``faiss.Index``
+    interface the vectorstore and the retrieval code use.
+    """
+
+    def __init__(self, index: faiss.Index, vectors: Optional[np.ndarray] = None, rerank_factor: Optional[int] = None):
+        self.index = index
+        self.vectors = vectors
+        self.rerank_factor = settings.FAISS_RERANK_FACTOR if rerank_factor is None else rerank_factor
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.sa_code_size() * self.index.ntotal
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        x = np.asarray(x, dtype=np.float32)
+        if self.vectors is None or self.rerank_factor <= 1:
+            return self.index.search(x, k)
+        _, candidates = self.index.search(x, k * self.rerank_factor)
+        distances = np.full((len(x), k), np.finfo(np.float32).max, dtype=np.float32)
+        positions = np.full((len(x), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(x, candidates)):
+            found = np.sort(found[found >= 0])
+            exact = ((np.asarray(self.vectors[found]) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(order)] = exact[order]
+            positions[row, :len(order)] = found[order]
+        return distances, positions
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return self.reconstruct_batch(np.array([position], dtype=np.int64))[0]
+
+    def reconstruct_batch(self, positions: np.ndarray) -> np.ndarray:
+        if self.vectors is None:
+            return self.index.reconstruct_batch(positions)
+        return np.asarray(self.vectors[np.asarray(positions, dtype=np.int64)], dtype=np.float32)
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        if self.vectors is None:
+            return self.index.reconstruct_n(start, count)
+        return np.array(self.vectors[start:start + count], dtype=np.float32)
+
+
+def build_quantized_index(vectors: np.ndarray, mode: str) -> faiss.Index:
+    """
+    Trains an int8 scalar ("sq8") or product ("pq") quantizer on the vectors and adds them.
+
+    Product quantization splits each vector into ``FAISS_PQ_M`` sub-vectors
+    (the largest divisor of the dimension not above it) with up to 256
+    centroids each; PDFs with too few chunks to train it use int8 instead.
+    """
+    count, dimension = vectors.shape
+    if mode == "pq" and count >= 2 ** 4:
+        m = max(divisor for divisor in range(1, min(settings.FAISS_PQ_M, dimension) + 1) if dimension % divisor == 0)
+        nbits = min(8, int(np.log2(count)))
+        index = faiss.IndexPQ(dimension, m, nbits)
+    elif mode in COMPACT_MODES:
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+    else:
+        raise ValueError(f"Unsupported compact index mode: {mode}")
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def write_compact(path: str, vectorstore, mode: str):
+    """
+    Writes a vectorstore in compact form: the quantized index, the float32
+    vectors and the on-disk chunk store, in index position order.
+
+    Files are written next to the old ones and swapped in with ``os.replace``,
+    so a loaded copy that still maps the old files keeps working.
+    """
+    index = vectorstore.index
+    vectors = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+    documents = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in range(index.ntotal)]
+    os.makedirs(path, exist_ok=True)
+    ChunkStore.write(path, documents)
+    with open(os.path.join(path, f"{VECTORS_FILE}.tmp"), "wb") as f:
+        np.save(f, vectors)
+    faiss.write_index(build_quantized_index(vectors, mode), os.path.join(path, f"{INDEX_FILE}.tmp"))
+    for name in COMPACT_FILES + (INDEX_FILE,):
+        os.replace(os.path.join(path, f"{name}.tmp"), os.path.join(path, name))
+
+
+def is_compact(path: str) -> bool:
+    return os.path.exists(os.path.join(path, CHUNKS_FILE))
+
+
+def load_compact(path: str, embeddings) -> FAISS:
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    docstore = ChunkStore(path)
+    return FAISS(embeddings, CompactIndex(index, vectors), docstore, PositionIds(len(docstore)))
+
+
+def thaw(vectorstore, embeddings) -> FAISS:
+    """
+    Returns an editable flat copy of a compact vectorstore, for adding and
+    removing chunks; other vectorstores are returned unchanged.
+    """
+    if not isinstance(vectorstore.index, CompactIndex):
+        return vectorstore
+    count = vectorstore.index.ntotal
+    index = faiss.IndexFlatL2(vectorstore.index.d)
+    if count:
+        index.add(vectorstore.index.reconstruct_n(0, count))
+    ids: List[str] = [str(i) for i in range(count)]
+    docstore = InMemoryDocstore({id_: vectorstore.docstore.search(id_) for id_ in ids})
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
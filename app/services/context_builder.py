@@ -0,0 +1,129 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence
+from app.core.config import settings
+from app.utils.lazy_import import LazyImport
+from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+Document = LazyImport("langchain_core.documents", "Document")
+np = LazyImport("numpy")
+
+SEPARATOR = "\n\n"
+
+
+class PackedContext(NamedTuple):
+    documents: List[Document]
+    scores: List[float]
+    text: str
+    tokens: int
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks into the prompt context under a token budget.
+
+    Candidates whose relevance is below ``min_relevance`` are dropped, as
+    are exact duplicates. Relevance is the score relative to the best one
+    unless the caller supplies a calibrated value, as hybrid retrieval does
+    because fused rank scores barely differ between a strong and a weak match. The rest are picked by maximal marginal
+    relevance (MMR), so a chunk that repeats one already picked gives way to
+    one that adds something new, until ``max_tokens`` or ``max_chunks`` is
+    reached. The number of chunks therefore adapts to their size and
+    relevance instead of being a fixed k.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_chunks: Optional[int] = None, min_relevance: Optional[float] = None, mmr_lambda: Optional[float] = None, dedup_similarity: Optional[float] = None):
+        self.max_tokens = max_tokens or settings.CONTEXT_MAX_TOKENS
+        self.max_chunks = max_chunks or settings.CONTEXT_MAX_CHUNKS
+        self.min_relevance = settings.CONTEXT_MIN_RELEVANCE if min_relevance is None else min_relevance
+        self.mmr_lambda = settings.CONTEXT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.dedup_similarity = settings.CONTEXT_DEDUP_SIMILARITY if dedup_similarity is None else dedup_similarity
+
+    def pack(self, documents: Sequence[Document], scores: Sequence[float], vectors: Optional["np.ndarray"] = None, relevance: Optional[Sequence[float]] = None) -> PackedContext:
+        """
+        Selects and joins the chunks for one prompt.
+
+        Args:
+            documents (Sequence[Document]): Candidate chunks.
+            scores (Sequence[float]): Their relevance scores, higher is better.
+            vectors (Optional[np.ndarray]): Their embeddings, used for MMR and near-duplicate detection.
+            relevance (Optional[Sequence[float]]): Calibrated relevance of each candidate in [0, 1], compared with ``min_relevance`` instead of the relative score.
+
+        Returns:
+            PackedContext: The picked chunks in retrieval order, their scores, the context text and its estimated token count.
+        """
+        if not documents:
+            return PackedContext([], [], "", 0)
+        ranking = np.asarray(scores, dtype=np.float32)
+        best = ranking.max()
+        ranking = ranking / best if best > 0 else np.ones_like(ranking)
+        relevance = ranking if relevance is None else np.asarray(relevance, dtype=np.float32)
+
+        remaining = []
+        seen = set()
+        for i, doc in enumerate(documents):
+            key = doc.metadata.get("chunk_hash") or doc.page_content
+            if key not in seen and relevance[i] >= self.min_relevance:
+                seen.add(key)
+                remaining.append(i)
+
+        similarity = None
+        if vectors is not None and len(vectors):
+            unit = np.asarray(vectors, dtype=np.float32)
+            unit = unit / np.maximum(np.linalg.norm(unit, axis=1, keepdims=True), 1e-12)
+            similarity = unit @ unit.T
+        redundancy = np.zeros(len(documents), dtype=np.float32)  # highest similarity to a picked chunk
+
+        picked: Dict[int, str] = {}
+        used = 0
+        while remaining and len(picked) < self.max_chunks:
+            mmr = self.mmr_lambda * ranking[remaining] - (1 - self.mmr_lambda) * redundancy[remaining]
+            i = remaining.pop(int(np.argmax(mmr)))
+            if redundancy[i] >= self.dedup_similarity:
+                continue
+            text = documents[i].page_content
+            tokens = estimate_tokens(text)
+            if used + tokens > self.max_tokens:
+                if picked:
+                    continue
+                text = truncate_to_tokens(text, self.max_tokens)
+                tokens = estimate_tokens(text)
+            picked[i] = text
+            used += tokens
+            if similarity is not None:
+                redundancy = np.maximum(redundancy, similarity[i])
+
+        order = sorted(picked)
+        packed = [
+            documents[i] if picked[i] is documents[i].page_content else Document(page_content=picked[i], metadata=documents[i].metadata)
+            for i in order
+        ]
+        return PackedContext(packed, [float(scores[i]) for i in order], SEPARATOR.join(picked[i] for i in order), used)
+
+
+def hybrid_relevance(query_vector: Sequence[float], vectors: "np.ndarray", keyword_scores: Sequence[float]) -> "np.ndarray":
+    """
+    Calibrates the relevance of hybrid retrieval candidates from their underlying signals.
+
+    Each candidate is rated by its cosine similarity to the question and by
+    its BM25 score, each relative to the best candidate on that signal, and
+    keeps the better of the two. A chunk that only made the fused list by
+    ranking low on both signals therefore rates low, whatever its fused score.
+
+    Args:
+        query_vector (Sequence[float]): The question's embedding.
+        vectors (np.ndarray): The candidates' embeddings.
+        keyword_scores (Sequence[float]): The candidates' BM25 scores, 0 if the keyword search did not return them.
+
+    Returns:
+        np.ndarray: Relevance of each candidate in [0, 1].
+    """
+    query = np.asarray(query_vector, dtype=np.float32)
+    unit = np.asarray(vectors, dtype=np.float32)
+    cosine = unit @ query / np.maximum(np.linalg.norm(unit, axis=1) * np.linalg.norm(query), 1e-12)
+    dense = np.maximum(cosine, 0)
+    lexical = np.asarray(keyword_scores, dtype=np.float32)
+    return np.maximum(_relative(dense), _relative(lexical))
+
+
+def _relative(values: "np.ndarray") -> "np.ndarray":
+    best = values.max() if len(values) else 0
+    return values / best if best > 0 else np.zeros_like(values)
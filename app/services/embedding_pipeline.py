@@ -0,0 +1,129 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.utils.logger import logger
+from app.utils.embedding_cache import EmbeddingCache
+from app.utils.metrics import EMBEDDED_TEXTS, EMBEDDING_BATCH_SECONDS
+
+EmbeddedBatch = Tuple[int, List[str], List[List[float]]]
+
+
+class EmbeddingPipeline:
+    """
+    Embeds text chunks in batches with a bounded number of batches in flight.
+
+    Each batch goes through the embeddings' ``aembed_documents``, which runs
+    blocking clients in an executor so the event loop stays free. Failed
+    batches are retried with jittered exponential backoff. When a cache is
+    given, only chunks missing from it are sent to the embeddings.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max_concurrency or settings.EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = settings.EMBEDDING_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+
+    async def embed(self, texts: Iterable[str]) -> List[List[float]]:
+        """
+        Embeds all texts and returns the vectors in input order.
+        """
+        results = {}
+        async for start, _, vectors in self.iter_batches(texts):
+            results[start] = vectors
+        return [vector for start in sorted(results) for vector in results[start]]
+
+    async def iter_batches(self, texts: Iterable[str], ordered: bool = False) -> AsyncIterator[EmbeddedBatch]:
+        """
+        Yields ``(start, texts, vectors)`` for each batch as soon as it is embedded.
+
+        Batches complete out of order; ``start`` is the position of the batch's
+        first text in the input. Input is consumed lazily, so at most
+        ``max_concurrency`` batches are held in memory at once.
+
+        Args:
+            texts (Iterable[str]): The chunks to embed.
+            ordered (bool): Yield batches in input order instead. Batches that
+                finish early wait for the ones before them and still count
+                against ``max_concurrency``.
+
+        Yields:
+            EmbeddedBatch: The batch offset, its texts and their vectors.
+        """
+        batches = self._batched(texts)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < self.max_concurrency:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    pending.append(asyncio.ensure_future(self._embed_batch(*batch)))
+                if not pending:
+                    return
+                if ordered:
+                    yield await pending.popleft()
+                    continue
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _batched(self, texts: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+        batch = []
+        start = 0
+        for text in texts:
+            batch.append(text)
+            if len(batch) == self.batch_size:
+                yield start, batch
+                start += len(batch)
+                batch = []
+        if batch:
+            yield start, batch
+
+    async def _embed_batch(self, start: int, texts: List[str]) -> EmbeddedBatch:
+        # The cache reads a memory map and appends to a file; keep that off the event loop
+        vectors = await asyncio.to_thread(self.cache.get_many, texts) if self.cache is not None else [None] * len(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fresh = await self._embed_with_retry(start, missing_texts)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put_many, missing_texts, fresh)
+        return start, texts, vectors
+
+    async def _embed_with_retry(self, start: int, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                start_time = time.perf_counter()
+                vectors = await self.embeddings.aembed_documents(texts)
+                EMBEDDING_BATCH_SECONDS.observe(time.perf_counter() - start_time)
+                EMBEDDED_TEXTS.inc(len(texts))
+                return vectors
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Embedding batch at offset {start} failed after {attempt + 1} attempts: {str(e)}")
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Embedding batch at offset {start} failed ({str(e)}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
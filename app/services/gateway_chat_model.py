@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.services.llm_gateway import Generation
+
+
+def _usage(generation: Generation) -> Dict[str, int]:
+    return {
+        "input_tokens": generation.input_tokens,
+        "output_tokens": generation.output_tokens,
+        "total_tokens": generation.input_tokens + generation.output_tokens,
+    }
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    LangChain chat model for Gemini that sends every call through the shared
+    ``LLMGateway``, so chains get its connection pool, concurrency limits and retries.
+    """
+
+    gateway: Any
+    model: str = "gemini-1.5-flash"
+    temperature: Optional[float] = None
+    max_output_tokens: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "gemini-gateway"
+
+    def _request(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Dict[str, Any]:
+        system = "\n".join(str(message.content) for message in messages if message.type == "system")
+        contents = [
+            {"role": "model" if message.type == "ai" else "user", "parts": [{"text": str(message.content)}]}
+            for message in messages if message.type != "system"
+        ]
+        config = {"temperature": self.temperature, "maxOutputTokens": self.max_output_tokens, "stopSequences": stop}
+        return {
+            "model": self.model,
+            "contents": contents,
+            "system_instruction": system or None,
+            "generation_config": {name: value for name, value in config.items() if value is not None},
+        }
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        generation = await self.gateway.generate(**self._request(messages, stop))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=generation.text, usage_metadata=_usage(generation)))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        # Only for synchronous callers outside an event loop; the app uses the async API
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._generate_once(messages, stop))
+        raise RuntimeError("GatewayChatModel cannot be invoked synchronously from a running event loop; use ainvoke or astream")
+
+    async def _generate_once(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> ChatResult:
+        try:
+            return await self._agenerate(messages, stop)
+        finally:
+            # The pool belongs to this short-lived loop; close it before the loop goes away
+            await self.gateway.aclose()
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        last = None
+        async for generation in self.gateway.stream(**self._request(messages, stop)):
+            last = generation
+            if generation.text:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=generation.text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(generation.text, chunk=chunk)
+                yield chunk
+        if last is not None:
+            # Gemini reports cumulative usage on every chunk; attach the final count once
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=_usage(last)))
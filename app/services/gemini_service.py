@@ -1,11 +1,11 @@
-import google.generativeai as genai
-from app.core.config import settings
+from typing import Optional
+from app.services.llm_gateway import LLMGateway
 from app.utils.logger import logger
 
 class GeminiService:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
+    def __init__(self, gateway: Optional[LLMGateway] = None, model: str = "gemini-1.5-flash"):
+        self.gateway = gateway or LLMGateway()
+        self.model = model
 
 
     async def generate_response(self, prompt: str) -> str:
@@ -22,7 +22,7 @@ class GeminiService:
             Exception: If there's an error in API communication.
         """
         try:
-            response = self.model.generate_content(prompt)
+            response = await self.gateway.generate(self.model, prompt)
             return response.text
         except Exception as e:
             logger.error(f"Error in Gemini API communication: {str(e)}")
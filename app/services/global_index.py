@@ -0,0 +1,502 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import logger
+from app.utils.metrics import RETRIEVAL_SECONDS
+
+Document = LazyImport("langchain_core.documents", "Document")
+faiss = LazyImport("faiss")
+np = LazyImport("numpy")
+
+INDEX_NAME = "index"
+CURRENT = "CURRENT"
+# Share of an HNSW shard that may be deleted-but-still-linked before it is compacted
+COMPACT_FRACTION = 0.25
+
+
+class IndexShard:
+    """
+    One tenant's slice of the global index: a FAISS index plus the chunk
+    stored under each of its ids.
+
+    Every chunk gets a stable int64 id, so a PDF's chunks are replaced or
+    removed by id without touching the rest of the shard. Flat and IVF
+    indexes delete in place; HNSW graphs cannot, so their deleted ids are
+    filtered out of searches and the graph is compacted once they make up a
+    quarter of it. The shard starts as an exact flat index and is rebuilt
+    as HNSW or IVF once, when it grows past ``ann_threshold`` vectors. Chunks
+    are grouped by their ``source`` metadata so a search can be restricted
+    to a set of PDFs.
+    """
+
+    def __init__(
+        self,
+        index: Optional["faiss.Index"] = None,
+        documents: Optional[Dict[int, Document]] = None,
+        next_id: int = 0,
+        deleted: Optional[Iterable[int]] = None,
+        ann_threshold: Optional[int] = None,
+        index_type: Optional[str] = None,
+    ):
+        self.index = index
+        self.documents: Dict[int, Document] = documents or {}
+        self.next_id = next_id
+        self.deleted: Set[int] = set(deleted or ())
+        self.ann_threshold = settings.GLOBAL_INDEX_ANN_THRESHOLD if ann_threshold is None else ann_threshold
+        self.index_type = index_type or settings.GLOBAL_INDEX_TYPE
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.ids: Dict[str, List[int]] = {}
+        self.text_bytes = 0
+        for chunk_id, doc in self.documents.items():
+            self.ids.setdefault(_source(doc), []).append(chunk_id)
+            self.text_bytes += len(doc.page_content)
+        # Sources whose chunks changed since the last save; the others are linked from the previous version
+        self.changed: Set[str] = set()
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __contains__(self, source: str) -> bool:
+        return source in self.ids
+
+    @property
+    def base_index(self) -> Optional["faiss.Index"]:
+        if isinstance(self.index, faiss.IndexIDMap2):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+
+    @property
+    def is_exact(self) -> bool:
+        return self.index is None or isinstance(self.base_index, faiss.IndexFlat)
+
+    @property
+    def nbytes(self) -> int:
+        vectors = int(self.index.ntotal) * int(self.index.d) * 4 if self.index is not None else 0
+        return vectors + self.text_bytes
+
+    def add(self, source: str, documents: List[Document], vectors: "np.ndarray"):
+        """
+        Replaces the chunks of one source with new ones.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if source in self.ids:
+                self._delete(source)
+            ids = np.arange(self.next_id, self.next_id + len(documents), dtype=np.int64)
+            self.next_id += len(documents)
+            if self.index is None:
+                self.index = _build_index(np.zeros((0, vectors.shape[1]), dtype=np.float32), ids[:0], vectors.shape[1], self.ann_threshold, self.index_type)
+            self.index.add_with_ids(vectors, ids)
+            for chunk_id, doc in zip(ids.tolist(), documents):
+                self.documents[chunk_id] = doc
+                self.text_bytes += len(doc.page_content)
+            self.ids[source] = ids.tolist()
+            self.changed.add(source)
+            self.dirty = True
+            if self.is_exact and len(self.documents) > self.ann_threshold:
+                self._rebuild()
+            elif len(self.deleted) > COMPACT_FRACTION * self.index.ntotal:
+                self._rebuild()
+
+    def remove(self, source: str) -> bool:
+        with self.lock:
+            if source not in self.ids:
+                return False
+            self._delete(source)
+            self.changed.add(source)
+            self.dirty = True
+            if len(self.deleted) > COMPACT_FRACTION * self.index.ntotal:
+                self._rebuild()
+            return True
+
+    def search(self, vector: "np.ndarray", k: int, sources: Optional[Iterable[str]] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns the k closest chunks, optionally only among the given sources.
+
+        Small selections are scored exactly against their own vectors, since
+        filtered approximate search can miss them entirely; larger ones go
+        through the index with an ID selector.
+        """
+        with self.lock:
+            distances, ids = self._search(vector, k, sources)
+            return [(self.documents[i], float(d)) for d, i in zip(distances, ids)]
+
+    def search_with_vectors(self, vector: "np.ndarray", k: int, sources: Optional[Iterable[str]] = None) -> Tuple[List[Tuple[Document, float]], "np.ndarray"]:
+        """
+        Like ``search``, also returning the stored vector of every result.
+        """
+        with self.lock:
+            distances, ids = self._search(vector, k, sources)
+            vectors = self.index.reconstruct_batch(ids) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+            return [(self.documents[i], float(d)) for d, i in zip(distances, ids)], vectors
+
+    def _search(self, vector: "np.ndarray", k: int, sources: Optional[Iterable[str]]) -> Tuple["np.ndarray", "np.ndarray"]:
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        if self.index is None or not self.documents:
+            return self._valid(np.zeros(0), np.zeros(0, dtype=np.int64))
+        if sources is None:
+            if not self.deleted:
+                distances, ids = self.index.search(query, k, params=self._search_params())
+                return self._valid(distances[0], ids[0])
+            deleted = faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype=np.int64))
+            distances, ids = self.index.search(query, k, params=self._search_params(faiss.IDSelectorNot(deleted)))
+            return self._valid(distances[0], ids[0])
+
+        selected = np.array(sorted(i for source in set(sources) for i in self.ids.get(source, [])), dtype=np.int64)
+        if len(selected) == 0:
+            return self._valid(np.zeros(0), selected)
+        if not self.is_exact and len(selected) <= settings.GLOBAL_INDEX_EXACT_SEARCH_LIMIT:
+            distances = ((self.index.reconstruct_batch(selected) - query) ** 2).sum(axis=1)
+            order = np.argsort(distances)[:k]
+            return self._valid(distances[order], selected[order])
+        distances, ids = self.index.search(query, k, params=self._search_params(faiss.IDSelectorBatch(selected)))
+        return self._valid(distances[0], ids[0])
+
+    @staticmethod
+    def _valid(distances: "np.ndarray", ids: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        keep = ids >= 0
+        return distances[keep], ids[keep].astype(np.int64)
+
+    def _search_params(self, selector=None):
+        base = self.base_index
+        if isinstance(base, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=settings.GLOBAL_INDEX_HNSW_EF_SEARCH)
+        if isinstance(base, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=settings.GLOBAL_INDEX_IVF_NPROBE)
+        return faiss.SearchParameters(sel=selector)
+
+    def _delete(self, source: str):
+        ids = self.ids.pop(source)
+        for chunk_id in ids:
+            self.text_bytes -= len(self.documents.pop(chunk_id).page_content)
+        if isinstance(self.base_index, faiss.IndexHNSW):
+            self.deleted.update(ids)
+        else:
+            self.index.remove_ids(faiss.IDSelectorArray(np.array(ids, dtype=np.int64)))
+
+    def _rebuild(self):
+        ids = np.array(sorted(self.documents), dtype=np.int64)
+        vectors = self.index.reconstruct_batch(ids) if len(ids) else np.zeros((0, self.index.d), dtype=np.float32)
+        self.index = _build_index(vectors, ids, self.index.d, self.ann_threshold, self.index_type)
+        self.deleted = set()
+
+
+def _source(doc: Document) -> str:
+    return doc.metadata.get("source", "Unknown")
+
+
+def _build_index(vectors: "np.ndarray", ids: "np.ndarray", dimension: int, ann_threshold: int, index_type: str) -> "faiss.Index":
+    count = len(vectors)
+    if count <= ann_threshold:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, settings.GLOBAL_INDEX_HNSW_M)
+        hnsw.hnsw.efConstruction = 2 * settings.GLOBAL_INDEX_HNSW_M
+        index = faiss.IndexIDMap2(hnsw)
+    elif index_type == "ivf":
+        nlist = max(1, int(4 * math.sqrt(count)))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+        index.train(vectors)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)  # reconstruct and remove by id
+    else:
+        raise ValueError(f"Unsupported global index type: {index_type}")
+    if count:
+        index.add_with_ids(vectors, ids)
+    logger.info(f"Built {type(index).__name__} global index shard with {count} vectors")
+    return index
+
+
+class GlobalIndex:
+    """
+    Cross-document FAISS index, sharded by tenant under ``FAISS_INDEX_PATH/_global/<tenant>``.
+
+    Every indexed chunk is added to its tenant's shard, so a question about
+    several PDFs (or a whole tenant) runs as one search over one index,
+    filtered by the chunks' ``source`` metadata, instead of one search per PDF.
+
+    Shards are kept in memory least-recently-used first and evicted once
+    they exceed ``GLOBAL_INDEX_CACHE_BYTES``. Each save writes a new version
+    directory (only the sources that changed are rewritten, the rest are
+    hard-linked from the previous version) and then swaps the ``CURRENT``
+    pointer in one rename, so a reader or a crash sees either the old shard
+    or the new one. Additions are saved after ``GLOBAL_INDEX_SAVE_DELAY``
+    seconds so a burst of uploads is written once; removals are saved
+    straight away.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        root_dir: Optional[str] = None,
+        ann_threshold: Optional[int] = None,
+        index_type: Optional[str] = None,
+        cache_bytes: Optional[int] = None,
+        save_delay: Optional[float] = None,
+    ):
+        self.embeddings = embeddings
+        self.root_dir = root_dir or os.path.join(settings.FAISS_INDEX_PATH, "_global")
+        self.ann_threshold = ann_threshold
+        self.index_type = index_type
+        self.cache_bytes = settings.GLOBAL_INDEX_CACHE_BYTES if cache_bytes is None else cache_bytes
+        self.save_delay = settings.GLOBAL_INDEX_SAVE_DELAY if save_delay is None else save_delay
+        self._shards: "OrderedDict[str, IndexShard]" = OrderedDict()
+        self._shards_lock = threading.Lock()
+        self._loading: Dict[str, threading.Event] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+
+    def shard_dir(self, tenant_id: str) -> str:
+        if not tenant_id or tenant_id in (".", "..") or os.path.basename(tenant_id) != tenant_id:
+            raise ValueError(f"Invalid tenant id: {tenant_id}")
+        return os.path.join(self.root_dir, tenant_id)
+
+    def shard(self, tenant_id: str) -> IndexShard:
+        """
+        Returns a tenant's shard, loading it from disk on first use.
+
+        Only one thread loads a given tenant; others asking for the same
+        tenant wait for it, while requests for other tenants are not blocked.
+        """
+        while True:
+            with self._shards_lock:
+                shard = self._shards.get(tenant_id)
+                if shard is not None:
+                    self._shards.move_to_end(tenant_id)
+                    return shard
+                loading = self._loading.get(tenant_id)
+                if loading is None:
+                    loading = self._loading[tenant_id] = threading.Event()
+                    break
+            loading.wait()
+        try:
+            shard = self._load(tenant_id)
+            with self._shards_lock:
+                self._shards[tenant_id] = shard
+        finally:
+            with self._shards_lock:
+                self._loading.pop(tenant_id, None)
+            loading.set()
+        self._evict(tenant_id)
+        return shard
+
+    def contains(self, tenant_id: str, source: str) -> bool:
+        return source in self.shard(tenant_id)
+
+    def add(self, tenant_id: str, source: str, documents: List[Document], vectors: "np.ndarray"):
+        """
+        Adds (or replaces) a PDF's chunks in its tenant's shard and schedules a save.
+        """
+        shard = self.shard(tenant_id)
+        shard.add(source, documents, vectors)
+        with self._shards_lock:
+            self._shards.setdefault(tenant_id, shard)
+        self._schedule_save(tenant_id)
+        self._evict(tenant_id)
+        logger.info(f"Added {len(documents)} chunks of PDF {source} to global index for tenant {tenant_id} ({len(shard)} total)")
+
+    def add_vectorstore(self, tenant_id: str, source: str, vectorstore):
+        """
+        Copies the chunks and vectors of a per-PDF FAISS vectorstore into the tenant's shard.
+        """
+        index = vectorstore.index
+        vectors = index.reconstruct_n(0, index.ntotal)
+        documents = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in range(index.ntotal)]
+        self.add(tenant_id, source, documents, vectors)
+
+    def remove(self, tenant_id: str, source: str):
+        """
+        Removes a PDF's chunks and saves the shard immediately, so a restart cannot bring them back.
+        """
+        shard = self.shard(tenant_id)
+        if shard.remove(source):
+            self._save(tenant_id, shard)
+
+    async def search(self, tenant_id: str, query: str, k: int = 5, sources: Optional[List[str]] = None) -> Tuple[List[Document], List[float], "np.ndarray"]:
+        """
+        Runs one search for a question over a tenant's shard.
+
+        Args:
+            tenant_id (str): The tenant whose documents are searched.
+            query (str): The user's question.
+            k (int): Number of chunks to return.
+            sources (Optional[List[str]]): PDF ids to restrict the search to, or None for the whole tenant.
+
+        Returns:
+            Tuple[List[Document], List[float], np.ndarray]: The closest chunks, their distances (lower is closer) and their vectors.
+        """
+        with RETRIEVAL_SECONDS.time(scope="global"):
+            shard = await asyncio.to_thread(self.shard, tenant_id)
+            vector = await self.embeddings.aembed_query(query)
+            results, vectors = await asyncio.to_thread(shard.search_with_vectors, vector, k, sources)
+        return [doc for doc, _ in results], [score for _, score in results], vectors
+
+    def flush(self):
+        """
+        Writes every shard with unsaved changes; called on shutdown.
+        """
+        with self._shards_lock:
+            timers, self._timers = self._timers, {}
+            shards = list(self._shards.items())
+        for timer in timers.values():
+            timer.cancel()
+        for tenant_id, shard in shards:
+            if shard.dirty:
+                self._save(tenant_id, shard)
+
+    def stats(self) -> Dict[str, int]:
+        with self._shards_lock:
+            return {tenant_id: len(shard) for tenant_id, shard in self._shards.items()}
+
+    def _evict(self, keep: str):
+        with self._shards_lock:
+            total = sum(shard.nbytes for shard in self._shards.values())
+            for tenant_id in list(self._shards):
+                if total <= self.cache_bytes:
+                    break
+                shard = self._shards[tenant_id]
+                # Unsaved shards stay until their pending save has run
+                if tenant_id == keep or shard.dirty:
+                    continue
+                total -= shard.nbytes
+                del self._shards[tenant_id]
+                logger.info(f"Evicted global index shard for tenant {tenant_id} from memory")
+
+    def _schedule_save(self, tenant_id: str):
+        if self.save_delay <= 0:
+            self._save_pending(tenant_id)
+            return
+        with self._shards_lock:
+            if tenant_id in self._timers:
+                return
+            timer = threading.Timer(self.save_delay, self._save_pending, args=(tenant_id,))
+            timer.daemon = True
+            self._timers[tenant_id] = timer
+        timer.start()
+
+    def _save_pending(self, tenant_id: str):
+        with self._shards_lock:
+            self._timers.pop(tenant_id, None)
+            shard = self._shards.get(tenant_id)
+        if shard is not None and shard.dirty:
+            try:
+                self._save(tenant_id, shard)
+            except Exception as e:
+                logger.error(f"Error saving global index shard for tenant {tenant_id}: {str(e)}")
+
+    def _load(self, tenant_id: str) -> IndexShard:
+        path = self.shard_dir(tenant_id)
+        version = _current_version(path)
+        if version is None:
+            if os.path.exists(os.path.join(path, f"{INDEX_NAME}.faiss")):
+                return self._migrate(tenant_id)
+            return IndexShard(ann_threshold=self.ann_threshold, index_type=self.index_type)
+        version_dir = os.path.join(path, version)
+        index = faiss.read_index(os.path.join(version_dir, f"{INDEX_NAME}.faiss"))
+        with open(os.path.join(version_dir, "meta.json")) as f:
+            meta = json.load(f)
+        documents = {}
+        sources_dir = os.path.join(version_dir, "sources")
+        for name in os.listdir(sources_dir):
+            with open(os.path.join(sources_dir, name), "rb") as f:
+                _, chunks = pickle.load(f)
+            documents.update(chunks)
+        logger.info(f"Loaded global index shard for tenant {tenant_id} ({version}) with {len(documents)} chunks")
+        return IndexShard(index, documents, meta["next_id"], meta["deleted"], ann_threshold=self.ann_threshold, index_type=self.index_type)
+
+    def _migrate(self, tenant_id: str) -> IndexShard:
+        """
+        Converts a shard saved as a single ``index.faiss``/``index.pkl`` pair into the versioned layout.
+        """
+        path = self.shard_dir(tenant_id)
+        legacy = faiss.read_index(os.path.join(path, f"{INDEX_NAME}.faiss"))
+        with open(os.path.join(path, f"{INDEX_NAME}.pkl"), "rb") as f:
+            documents = pickle.load(f)
+        if isinstance(legacy, faiss.IndexIVF):
+            legacy.make_direct_map()
+        vectors = legacy.reconstruct_n(0, legacy.ntotal)
+        ids = np.arange(len(documents), dtype=np.int64)
+        shard = IndexShard(ann_threshold=self.ann_threshold, index_type=self.index_type)
+        shard.index = _build_index(vectors, ids, legacy.d, shard.ann_threshold, shard.index_type)
+        shard.documents = dict(enumerate(documents))
+        shard.next_id = len(documents)
+        for chunk_id, doc in shard.documents.items():
+            shard.ids.setdefault(_source(doc), []).append(chunk_id)
+            shard.text_bytes += len(doc.page_content)
+        shard.changed = set(shard.ids)
+        shard.dirty = True
+        self._save(tenant_id, shard)
+        for name in (f"{INDEX_NAME}.faiss", f"{INDEX_NAME}.pkl"):
+            os.remove(os.path.join(path, name))
+        logger.info(f"Migrated global index shard for tenant {tenant_id} to the versioned layout")
+        return shard
+
+    def _save(self, tenant_id: str, shard: IndexShard):
+        path = self.shard_dir(tenant_id)
+        with shard.save_lock:
+            with shard.lock:
+                if shard.index is None:
+                    return
+                data = faiss.serialize_index(shard.index)
+                meta = {"next_id": shard.next_id, "deleted": sorted(shard.deleted)}
+                sources = {source: list(ids) for source, ids in shard.ids.items()}
+                changed = {source: [(i, shard.documents[i]) for i in sources[source]] for source in shard.changed if source in sources}
+                pending, shard.changed, shard.dirty = shard.changed, set(), False
+            try:
+                self._write_version(path, data, meta, sources, changed)
+            except Exception:
+                with shard.lock:
+                    shard.changed |= pending
+                    shard.dirty = True
+                raise
+
+    def _write_version(self, path: str, data: "np.ndarray", meta: Dict, sources: Dict[str, List[int]], changed: Dict[str, List[Tuple[int, Document]]]):
+        previous = _current_version(path)
+        number = int(previous[1:]) + 1 if previous else 1
+        version = f"v{number:06d}"
+        version_dir = os.path.join(path, version)
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.makedirs(os.path.join(version_dir, "sources"))
+        data.tofile(os.path.join(version_dir, f"{INDEX_NAME}.faiss"))
+        with open(os.path.join(version_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        for source in sources:
+            name = f"{hashlib.sha1(source.encode()).hexdigest()}.pkl"
+            target = os.path.join(version_dir, "sources", name)
+            if source not in changed and previous:
+                try:
+                    os.link(os.path.join(path, previous, "sources", name), target)
+                    continue
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    shutil.copy2(os.path.join(path, previous, "sources", name), target)
+                    continue
+            chunks = changed.get(source)
+            if chunks is None:
+                raise RuntimeError(f"Unchanged source {source} is missing from {previous}")
+            with open(target, "wb") as f:
+                pickle.dump((source, chunks), f)
+        with open(os.path.join(path, f"{CURRENT}.tmp"), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(path, f"{CURRENT}.tmp"), os.path.join(path, CURRENT))
+        for name in os.listdir(path):
+            if name.startswith("v") and name not in (version, previous):
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def _current_version(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,21 @@
+from typing import Any, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    LangChain retriever over a PDF's hybrid (vector + BM25) search, returning
+    the chunks packed into the context budget.
+    """
+
+    service: Any
+    pdf_id: str
+    k: Optional[int] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.service.retrieve_sync(self.pdf_id, query, self.k)[0]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return (await self.service.retrieve(self.pdf_id, query, self.k))[0]
@@ -0,0 +1,215 @@
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from app.core.config import settings
+from app.services.keyword_index import KeywordIndex
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import logger
+
+FAISS = LazyImport("langchain_community.vectorstores", "FAISS")
+compact_index = LazyImport("app.services.compact_index")
+faiss = LazyImport("faiss")
+
+INDEX_NAME = "index"
+KEYWORDS_NAME = "keywords.npz"
+
+
+class _Entry(NamedTuple):
+    vectorstore: FAISS
+    keywords: Optional[KeywordIndex]
+    nbytes: int
+
+
+class PDFIndexStore:
+    """
+    Per-PDF FAISS indexes persisted under ``FAISS_INDEX_PATH/<pdf_id>``,
+    each with a BM25 keyword index over the same chunks.
+
+    Indexes are loaded from disk on first access and kept in an LRU whose
+    total size is bounded by ``FAISS_INDEX_CACHE_BYTES``. The store behaves
+    like a mapping from pdf_id to vectorstore, so membership checks also
+    see indexes that are only on disk.
+
+    With ``mode`` set to "sq8" or "pq", indexes are saved in compact form
+    (see ``app.services.compact_index``): quantized codes in memory, exact
+    vectors and chunk text on disk. Either form is loaded as found on disk.
+
+    Loading and saving block on disk I/O, so async callers run them in a
+    thread; ``is_loaded`` tells whether ``get`` and ``keywords`` can answer
+    from memory. The LRU itself is guarded by a lock.
+    """
+
+    def __init__(self, embeddings, root_dir: Optional[str] = None, max_bytes: Optional[int] = None, use_mmap: Optional[bool] = None, mode: Optional[str] = None):
+        self.embeddings = embeddings
+        self.root_dir = root_dir or settings.FAISS_INDEX_PATH
+        self.max_bytes = settings.FAISS_INDEX_CACHE_BYTES if max_bytes is None else max_bytes
+        self.use_mmap = settings.FAISS_INDEX_MMAP if use_mmap is None else use_mmap
+        self.mode = mode or settings.FAISS_INDEX_MODE
+        if self.mode != "flat" and self.mode not in compact_index.COMPACT_MODES:
+            raise ValueError(f"Unsupported FAISS index mode: {self.mode}")
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.resident_bytes = 0
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def index_dir(self, pdf_id: str) -> str:
+        if not pdf_id or pdf_id in (".", "..") or os.path.basename(pdf_id) != pdf_id:
+            raise ValueError(f"Invalid PDF id: {pdf_id}")
+        return os.path.join(self.root_dir, pdf_id)
+
+    def is_persisted(self, pdf_id: str) -> bool:
+        try:
+            return os.path.exists(os.path.join(self.index_dir(pdf_id), f"{INDEX_NAME}.faiss"))
+        except ValueError:
+            return False
+
+    def __contains__(self, pdf_id: str) -> bool:
+        return pdf_id in self._entries or self.is_persisted(pdf_id)
+
+    def __getitem__(self, pdf_id: str):
+        vectorstore = self.get(pdf_id)
+        if vectorstore is None:
+            raise KeyError(pdf_id)
+        return vectorstore
+
+    def __setitem__(self, pdf_id: str, vectorstore):
+        self._put(pdf_id, vectorstore)
+
+    def __delitem__(self, pdf_id: str):
+        if not self.evict(pdf_id):
+            raise KeyError(pdf_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_loaded(self, pdf_id: str) -> bool:
+        """
+        Whether the PDF's vectorstore and keyword index are both resident, so neither needs disk I/O.
+        """
+        entry = self._entries.get(pdf_id)
+        return entry is not None and entry.keywords is not None
+
+    def get(self, pdf_id: str):
+        """
+        Returns the vectorstore for a PDF, loading it from disk if it is not resident.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+
+        Returns:
+            The FAISS vectorstore, or None if no index exists for the PDF.
+        """
+        with self._lock:
+            entry = self._entries.get(pdf_id)
+            if entry is not None:
+                self._entries.move_to_end(pdf_id)
+                return entry.vectorstore
+        if not self.is_persisted(pdf_id):
+            return None
+        vectorstore, keywords = self._load(pdf_id)
+        self._put(pdf_id, vectorstore, keywords)
+        return vectorstore
+
+    def keywords(self, pdf_id: str) -> Optional[KeywordIndex]:
+        """
+        Returns the keyword index for a PDF, building and persisting it for
+        indexes written before keyword indexes existed.
+        """
+        vectorstore = self.get(pdf_id)
+        if vectorstore is None:
+            return None
+        entry = self._entries.get(pdf_id)
+        if entry is not None and entry.keywords is not None:
+            return entry.keywords
+        keywords = KeywordIndex.from_vectorstore(vectorstore)
+        keywords.save(os.path.join(self.index_dir(pdf_id), KEYWORDS_NAME))
+        logger.info(f"Built missing keyword index for PDF {pdf_id}")
+        self._put(pdf_id, vectorstore, keywords)
+        return keywords
+
+    def save(self, pdf_id: str, vectorstore, keywords: Optional[KeywordIndex] = None):
+        """
+        Persists a PDF's vectorstore and keyword index to disk and makes them
+        resident. In a compact mode the compact form is what stays resident.
+        """
+        path = self.index_dir(pdf_id)
+        keywords = keywords or KeywordIndex.from_vectorstore(vectorstore)
+        if self.mode == "flat":
+            vectorstore.save_local(path, index_name=INDEX_NAME)
+            self._remove_files(path, compact_index.COMPACT_FILES)
+        else:
+            compact_index.write_compact(path, vectorstore, self.mode)
+            self._remove_files(path, (f"{INDEX_NAME}.pkl",))
+            vectorstore = compact_index.load_compact(path, self.embeddings)
+        os.makedirs(path, exist_ok=True)
+        keywords.save(os.path.join(path, KEYWORDS_NAME))
+        logger.info(f"Saved {self.mode} FAISS and keyword indexes for PDF {pdf_id} to {path}")
+        self._put(pdf_id, vectorstore, keywords)
+
+    def evict(self, pdf_id: str) -> bool:
+        """
+        Drops a PDF's index from memory. The copy on disk is kept.
+        """
+        with self._lock:
+            entry = self._entries.pop(pdf_id, None)
+            if entry is None:
+                return False
+            self.resident_bytes -= entry.nbytes
+            return True
+
+    def delete(self, pdf_id: str):
+        """
+        Drops a PDF's index from memory and removes it from disk.
+        """
+        self.evict(pdf_id)
+        shutil.rmtree(self.index_dir(pdf_id), ignore_errors=True)
+
+    def _load(self, pdf_id: str):
+        path = self.index_dir(pdf_id)
+        keywords_path = os.path.join(path, KEYWORDS_NAME)
+        keywords = KeywordIndex.load(keywords_path) if os.path.exists(keywords_path) else None
+        if compact_index.is_compact(path):
+            logger.info(f"Loaded compact FAISS index for PDF {pdf_id} from {path}")
+            return compact_index.load_compact(path, self.embeddings), keywords
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self.use_mmap else 0
+        index = faiss.read_index(os.path.join(path, f"{INDEX_NAME}.faiss"), flags)
+        with open(os.path.join(path, f"{INDEX_NAME}.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        logger.info(f"Loaded FAISS index for PDF {pdf_id} from {path}")
+        return FAISS(self.embeddings, index, docstore, index_to_docstore_id), keywords
+
+    @staticmethod
+    def _remove_files(path: str, names):
+        for name in names:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+
+    def _put(self, pdf_id: str, vectorstore, keywords: Optional[KeywordIndex] = None):
+        nbytes = self._estimate_bytes(vectorstore) + (keywords.nbytes if keywords is not None else 0)
+        with self._lock:
+            self.evict(pdf_id)
+            self._entries[pdf_id] = _Entry(vectorstore, keywords, nbytes)
+            self.resident_bytes += nbytes
+            self._enforce_budget(keep=pdf_id)
+
+    def _enforce_budget(self, keep: str):
+        while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self.evict(oldest)
+            logger.info(f"Evicted FAISS index for PDF {oldest} from memory (resident bytes: {self.resident_bytes})")
+
+    @staticmethod
+    def _estimate_bytes(vectorstore) -> int:
+        try:
+            index = vectorstore.index
+            nbytes = index.nbytes if isinstance(index, compact_index.CompactIndex) else int(index.ntotal) * int(index.d) * 4
+            documents = getattr(vectorstore.docstore, "_dict", {})
+            nbytes += sum(len(doc.page_content) for doc in documents.values())
+            return nbytes
+        except Exception:
+            return 0
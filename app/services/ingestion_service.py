@@ -0,0 +1,150 @@
+import asyncio
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+from cachetools import TTLCache
+from app.core.config import settings
+from app.utils.logger import logger
+from app.utils.metrics import INGEST_JOBS
+
+
+class JobStage(str, Enum):
+    QUEUED = "queued"
+    EXTRACTING = "extracting"
+    CHUNKING = "chunking"
+    EMBEDDING = "embedding"
+    INDEXED = "indexed"
+    FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    pdf_id: str
+    file_path: str
+    tenant_id: str
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    stage: JobStage = JobStage.QUEUED
+    done: int = 0
+    total: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def report(self, stage: JobStage, done: int = 0, total: int = 0):
+        """
+        Records stage-level progress, e.g. ``report(JobStage.EMBEDDING, 40, 120)``.
+        """
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.updated_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in (JobStage.INDEXED, JobStage.FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue or a tenant's share of it is full."""
+
+
+class IngestionQueue:
+    """
+    Runs PDF ingestion on a fixed pool of background workers.
+
+    Jobs wait in a bounded queue; submissions beyond its size, or beyond a
+    tenant's limit of unfinished jobs, are rejected so the caller can apply
+    backpressure. Finished jobs stay queryable for ``INGEST_JOB_TTL`` seconds.
+    """
+
+    def __init__(self, pdf_service, workers: Optional[int] = None, max_queue_size: Optional[int] = None, max_pending_per_tenant: Optional[int] = None):
+        self.pdf_service = pdf_service
+        self.workers = workers or settings.INGEST_WORKERS
+        self.max_queue_size = max_queue_size or settings.INGEST_QUEUE_SIZE
+        self.max_pending_per_tenant = max_pending_per_tenant or settings.INGEST_MAX_PENDING_PER_TENANT
+        self.active_jobs: Dict[str, IngestionJob] = {}
+        self.finished_jobs = TTLCache(maxsize=10000, ttl=settings.INGEST_JOB_TTL)
+        self.pending_per_tenant: Counter = Counter()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def check_capacity(self, tenant_id: str):
+        """
+        Raises QueueFullError if a job for the tenant would be rejected.
+        """
+        if self.depth >= self.max_queue_size:
+            raise QueueFullError("Ingestion queue is full, retry later")
+        if self.pending_per_tenant[tenant_id] >= self.max_pending_per_tenant:
+            raise QueueFullError(f"Too many PDFs are already being processed for tenant {tenant_id}")
+
+    def submit(self, pdf_id: str, file_path: str, tenant_id: str) -> IngestionJob:
+        """
+        Enqueues a PDF for ingestion and returns its job without waiting for it.
+
+        Raises:
+            QueueFullError: If the queue or the tenant's share of it is full.
+        """
+        self._ensure_workers()
+        self.check_capacity(tenant_id)
+        job = IngestionJob(pdf_id=pdf_id, file_path=file_path, tenant_id=tenant_id)
+        self._queue.put_nowait(job)
+        self.active_jobs[job.id] = job
+        self.pending_per_tenant[tenant_id] += 1
+        logger.info(f"Queued ingestion job {job.id} for PDF {pdf_id} (queue depth: {self.depth})")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.active_jobs.get(job_id) or self.finished_jobs.get(job_id)
+
+    def is_pending(self, pdf_id: str) -> bool:
+        return any(job.pdf_id == pdf_id for job in self.active_jobs.values())
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and all(not task.done() for task in self._tasks):
+            return
+        # (Re)start the pool, e.g. on first use or if the loop it ran on has gone away
+        for job in list(self.active_jobs.values()):
+            job.error = "Ingestion worker pool was restarted"
+            job.report(JobStage.FAILED)
+            self._finish(job)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self.pdf_service.ingest(job.pdf_id, job.file_path, job)
+                job.report(JobStage.INDEXED, job.total, job.total)
+                logger.info(f"Ingestion job {job.id} for PDF {job.pdf_id} finished on worker {worker_id}")
+            except Exception as e:
+                job.error = str(e)
+                job.report(JobStage.FAILED)
+                logger.error(f"Ingestion job {job.id} for PDF {job.pdf_id} failed: {str(e)}")
+            finally:
+                self._finish(job)
+                self._queue.task_done()
+
+    def _finish(self, job: IngestionJob):
+        INGEST_JOBS.inc(status=job.stage.value)
+        self.active_jobs.pop(job.id, None)
+        self.finished_jobs[job.id] = job
+        self.pending_per_tenant[job.tenant_id] -= 1
+        if self.pending_per_tenant[job.tenant_id] <= 0:
+            del self.pending_per_tenant[job.tenant_id]
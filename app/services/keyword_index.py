@@ -0,0 +1,152 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+from app.utils.lazy_import import LazyImport
+
+np = LazyImport("numpy")
+
+# Words plus identifiers joined by separators, e.g. "sku-10432", "4.2.1", "err_conn_reset"
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[-_./:][0-9a-z]+)*")
+SEPARATOR_PATTERN = re.compile(r"[-_./:]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cases and splits text into terms. Compound identifiers are kept
+    whole and also split into their parts, so "SKU-10432" matches both
+    "SKU-10432" and "10432".
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in SEPARATOR_PATTERN.split(token) if part)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over the chunks of one PDF.
+
+    Postings are stored as flat numpy arrays with the BM25 weight of every
+    (term, chunk) pair precomputed, so a query only gathers and adds the
+    postings of its terms. Chunk ids are positions in the PDF's FAISS index.
+    """
+
+    def __init__(self, terms: Sequence[str], offsets: "np.ndarray", chunk_ids: "np.ndarray", weights: "np.ndarray", chunk_count: int):
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.chunk_ids = chunk_ids
+        self.weights = weights
+        self.chunk_count = chunk_count
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "KeywordIndex":
+        builder = KeywordIndexBuilder()
+        builder.add(texts)
+        return builder.build(k1, b)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "KeywordIndex":
+        """
+        Builds the index from a FAISS vectorstore's chunks, in index position order.
+        """
+        return cls.build(
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content
+            for i in range(vectorstore.index.ntotal)
+        )
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Returns up to k ``(chunk_id, score)`` pairs with the highest BM25 scores.
+        """
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocabulary.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            scores[self.chunk_ids[start:end]] += self.weights[start:end]
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(scores[matches], -k)[-k:]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in matches]
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.chunk_ids.nbytes + self.weights.nbytes + sum(len(term) for term in self.vocabulary)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.array(list(self.vocabulary), dtype=str),
+                offsets=self.offsets,
+                chunk_ids=self.chunk_ids,
+                weights=self.weights,
+                chunk_count=np.array(self.chunk_count),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "KeywordIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["terms"].tolist(), data["offsets"], data["chunk_ids"], data["weights"], int(data["chunk_count"]))
+
+
+class KeywordIndexBuilder:
+    """
+    Collects BM25 postings chunk by chunk, so an index can be built while
+    chunks stream past without keeping their text. Chunk ids are assigned in
+    the order chunks are added.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+
+    def add(self, texts: Iterable[str]):
+        for text in texts:
+            chunk_id = len(self.lengths)
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, frequency))
+
+    def build(self, k1: float = 1.5, b: float = 0.75) -> KeywordIndex:
+        chunk_count = len(self.lengths)
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if chunk_count and lengths.mean() > 0 else 1.0
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        chunk_ids, weights = [], []
+        for i, term in enumerate(terms):
+            term_postings = np.asarray(self.postings[term], dtype=np.float32)
+            ids = term_postings[:, 0].astype(np.int32)
+            frequency = term_postings[:, 1]
+            idf = math.log(1 + (chunk_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            chunk_ids.append(ids)
+            weights.append(idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * lengths[ids] / average_length)))
+            offsets[i + 1] = offsets[i] + len(ids)
+        return KeywordIndex(
+            terms,
+            offsets,
+            np.concatenate(chunk_ids) if chunk_ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights).astype(np.float32) if weights else np.zeros(0, dtype=np.float32),
+            chunk_count,
+        )
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuses several rankings of chunk ids; each id scores ``sum(1 / (k + rank))``.
+
+    Returns:
+        List[Tuple[int, float]]: Chunk ids with their fused scores, best first.
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
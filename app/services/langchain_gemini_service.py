@@ -1,116 +1,477 @@
-import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from app.core.config import settings
-from app.utils.logger import logger
-from langchain.prompts import PromptTemplate
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import get_logger, logger
+from app.services.index_store import PDFIndexStore
+from app.services.global_index import GlobalIndex
+from app.services.keyword_index import KeywordIndex, KeywordIndexBuilder, reciprocal_rank_fusion
+from app.services.chunking import Chunk, PageChunker, create_text_splitter
+from app.services.context_builder import ContextBuilder, PackedContext, hybrid_relevance
+from app.services.embedding_pipeline import EmbeddingPipeline
+from app.services.llm_gateway import LLMGateway
+from app.utils.embedding_cache import EmbeddingCache
+from app.utils.cache import answer_cache
+from app.utils.metrics import CHUNKS_INDEXED, CONTEXT_TOKENS, LLM_SECONDS, LLM_TOKENS, RETRIEVAL_SECONDS, count_tokens
+from app.utils.single_flight import SingleFlight
+from app.utils.tokens import estimate_tokens
+from app.services.ingestion_service import JobStage
+
+# LangChain, the Gemini clients, FAISS and NumPy take a while to import; load them when first needed
+Document = LazyImport("langchain_core.documents", "Document")
+GatewayChatModel = LazyImport("app.services.gateway_chat_model", "GatewayChatModel")
+GoogleGenerativeAIEmbeddings = LazyImport("langchain_google_genai", "GoogleGenerativeAIEmbeddings")
+RetrievalQA = LazyImport("langchain.chains", "RetrievalQA")
+FAISS = LazyImport("langchain_community.vectorstores", "FAISS")
+PromptTemplate = LazyImport("langchain_core.prompts", "PromptTemplate")
+HybridRetriever = LazyImport("app.services.hybrid_retriever", "HybridRetriever")
+compact_index = LazyImport("app.services.compact_index")
+faiss = LazyImport("faiss")
+np = LazyImport("numpy")
+
+retrieval_logger = get_logger("retrieval")
+
+PROMPT_TEMPLATE = """Use the following pieces of context to answer the question at the end. 
+
+        {context}
+        Question: {question}
+        Answer:"""
+CONTINUATION_PROMPT_TEMPLATE = """Use the following pieces of context to answer the question at the end. 
+
+        {context}
+        Question: {question}
+        Answer so far: {answer}
+        Continue the answer from where it stops, without repeating it:"""
+
+
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _chunk_metadata(pdf_id: str, chunk: Chunk) -> dict:
+    return {"source": pdf_id, "chunk_hash": _chunk_hash(chunk.text), "page": chunk.page, "end_page": chunk.last_page, "start": chunk.start, "end": chunk.end}
+
+
+def _citations(documents: Iterable[Document]) -> List[str]:
+    """
+    One "source:page" entry per cited page, in order of first appearance; a chunk spanning a page break cites both pages.
+    """
+    citations = []
+    for doc in documents:
+        source = doc.metadata.get("source", "Unknown")
+        page = doc.metadata.get("page")
+        pages = range(page, doc.metadata.get("end_page", page) + 1) if page is not None else [None]
+        for number in pages:
+            citation = f"{source}:{number}" if number is not None else source
+            if citation not in citations:
+                citations.append(citation)
+    return citations
+
+
+@dataclass
+class LongAnswer:
+    answer: str
+    documents: List[Document] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    iterations: int = 0
+    context_tokens: int = 0
+
+    @property
+    def sources(self) -> List[str]:
+        return _citations(self.documents)
+
+    def format(self) -> str:
+        return f"Answer: {self.answer}\n\nSources: {self.sources}"
+
 
 class LangchainGeminiService:
-    def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=0.3,
-            top_p=1,
-            top_k=1,
-            system_message="You are an AI assistant that answers questions based on the provided PDF content. Always refer to the given context to answer questions."
-        )
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=settings.GEMINI_API_KEY)
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=settings.GEMINI_API_KEY)
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
-        self.vectorstore = self._load_or_create_vectorstore()
-        self.pdf_vectorstores = {}
-
-    def _load_or_create_vectorstore(self):
-        try:
-            if os.path.exists(settings.FAISS_INDEX_PATH):
-                logger.info(f"Loading existing FAISS index from {settings.FAISS_INDEX_PATH}")
-                vectorstore = FAISS.load_local(settings.FAISS_INDEX_PATH, self.embeddings, allow_dangerous_deserialization=True)
-                logger.info(f"FAISS index loaded with {len(vectorstore.index_to_docstore_id)} documents")
-                return vectorstore
-            else:
-                logger.info(f"Creating new FAISS index at {settings.FAISS_INDEX_PATH}")
-                vectorstore = FAISS.from_texts(["Initialize"], self.embeddings)
-                vectorstore.save_local(settings.FAISS_INDEX_PATH)
-                return vectorstore
-        except Exception as e:
-            logger.error(f"Error loading or creating FAISS index: {str(e)}")
-            logger.info("Creating new FAISS index as fallback")
-            vectorstore = FAISS.from_texts(["Initialize"], self.embeddings)
-            vectorstore.save_local(settings.FAISS_INDEX_PATH)
-            return vectorstore
-        
-    
-    async def generate_long_answer(self,pdf_id: str,  query: str, max_tokens: int = 16392, max_iterations: int = 3) -> str:
-        full_response = ""
-        iteration = 0
-        
-        while len(full_response.split()) < max_tokens and iteration < max_iterations:
-            current_query = query if iteration == 0 else f"Continue the previous answer. {query}"
-            
-            result = await self.query_pdf(pdf_id,current_query)
-            response = result.split("Answer: ")[1].split("\n\nSources:")[0]
-            
-            full_response += " " + response
-            
-            if len(response.split()) < 100:  # Stop if the response is too short
+    def __init__(self, llm=None, embeddings=None, gateway: Optional[LLMGateway] = None):
+        self.llm = llm or GatewayChatModel(gateway=gateway or LLMGateway(), model="gemini-1.5-flash")
+        self.embeddings = embeddings or GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=settings.GEMINI_API_KEY)
+        self.embedding_cache = self._create_embedding_cache()
+        self.embedding_pipeline = EmbeddingPipeline(self.embeddings, cache=self.embedding_cache)
+        self.text_splitter = create_text_splitter()
+        self.chunker = PageChunker(self.text_splitter)
+        self.pdf_vectorstores = PDFIndexStore(self.embeddings)
+        self.global_index = GlobalIndex(self.embeddings)
+        self.context_builder = ContextBuilder()
+        # Shared by background ingestion and indexing on first query, so a PDF is never indexed twice at once
+        self.index_flight = SingleFlight("index")
+
+    def _create_embedding_cache(self):
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return None
+        model = getattr(self.embeddings, "model", type(self.embeddings).__name__)
+        return EmbeddingCache(settings.EMBEDDING_CACHE_DIR, model)
+
+    async def generate_long_answer(self,pdf_id: str,  query: str, max_tokens: int = 16392, max_iterations: int = 3, query_vector: Optional[List[float]] = None) -> str:
+        result = await self.answer_long(pdf_id, query, max_tokens, max_iterations, query_vector)
+        return result.format()
+
+    async def answer_long(self, pdf_id: str, query: str, max_tokens: int = 16392, max_iterations: int = 3, query_vector: Optional[List[float]] = None) -> LongAnswer:
+        """
+        Generates a long answer over several LLM rounds with a single retrieval.
+
+        The context is retrieved once; every continuation round reuses it and
+        receives the answer so far, so extra rounds only cost LLM time.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            query (str): The user's question.
+            max_tokens (int): Stop continuing once the answer has about this many tokens.
+            max_iterations (int): Maximum number of LLM rounds.
+            query_vector (Optional[List[float]]): The question's embedding, if the caller already has it.
+
+        Returns:
+            LongAnswer: The answer text, the packed context documents, their scores and token count.
+
+        Raises:
+            ValueError: If the PDF is not indexed.
+        """
+        context = await self.retrieve_context(pdf_id, query, query_vector=query_vector)
+        result = await self._generate_rounds(context, query, max_tokens, max_iterations)
+        logger.info(f"Long answer for PDF {pdf_id} took {result.iterations} rounds ({estimate_tokens(result.answer)} tokens from {result.context_tokens} context tokens)")
+        return result
+
+    async def answer_across_documents(self, tenant_id: str, query: str, pdf_ids: Optional[List[str]] = None, max_tokens: int = 16392, max_iterations: int = 3) -> LongAnswer:
+        """
+        Answers a question over several PDFs, or all of a tenant's PDFs, with one search of the global index.
+
+        Args:
+            tenant_id (str): The tenant whose documents are searched.
+            query (str): The user's question.
+            pdf_ids (Optional[List[str]]): PDFs to restrict the search to, or None for the whole tenant.
+            max_tokens (int): Stop continuing once the answer has about this many tokens.
+            max_iterations (int): Maximum number of LLM rounds.
+
+        Returns:
+            LongAnswer: The answer text, the packed context documents, their scores and token count.
+
+        Raises:
+            ValueError: If none of the requested PDFs has indexed content.
+        """
+        documents, distances, vectors = await self.global_index.search(tenant_id, query, k=settings.CONTEXT_CANDIDATES, sources=pdf_ids)
+        if not documents:
+            raise ValueError(f"No indexed content found for tenant {tenant_id}")
+        context = self._pack(documents, [1 / (1 + distance) for distance in distances], vectors, scope="global")
+        result = await self._generate_rounds(context, query, max_tokens, max_iterations)
+        logger.info(f"Cross-document answer for tenant {tenant_id} over {len(pdf_ids) if pdf_ids else 'all'} PDFs used {len(result.documents)} chunks ({result.context_tokens} tokens) from {sorted(set(result.sources))}")
+        return result
+
+    async def _generate_rounds(self, context: PackedContext, query: str, max_tokens: int, max_iterations: int) -> LongAnswer:
+        result = LongAnswer(answer="", documents=context.documents, scores=context.scores, context_tokens=context.tokens)
+
+        for iteration in range(max_iterations):
+            with LLM_SECONDS.time(mode="complete"):
+                message = await self.llm.ainvoke(self._round_prompt(context.text, query, result.answer))
+            LLM_TOKENS.inc(count_tokens(message), mode="complete")
+            response = message.content.strip()
+            result.answer = f"{result.answer} {response}".strip()
+            result.iterations += 1
+            if estimate_tokens(response) < 100 or estimate_tokens(result.answer) >= max_tokens:  # Stop if the response is too short
                 break
-            
-            iteration += 1
-        
-        sources = result.split("\n\nSources:")[1]
-        return f"Answer: {full_response.strip()}\n\nSources: {sources}"
+        return result
+
+    async def retrieve(self, pdf_id: str, query: str, k: Optional[int] = None) -> Tuple[List[Document], List[float]]:
+        """
+        Runs hybrid retrieval for a question against a PDF and returns the chunks packed into the context.
 
-    async def process_pdf(self, pdf_id: str, text: str):
-        chunks = self.text_splitter.split_text(text)
-        logger.info(f"Split PDF {pdf_id} into {len(chunks)} chunks")
+        Returns:
+            Tuple[List[Document], List[float]]: The packed chunks and their fused scores (higher is better).
 
-        vectorstore = FAISS.from_texts(chunks, self.embeddings, metadatas=[{"source": pdf_id}] * len(chunks))
-        self.pdf_vectorstores[pdf_id] = vectorstore
-        logger.info(f"Processed and indexed PDF {pdf_id}. Total documents in index: {len(chunks)}")
+        Raises:
+            ValueError: If the PDF is not indexed.
+        """
+        context = await self.retrieve_context(pdf_id, query, k)
+        return context.documents, context.scores
 
+    async def retrieve_context(self, pdf_id: str, query: str, k: Optional[int] = None, query_vector: Optional[List[float]] = None) -> PackedContext:
+        """
+        Runs hybrid retrieval for a question against a PDF: vector search and
+        BM25 keyword search, fused with reciprocal rank fusion. The best k
+        candidates are then packed into the context token budget.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            query (str): The user's question.
+            k (Optional[int]): Number of candidates to consider, ``CONTEXT_CANDIDATES`` by default.
+            query_vector (Optional[List[float]]): The question's embedding; embedded here if not given.
+
+        Returns:
+            PackedContext: The packed chunks, their scores, the context text and its token count.
+
+        Raises:
+            ValueError: If the PDF is not indexed.
+        """
+        with RETRIEVAL_SECONDS.time(scope="pdf"):
+            vectorstore, keywords = await self._load_indexes(pdf_id)
+            vector = query_vector if query_vector is not None else await self.embeddings.aembed_query(query)
+            candidates = await asyncio.to_thread(self._hybrid_search, vectorstore, keywords, query, vector, k or settings.CONTEXT_CANDIDATES)
+        return self._pack(*candidates, scope="pdf")
+
+    def retrieve_sync(self, pdf_id: str, query: str, k: Optional[int] = None) -> Tuple[List[Document], List[float]]:
+        with RETRIEVAL_SECONDS.time(scope="pdf"):
+            vectorstore, keywords = self._indexes(pdf_id)
+            candidates = self._hybrid_search(vectorstore, keywords, query, self.embeddings.embed_query(query), k or settings.CONTEXT_CANDIDATES)
+        context = self._pack(*candidates, scope="pdf")
+        return context.documents, context.scores
+
+    def _pack(self, documents: List[Document], scores: List[float], vectors: "np.ndarray", relevance: Optional["np.ndarray"] = None, scope: str = "pdf") -> PackedContext:
+        context = self.context_builder.pack(documents, scores, vectors, relevance)
+        CONTEXT_TOKENS.observe(context.tokens, scope=scope)
+        retrieval_logger.debug(f"Packed {len(context.documents)} of {len(documents)} candidate chunks into {context.tokens} context tokens")
+        return context
+
+    async def _load_indexes(self, pdf_id: str):
+        # A cold load reads the index from disk (and may build a missing keyword index), so it runs in a thread,
+        # once per PDF; it joins an indexing run in flight for the PDF instead of loading the older copy on disk
+        while not self.pdf_vectorstores.is_loaded(pdf_id):
+            await self.index_flight.do(pdf_id, lambda: asyncio.to_thread(self._indexes, pdf_id))
+        return self._indexes(pdf_id)
+
+    def _indexes(self, pdf_id: str):
+        vectorstore = self.pdf_vectorstores.get(pdf_id)
+        if vectorstore is None:
+            raise ValueError(f"PDF with id {pdf_id} not found in the index")
+        return vectorstore, self.pdf_vectorstores.keywords(pdf_id)
+
+    @staticmethod
+    def _hybrid_search(vectorstore, keywords: KeywordIndex, query: str, vector: List[float], k: int) -> Tuple[List[Document], List[float], "np.ndarray", "np.ndarray"]:
+        fetch_k = max(k, settings.HYBRID_FETCH_K)
+        _, positions = vectorstore.index.search(np.asarray([vector], dtype=np.float32), fetch_k)
+        dense = [int(position) for position in positions[0] if position >= 0]
+        keyword_scores = dict(keywords.search(query, fetch_k))
+        fused = reciprocal_rank_fusion([dense, list(keyword_scores)], k=settings.HYBRID_RRF_K)[:k]
+        if not fused:
+            return [], [], None, None
+        fused_positions = [position for position, _ in fused]
+        documents = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]) for position in fused_positions]
+        vectors = vectorstore.index.reconstruct_batch(np.array(fused_positions, dtype=np.int64))
+        # Fused scores only encode ranks, so the relevance cut-off is applied to the vector and BM25 scores behind them
+        relevance = hybrid_relevance(vector, vectors, [keyword_scores.get(position, 0.0) for position in fused_positions])
+        return documents, [score for _, score in fused], vectors, relevance
+
+    @staticmethod
+    def _round_prompt(context: str, query: str, answer: str) -> str:
+        if not answer:
+            return PROMPT_TEMPLATE.format(context=context, question=query)
+        return CONTINUATION_PROMPT_TEMPLATE.format(context=context, question=query, answer=answer)
+
+    async def index_pdf(self, pdf_id: str, pages: Callable[[], Iterable[str]], progress: Optional[Callable] = None, tenant_id: Optional[str] = None, fresh: bool = False):
+        """
+        Indexes a PDF through ``index_flight``, joining an indexing run for it that is already in flight.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            pages (Callable[[], Iterable[str]]): Returns the text of each page; only called if this call starts the run.
+            progress (Optional[Callable]): Called with the job stage and embedding progress.
+            tenant_id (Optional[str]): Also add the chunks to this tenant's global index.
+            fresh (bool): The pages are new content, so a run already in flight (which may have read the old
+                text) is waited for and then a new run is started instead of joining it.
+        """
+        while fresh and pdf_id in self.index_flight:
+            await self.index_flight.wait(pdf_id)
+        await self.index_flight.do(pdf_id, lambda: self.process_pdf(pdf_id, pages(), progress=progress, tenant_id=tenant_id))
+
+    async def process_pdf(self, pdf_id: str, pages: Union[str, Iterable[str]], progress: Optional[Callable] = None, tenant_id: Optional[str] = None):
+        """
+        Chunks a PDF page by page and indexes the chunks.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            pages (Union[str, Iterable[str]]): The text of each page, consumed lazily; a single string is one page.
+            progress (Optional[Callable]): Called with the job stage and embedding progress.
+            tenant_id (Optional[str]): Also add the chunks to this tenant's global index.
+        """
+        if progress:
+            progress(JobStage.CHUNKING)
+        if isinstance(pages, str):
+            pages = [pages]
+        chunks = self.chunker.iter_chunks(pages)
+
+        existing = await asyncio.to_thread(self.pdf_vectorstores.get, pdf_id)
+        if existing is not None:
+            chunks = list(chunks)
+            if not chunks:
+                raise ValueError("No text chunks to index")
+            logger.info(f"Split PDF {pdf_id} into {len(chunks)} chunks")
+            CHUNKS_INDEXED.inc(len(chunks))
+            vectorstore, keywords = await self._update_vectorstore(pdf_id, existing, chunks, progress)
+        else:
+            builder = KeywordIndexBuilder()
+            vectorstore = await self._build_vectorstore(pdf_id, chunks, progress, keywords=builder)
+            logger.info(f"Split PDF {pdf_id} into {vectorstore.index.ntotal} chunks")
+            CHUNKS_INDEXED.inc(vectorstore.index.ntotal)
+            keywords = await asyncio.to_thread(builder.build)
+        await asyncio.to_thread(self.pdf_vectorstores.save, pdf_id, vectorstore, keywords)
+        if tenant_id is not None:
+            await asyncio.to_thread(self.global_index.add_vectorstore, tenant_id, pdf_id, vectorstore)
+        answer_cache.invalidate(pdf_id)
+        if self.embedding_cache is not None:
+            logger.info(f"Embedding cache stats after PDF {pdf_id}: {self.embedding_cache.stats()}")
+        logger.info(f"Processed and indexed PDF {pdf_id}. Total documents in index: {vectorstore.index.ntotal}")
+
+    async def _update_vectorstore(self, pdf_id: str, vectorstore, chunks: List[Chunk], progress: Optional[Callable] = None):
+        """
+        Brings an existing index in line with a new version of its PDF.
+
+        Chunks are matched by content hash: unchanged chunks keep their
+        vectors (with their page and offsets refreshed, in case they moved),
+        stale ones are removed from FAISS by id, and only chunks that are new
+        in this version are embedded and added. A compact index is edited as a
+        flat copy and re-quantized when saved.
+        """
+        vectorstore = compact_index.thaw(vectorstore, self.embeddings)
+        wanted: Dict[str, List[Chunk]] = {}
+        for chunk in chunks:
+            wanted.setdefault(_chunk_hash(chunk.text), []).append(chunk)
+        stale_ids = []
+        unchanged = 0
+        for docstore_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(docstore_id)
+            matches = wanted.get(doc.metadata.get("chunk_hash") or _chunk_hash(doc.page_content))
+            if matches:
+                doc.metadata.update(_chunk_metadata(pdf_id, matches.pop(0)))
+                unchanged += 1
+            else:
+                stale_ids.append(docstore_id)
+
+        unmatched = {chunk for matches in wanted.values() for chunk in matches}
+        new_chunks = [chunk for chunk in chunks if chunk in unmatched]
+
+        if stale_ids:
+            vectorstore.index = faiss.clone_index(vectorstore.index)  # indexes loaded with mmap are read-only
+            vectorstore.delete(stale_ids)
+        if new_chunks:
+            await self._build_vectorstore(pdf_id, new_chunks, progress, vectorstore)
+        logger.info(f"Re-indexed PDF {pdf_id}: {len(new_chunks)} chunks added, {len(stale_ids)} removed, {unchanged} unchanged")
+        keywords = await asyncio.to_thread(KeywordIndex.from_vectorstore, vectorstore)
+        return vectorstore, keywords
+
+    def delete_pdf(self, pdf_id: str, tenant_id: Optional[str] = None):
+        """
+        Removes a PDF's indexes from memory and disk and drops its cached answers.
+        """
+        self.pdf_vectorstores.delete(pdf_id)
+        if tenant_id is not None:
+            self.global_index.remove(tenant_id, pdf_id)
+        answer_cache.invalidate(pdf_id)
+        logger.info(f"Deleted indexes for PDF {pdf_id}")
+
+    async def _build_vectorstore(self, pdf_id: str, chunks: Iterable[Chunk], progress: Optional[Callable] = None, vectorstore=None, keywords: Optional[KeywordIndexBuilder] = None):
+        """
+        Embeds chunks through the batched pipeline and adds the batches to the
+        FAISS index (a new one unless given) in chunk order, so a PDF always
+        gets the same index positions.
+
+        Chunks are consumed lazily and each batch's text is passed on to the
+        keyword index builder (if given) as it is indexed, so only the chunks
+        sent for embedding but not yet indexed are held. Progress totals grow
+        as chunks are produced, so they are exact once chunking is done.
+
+        Returns:
+            The vectorstore.
+        """
+        metadatas: Dict[int, dict] = {}
+        produced = embedded = 0
+
+        def texts():
+            nonlocal produced
+            for chunk in chunks:
+                metadatas[produced] = _chunk_metadata(pdf_id, chunk)
+                produced += 1
+                yield chunk.text
+
+        if progress:
+            progress(JobStage.EMBEDDING, 0, 0)
+        async for start, batch_texts, vectors in self.embedding_pipeline.iter_batches(texts(), ordered=True):
+            text_embeddings = list(zip(batch_texts, vectors))
+            batch_metadatas = [metadatas.pop(start + i) for i in range(len(batch_texts))]
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=batch_metadatas)
+            else:
+                vectorstore.add_embeddings(text_embeddings, metadatas=batch_metadatas)
+            if keywords is not None:
+                await asyncio.to_thread(keywords.add, batch_texts)
+            embedded += len(batch_texts)
+            if progress:
+                progress(JobStage.EMBEDDING, embedded, produced)
+        if vectorstore is None:
+            raise ValueError("No text chunks to index")
+        return vectorstore
 
     async def query_pdf(self, pdf_id: str, query: str) -> str:
         if pdf_id not in self.pdf_vectorstores:
             raise ValueError(f"PDF with id {pdf_id} not found in the index")
         
-        vectorstore = self.pdf_vectorstores[pdf_id]
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-        
-        prompt_template = """Use the following pieces of context to answer the question at the end. 
-
-        {context}
-        Question: {question}
-        Answer:"""
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
+        retriever = HybridRetriever(service=self, pdf_id=pdf_id)
         
         qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
             retriever=retriever,
             return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT},
+            chain_type_kwargs={"prompt": PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])},
         )
         
-        result = qa_chain({"query": query})
+        result = await qa_chain.ainvoke({"query": query})
         response = result['result']
         source_documents = result['source_documents']
         
-        logger.info(f"Query for PDF {pdf_id}: {query}")
-        logger.info(f"Response: {response}")
-        for i, doc in enumerate(source_documents):
-            logger.info(f"Source document {i+1}: Content={doc.page_content[:100]}..., Metadata={doc.metadata}")
+        logger.info(f"Query for PDF {pdf_id}: {query} ({len(response)} characters, {len(source_documents)} sources)")
+        if retrieval_logger.isEnabledFor(logging.DEBUG):
+            retrieval_logger.debug(f"Response: {response}")
+            for i, doc in enumerate(source_documents):
+                retrieval_logger.debug(f"Source document {i+1}: Content={doc.page_content[:100]}..., Metadata={doc.metadata}")
         
-        return f"Answer: {response}\n\nSources: {[doc.metadata.get('source', 'Unknown') for doc in source_documents]}"
+        return f"Answer: {response}\n\nSources: {_citations(source_documents)}"
+
+
+    async def stream_long_answer(self, pdf_id: str, query: str, max_tokens: int = 16392, max_iterations: int = 3, query_vector: Optional[List[float]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streams a long answer as it is generated.
 
+        Retrieval runs once; the source list is yielded first as ``("sources", [...])``
+        and the packed context's size as ``("context_tokens", n)``, followed by
+        ``("token", text)`` for every chunk the LLM produces, across all
+        continuation rounds.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            query (str): The user's question.
+            max_tokens (int): Stop continuing once the answer has about this many tokens.
+            max_iterations (int): Maximum number of LLM rounds.
+            query_vector (Optional[List[float]]): The question's embedding, if the caller already has it.
+
+        Raises:
+            ValueError: If the PDF is not indexed.
+        """
+        context = await self.retrieve_context(pdf_id, query, query_vector=query_vector)
+        yield "sources", _citations(context.documents)
+        yield "context_tokens", context.tokens
+
+        answer = ""
+        for iteration in range(max_iterations):
+            if iteration > 0:
+                yield "token", " "
+            response = ""
+            message = None
+            start_time = time.perf_counter()
+            async for chunk in self.llm.astream(self._round_prompt(context.text, query, answer)):
+                message = chunk if message is None else message + chunk
+                if chunk.content:
+                    response += chunk.content
+                    yield "token", chunk.content
+            LLM_SECONDS.observe(time.perf_counter() - start_time, mode="stream")
+            if message is not None:
+                LLM_TOKENS.inc(count_tokens(message), mode="stream")
+            answer = f"{answer} {response.strip()}".strip()
+            if estimate_tokens(response) < 100 or estimate_tokens(answer) >= max_tokens:  # Stop if the response is too short
+                break
 
     def check_index_contents(self):
-        logger.info(f"Total documents in index: {len(self.vectorstore.index_to_docstore_id)}")
-        for i, (index, doc_id) in enumerate(self.vectorstore.index_to_docstore_id.items()):
-            doc = self.vectorstore.docstore.search(doc_id)
-            logger.info(f"Document {i+1}: ID={doc_id}, Content={doc.page_content[:100]}...")
\ No newline at end of file
+        logger.info(f"Chunks in global index by tenant: {self.global_index.stats()}")
@@ -0,0 +1,262 @@
+import asyncio
+import random
+import time
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Union
+import orjson
+from app.core.config import settings
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import logger
+from app.utils.metrics import LLM_QUEUE_SECONDS, LLM_QUEUED_CALLS, LLM_RETRIES
+
+httpx = LazyImport("httpx")
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# Tenant that LLM calls made while handling the current request are charged to
+tenant_context: ContextVar[str] = ContextVar("llm_tenant", default="default")
+
+
+class LLMGatewayError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Generation(NamedTuple):
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+def _contents(prompt: Union[str, List[dict]]) -> List[dict]:
+    if isinstance(prompt, str):
+        return [{"role": "user", "parts": [{"text": prompt}]}]
+    return prompt
+
+
+def _parse(payload: dict) -> Generation:
+    candidates = payload.get("candidates") or []
+    parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+    usage = payload.get("usageMetadata") or {}
+    return Generation(
+        "".join(part.get("text", "") for part in parts),
+        usage.get("promptTokenCount", 0),
+        usage.get("candidatesTokenCount", 0),
+    )
+
+
+class _LoopBinding:
+    """
+    The connection pool and semaphores of one event loop; asyncio objects cannot be shared between loops.
+    """
+
+    def __init__(self, client, max_concurrency: int):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # A tenant's semaphore lives while one of its calls holds or waits for it
+        self.tenant_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+class LLMGateway:
+    """
+    Async client for the Gemini REST API, shared by every LLM caller in the process.
+
+    Calls go over one pooled HTTP/1.1 connection pool and wait for a slot of
+    the tenant's semaphore (``LLM_MAX_CONCURRENCY_PER_TENANT``) and then of
+    the global one (``LLM_MAX_CONCURRENCY``), so one tenant cannot take every
+    slot. The wait is recorded in ``llm_queue_wait_seconds``. Responses with
+    status 429 or 5xx and transport errors are retried with jittered
+    exponential backoff, or after the server's ``Retry-After``; the slot is
+    released while backing off.
+
+    Each event loop that makes calls gets its own pool and semaphores, which
+    ``aclose`` closes from that loop; the app's calls all run on one loop.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        max_concurrency_per_tenant: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None,
+        transport: Optional["httpx.AsyncBaseTransport"] = None,
+    ):
+        self.api_key = api_key or settings.GEMINI_API_KEY
+        self.base_url = base_url or settings.GEMINI_API_BASE_URL
+        self.max_concurrency = max_concurrency or settings.LLM_MAX_CONCURRENCY
+        self.max_concurrency_per_tenant = max_concurrency_per_tenant or settings.LLM_MAX_CONCURRENCY_PER_TENANT
+        self.timeout = timeout or settings.LLM_TIMEOUT
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = settings.LLM_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.transport = transport
+        self.queued = 0
+        self._bindings: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopBinding]" = weakref.WeakKeyDictionary()
+
+    def _bind(self) -> _LoopBinding:
+        loop = asyncio.get_running_loop()
+        binding = self._bindings.get(loop)
+        if binding is None:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"x-goog-api-key": self.api_key},
+                timeout=httpx.Timeout(self.timeout, connect=settings.LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                transport=self.transport,
+            )
+            binding = self._bindings[loop] = _LoopBinding(client, self.max_concurrency)
+        return binding
+
+    @asynccontextmanager
+    async def _slot(self, binding: _LoopBinding, tenant_id: str) -> AsyncIterator[None]:
+        tenant_semaphore = binding.tenant_semaphores.get(tenant_id)
+        if tenant_semaphore is None:
+            tenant_semaphore = binding.tenant_semaphores[tenant_id] = asyncio.Semaphore(self.max_concurrency_per_tenant)
+        start = time.perf_counter()
+        self.queued += 1
+        LLM_QUEUED_CALLS.set(self.queued)
+        try:
+            await tenant_semaphore.acquire()
+            try:
+                await binding.semaphore.acquire()
+            except BaseException:
+                tenant_semaphore.release()
+                raise
+        finally:
+            self.queued -= 1
+            LLM_QUEUED_CALLS.set(self.queued)
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            binding.semaphore.release()
+            tenant_semaphore.release()
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after is not None:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+        return self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def _retry_or_raise(self, model: str, attempt: int, error: str, status_code: Optional[int] = None, response=None):
+        if attempt >= self.max_retries:
+            logger.error(f"Gemini call to {model} failed after {attempt + 1} attempts: {error}")
+            raise LLMGatewayError(f"Gemini call to {model} failed: {error}", status_code)
+        delay = self._retry_delay(attempt, response)
+        LLM_RETRIES.inc(reason=str(status_code) if status_code else "transport")
+        logger.warning(f"Gemini call to {model} failed ({error}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    @staticmethod
+    def _body(contents: Union[str, List[dict]], system_instruction: Optional[str], generation_config: Optional[Dict[str, Any]]) -> dict:
+        body = {"contents": _contents(contents)}
+        if system_instruction:
+            body["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+        return body
+
+    async def generate(
+        self,
+        model: str,
+        contents: Union[str, List[dict]],
+        system_instruction: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        tenant_id: Optional[str] = None,
+    ) -> Generation:
+        """
+        Generates one completion.
+
+        Args:
+            model (str): The Gemini model, e.g. "gemini-1.5-flash".
+            contents (Union[str, List[dict]]): A prompt, or Gemini ``contents`` turns.
+            system_instruction (Optional[str]): Optional system instruction.
+            generation_config (Optional[Dict[str, Any]]): Gemini ``generationConfig``, e.g. temperature.
+            tenant_id (Optional[str]): Tenant whose concurrency limit applies; defaults to the current request's.
+
+        Raises:
+            LLMGatewayError: If the API rejects the call, or it still fails after ``max_retries`` retries.
+        """
+        binding = self._bind()
+        body = self._body(contents, system_instruction, generation_config)
+        tenant_id = tenant_id or tenant_context.get()
+        attempt = 0
+        while True:
+            try:
+                async with self._slot(binding, tenant_id):
+                    response = await binding.client.post(f"/v1beta/models/{model}:generateContent", json=body)
+            except httpx.TransportError as e:
+                await self._retry_or_raise(model, attempt, f"{type(e).__name__}: {str(e)}")
+                attempt += 1
+                continue
+            if response.status_code in RETRYABLE_STATUS:
+                await self._retry_or_raise(model, attempt, f"HTTP {response.status_code}", response.status_code, response)
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                raise LLMGatewayError(f"Gemini call to {model} failed with HTTP {response.status_code}: {response.text[:500]}", response.status_code)
+            return _parse(response.json())
+
+    async def stream(
+        self,
+        model: str,
+        contents: Union[str, List[dict]],
+        system_instruction: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        tenant_id: Optional[str] = None,
+    ) -> AsyncIterator[Generation]:
+        """
+        Streams a completion as it is generated, one ``Generation`` per server-sent chunk.
+
+        The call holds its concurrency slot until the stream ends. Failures
+        are retried only until the response starts; an error mid-stream is raised.
+
+        Raises:
+            LLMGatewayError: If the API rejects the call, or it still fails after ``max_retries`` retries.
+        """
+        binding = self._bind()
+        body = self._body(contents, system_instruction, generation_config)
+        tenant_id = tenant_id or tenant_context.get()
+        attempt = 0
+        started = False
+        while True:
+            error = None
+            async with self._slot(binding, tenant_id):
+                try:
+                    async with binding.client.stream("POST", f"/v1beta/models/{model}:streamGenerateContent", params={"alt": "sse"}, json=body) as response:
+                        if response.status_code >= 400:
+                            await response.aread()
+                            if response.status_code not in RETRYABLE_STATUS:
+                                raise LLMGatewayError(f"Gemini call to {model} failed with HTTP {response.status_code}: {response.text[:500]}", response.status_code)
+                            error = response
+                        else:
+                            async for line in response.aiter_lines():
+                                if line.startswith("data:"):
+                                    started = True
+                                    yield _parse(orjson.loads(line[5:]))
+                            return
+                except httpx.TransportError as e:
+                    if started:
+                        raise LLMGatewayError(f"Gemini stream from {model} broke off: {type(e).__name__}: {str(e)}") from e
+                    error = e
+            if isinstance(error, Exception):
+                await self._retry_or_raise(model, attempt, f"{type(error).__name__}: {str(error)}")
+            else:
+                await self._retry_or_raise(model, attempt, f"HTTP {error.status_code}", error.status_code, error)
+            attempt += 1
+
+    async def aclose(self):
+        """
+        Closes the connection pool of the calling event loop.
+        """
+        binding = self._bindings.pop(asyncio.get_running_loop(), None)
+        if binding is not None:
+            await binding.client.aclose()
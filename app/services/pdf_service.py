@@ -1,21 +1,60 @@
+import asyncio
+import hashlib
+from collections import deque
+from concurrent.futures import Executor
+from itertools import islice
 import uuid
-import json
 import os
-from typing import List, Dict, Tuple, Any
-from fastapi import UploadFile, HTTPException, Depends
+from typing import List, Dict, Tuple, Any, Iterator, NamedTuple, Optional
+from fastapi import UploadFile, HTTPException
 from app.schemas.pdf import PDFListResponse
-from pypdf import PdfReader
 from app.core.config import settings
+from app.utils.lazy_import import LazyImport
 from app.utils.logger import logger
 from app.services.langchain_gemini_service import LangchainGeminiService
+from app.services.ingestion_service import IngestionJob, JobStage
+from app.services.text_store import TextStore
+from app.utils.metrics import EXTRACTION_SECONDS, PAGES_EXTRACTED, UPLOAD_BYTES
+
+PdfReader = LazyImport("pypdf", "PdfReader")
+# The catalog pulls in SQLAlchemy; it is imported when the first PDFService is built
+catalog_service = LazyImport("app.services.catalog_service")
+PDFCatalog = LazyImport("app.services.catalog_service", "PDFCatalog")
+
+def _document_metadata(reader: PdfReader) -> Dict:
+    info = reader.metadata
+    return {
+        "title": info.title if info and info.title else "Unknown",
+        "author": info.author if info and info.author else "Unknown",
+        "number_of_pages": len(reader.pages)
+    }
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """
+    Extracts the text of pages [start, end). Runs in a worker process.
+    """
+    with open(file_path, "rb") as file:
+        reader = PdfReader(file)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+class StoredUpload(NamedTuple):
+    pdf_id: str
+    file_path: str
+    content_hash: str
+    duplicate: bool
 
 class PDFService:
-    def __init__(self, langchain_service: LangchainGeminiService = Depends()):
+    def __init__(self, langchain_service: Optional[LangchainGeminiService] = None, extract_executor: Optional[Executor] = None, catalog: Optional[PDFCatalog] = None):
         self.pdf_dir = settings.PDF_STORAGE_DIR
         self.text_dir = os.path.join(settings.PDF_STORAGE_DIR, "extracted_text")
+        self.text_store = TextStore(self.text_dir)
         self.langchain_service = langchain_service
+        self.extract_executor = extract_executor
         os.makedirs(self.pdf_dir, exist_ok=True)
         os.makedirs(self.text_dir, exist_ok=True)
+        self.catalog = catalog or PDFCatalog()
+        if self.catalog.count() == 0:
+            self.catalog.sync_from_storage(self.pdf_dir, self.text_store)
         logger.info(f"PDFService initialized with storage directory: {self.pdf_dir}")
 
     async def get_pdf_path(self, pdf_id: str) -> str:
@@ -27,133 +66,309 @@ class PDFService:
             raise FileNotFoundError(f"PDF with id {pdf_id} not found")
         return pdf_path
 
-    async def process_pdf(self, file: UploadFile) -> str:
-        # Check file size
-        file_size = await file.read()
-        await file.seek(0)
-        if len(file_size) > settings.MAX_PDF_SIZE:
+    async def save_upload(self, file: UploadFile, tenant_id: str = "default") -> StoredUpload:
+        """
+        Streams an uploaded PDF to storage in fixed-size chunks.
+
+        The size limit is enforced as bytes arrive and a SHA-256 of the content
+        is computed on the fly. If the tenant uploaded a PDF with the same
+        content before, the new copy is dropped and the existing PDF is
+        returned; other tenants' PDFs are never matched.
+
+        Returns:
+            StoredUpload: The PDF id, stored file path, content hash and whether it is a duplicate.
+        """
+        if file.size is not None and file.size > settings.MAX_PDF_SIZE:
             logger.warning(f"Attempted to upload file larger than {settings.MAX_PDF_SIZE} bytes")
-            raise HTTPException(status_code=400, detail="File too large")
+            raise HTTPException(status_code=413, detail="File too large")
 
         pdf_id = str(uuid.uuid4())
         file_path = os.path.join(self.pdf_dir, f"{pdf_id}.pdf")
-        
-        try:
-            # Save the uploaded file
-            content = await file.read()
-            with open(file_path, "wb") as pdf_file:
-                pdf_file.write(content)
-            
-            # Extract text and metadata from PDF
-            text, metadata = self._extract_text_and_metadata(file_path)
-            
-            # Save extracted text and metadata
-            self._save_text_and_metadata(pdf_id, text, metadata)
+        partial_path = f"{file_path}.part"
 
-            # Process and index the PDF content
-            await self.langchain_service.process_pdf(pdf_id, text)
+        try:
+            content_hash, size = await self._receive_upload(file, partial_path)
+            existing_id = self.find_by_hash(content_hash, tenant_id)
+            if existing_id is not None:
+                os.remove(partial_path)
+                logger.info(f"Uploaded PDF is a duplicate of {existing_id}")
+                return StoredUpload(existing_id, os.path.join(self.pdf_dir, f"{existing_id}.pdf"), content_hash, True)
 
-            self.langchain_service.check_index_contents()
-            
-            logger.info(f"Successfully processed PDF with ID: {pdf_id}")
-            return pdf_id
+            os.replace(partial_path, file_path)
+            self.catalog.add(pdf_id, tenant_id=tenant_id, content_hash=content_hash, size_bytes=size)
+            logger.info(f"Saved uploaded PDF with ID: {pdf_id} ({size} bytes)")
+            return StoredUpload(pdf_id, file_path, content_hash, False)
+        except HTTPException:
+            self._remove_quietly(partial_path)
+            raise
         except Exception as e:
-            logger.error(f"Error processing PDF: {str(e)}")
-            raise HTTPException(status_code=500, detail="Error processing PDF")
+            self._remove_quietly(partial_path)
+            logger.error(f"Error saving uploaded PDF: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error saving PDF")
+
+    async def replace_upload(self, pdf_id: str, file: UploadFile, tenant_id: str = "default") -> StoredUpload:
+        """
+        Streams a new version of an existing PDF next to the stored file.
+
+        The stored file and catalog entry are left untouched until
+        ``commit_replacement`` is called, so a caller that cannot queue the
+        re-indexing job can ``discard_replacement`` and keep the old version intact.
+
+        Returns:
+            StoredUpload: The PDF id, staged file path and new content hash; ``duplicate`` is True if the content did not change.
 
-    def _extract_text_and_metadata(self, file_path: str) -> Tuple[str, Dict]:
+        Raises:
+            HTTPException: 404 if the tenant has no such PDF, 413 if the file is too large.
+        """
+        document = self._owned(pdf_id, tenant_id)
+        if file.size is not None and file.size > settings.MAX_PDF_SIZE:
+            logger.warning(f"Attempted to upload file larger than {settings.MAX_PDF_SIZE} bytes")
+            raise HTTPException(status_code=413, detail="File too large")
+
+        file_path = os.path.join(self.pdf_dir, f"{pdf_id}.pdf")
+        partial_path = f"{file_path}.part"
         try:
-            with open(file_path, "rb") as file:
-                reader = PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text()
-                
-                metadata = {
-                    "title": reader.metadata.title if reader.metadata.title else "Unknown",
-                    "author": reader.metadata.author if reader.metadata.author else "Unknown",
-                    "number_of_pages": len(reader.pages)
-                }
-            logger.info(f"Extracted text and metadata from {file_path}")
-            return text, metadata
-        
+            content_hash, _ = await self._receive_upload(file, partial_path)
+            if content_hash == document.content_hash and os.path.exists(file_path):
+                os.remove(partial_path)
+                logger.info(f"Replacement for PDF {pdf_id} has unchanged content")
+                return StoredUpload(pdf_id, file_path, content_hash, True)
+            return StoredUpload(pdf_id, partial_path, content_hash, False)
+        except HTTPException:
+            self._remove_quietly(partial_path)
+            raise
         except Exception as e:
-            logger.error(f"Error extracting text and metadata from {file_path}: {str(e)}")
+            self._remove_quietly(partial_path)
+            logger.error(f"Error replacing PDF {pdf_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error saving PDF")
+
+    def commit_replacement(self, upload: StoredUpload) -> str:
+        """
+        Moves a staged replacement over the stored PDF and records its new hash.
+
+        Returns:
+            str: The path of the stored PDF.
+        """
+        file_path = os.path.join(self.pdf_dir, f"{upload.pdf_id}.pdf")
+        size = os.path.getsize(upload.file_path)
+        os.replace(upload.file_path, file_path)
+        self.catalog.update(upload.pdf_id, content_hash=upload.content_hash, size_bytes=size)
+        logger.info(f"Replaced PDF with ID: {upload.pdf_id} ({size} bytes)")
+        return file_path
+
+    def discard_replacement(self, upload: StoredUpload):
+        self._remove_quietly(upload.file_path)
+
+    async def _receive_upload(self, file: UploadFile, partial_path: str) -> Tuple[str, int]:
+        """
+        Writes an upload to ``partial_path`` chunk by chunk, enforcing the size limit.
+
+        Returns:
+            Tuple[str, int]: The SHA-256 of the content and its size in bytes.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(partial_path, "wb") as pdf_file:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.MAX_PDF_SIZE:
+                    logger.warning(f"Attempted to upload file larger than {settings.MAX_PDF_SIZE} bytes")
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                pdf_file.write(chunk)
+        UPLOAD_BYTES.observe(size)
+        return digest.hexdigest(), size
+
+    def delete_pdf(self, pdf_id: str, tenant_id: str = "default"):
+        """
+        Deletes a PDF with everything derived from it: the stored file,
+        extracted text, catalog entry, indexes and cached answers.
+
+        Raises:
+            HTTPException: 404 if the tenant has no such PDF.
+        """
+        self._owned(pdf_id, tenant_id)
+        if self.langchain_service is not None:
+            self.langchain_service.delete_pdf(pdf_id, tenant_id)
+        self.text_store.delete(pdf_id)
+        self._remove_quietly(os.path.join(self.pdf_dir, f"{pdf_id}.pdf"))
+        self.catalog.remove(pdf_id)
+        logger.info(f"Deleted PDF with ID: {pdf_id}")
+
+    def _owned(self, pdf_id: str, tenant_id: str):
+        document = self.catalog.get(pdf_id)
+        if document is None or document.tenant_id != tenant_id:
+            raise HTTPException(status_code=404, detail="PDF not found")
+        return document
+
+    def find_by_hash(self, content_hash: str, tenant_id: str = "default") -> Optional[str]:
+        """
+        Returns the id of the tenant's stored PDF with the given content hash, if any.
+        """
+        pdf_id = self.catalog.find_by_hash(content_hash, tenant_id)
+        if pdf_id is None or not os.path.exists(os.path.join(self.pdf_dir, f"{pdf_id}.pdf")):
+            return None
+        return pdf_id
+
+    def _forget_hash(self, pdf_id: str):
+        self.catalog.update(pdf_id, content_hash=None)
+
+    @staticmethod
+    def _remove_quietly(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def discard_upload(self, pdf_id: str):
+        """
+        Removes a stored PDF that will not be ingested.
+        """
+        self._remove_quietly(os.path.join(self.pdf_dir, f"{pdf_id}.pdf"))
+        self.catalog.remove(pdf_id)
+
+    async def ingest(self, pdf_id: str, file_path: str, job: Optional[IngestionJob] = None):
+        """
+        Extracts, stores and indexes a saved PDF, reporting stage progress to the job if given.
+        """
+        progress = job.report if job is not None else None
+        if progress:
+            progress(JobStage.EXTRACTING)
+
+        try:
+            # Extract text and metadata from PDF off the event loop, straight into the text store
+            with EXTRACTION_SECONDS.time():
+                metadata = await self.extract_to_store(pdf_id, file_path)
+            PAGES_EXTRACTED.inc(metadata["number_of_pages"])
+            self.catalog.update_metadata(pdf_id, metadata)
+
+            # Index the stored pages, read back one at a time
+            tenant_id = job.tenant_id if job is not None else self.tenant_of(pdf_id)
+            await self.langchain_service.index_pdf(pdf_id, lambda: self.text_store.iter_pages(pdf_id), progress=progress, tenant_id=tenant_id, fresh=True)
+        except Exception:
+            # Don't let later uploads of the same content dedupe onto a PDF that never got indexed
+            self._forget_hash(pdf_id)
             raise
-        
-    def split_text_into_chunks(self, text: str, chunk_size: int = 10000) -> List[str]:
+
+        self.langchain_service.check_index_contents()
+
+        logger.info(f"Successfully processed PDF with ID: {pdf_id}")
+
+    def tenant_of(self, pdf_id: str) -> str:
+        document = self.catalog.get(pdf_id)
+        return document.tenant_id if document is not None else "default"
+
+    async def extract_to_store(self, pdf_id: str, file_path: str) -> Dict:
         """
-        Splits the text into smaller chunks for processing.
+        Extracts a PDF's text page by page straight into the text store, so its whole text is never held in memory.
 
-        Args:
-            text (str): The text to split.
-            chunk_size (int): The maximum size of each chunk.
+        With a process pool, page ranges of ``PDF_EXTRACT_PAGES_PER_TASK`` are
+        extracted in parallel with at most ``PDF_EXTRACT_WORKERS`` ranges in
+        flight, and written in page order as they arrive.
 
         Returns:
-            List[str]: A list of text chunks.
+            Dict: The PDF metadata.
         """
-        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-    
-    def _save_text_and_metadata(self, pdf_id: str, text: str, metadata: Dict):
-        text_file_path = os.path.join(self.text_dir, f"{pdf_id}.json")
-        data = {
-            "text": text,
-            "metadata": metadata
-        }
+        def extract() -> Dict:
+            with open(file_path, "rb") as file:
+                reader = PdfReader(file)
+                metadata = _document_metadata(reader)
+                if self.extract_executor is None or metadata["number_of_pages"] <= settings.PDF_EXTRACT_PAGES_PER_TASK:
+                    self.text_store.save(pdf_id, (page.extract_text() or "" for page in reader.pages), metadata)
+                    return metadata
+            self.text_store.save(pdf_id, self._iter_page_ranges(file_path, metadata["number_of_pages"]), metadata)
+            return metadata
+
         try:
-            with open(text_file_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            logger.info(f"Saved text and metadata for PDF {pdf_id}")
+            metadata = await asyncio.to_thread(extract)
         except Exception as e:
-            logger.error(f"Error saving text and metadata for PDF {pdf_id}: {str(e)}")
+            logger.error(f"Error extracting text and metadata from {file_path}: {str(e)}")
             raise
+        logger.info(f"Extracted and stored {metadata['number_of_pages']} pages of PDF {pdf_id}")
+        return metadata
+
+    def _iter_page_ranges(self, file_path: str, page_count: int) -> Iterator[str]:
+        pages_per_task = settings.PDF_EXTRACT_PAGES_PER_TASK
+        ranges = ((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+        pending = deque(self.extract_executor.submit(_extract_page_range, file_path, start, end) for start, end in islice(ranges, settings.PDF_EXTRACT_WORKERS))
+        try:
+            while pending:
+                pages = pending.popleft().result()
+                for start, end in islice(ranges, 1):
+                    pending.append(self.extract_executor.submit(_extract_page_range, file_path, start, end))
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
 
-    async def list_pdfs(self) -> List[PDFListResponse]:
+    async def list_pdfs(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "asc",
+        title: Optional[str] = None,
+        author: Optional[str] = None,
+        min_pages: Optional[int] = None,
+        max_pages: Optional[int] = None,
+    ) -> Tuple[List[PDFListResponse], Optional[str]]:
+        """
+        Lists one page of PDFs from the catalog.
+
+        Returns:
+            Tuple[List[PDFListResponse], Optional[str]]: The PDFs and the cursor of the next page, if any.
+        """
         try:
-            pdf_list = []
-            for filename in os.listdir(self.pdf_dir):
-                if filename.endswith('.pdf'):
-                    pdf_id = filename[:-4]  # Remove .pdf extension
-                    metadata_path = os.path.join(self.text_dir, f"{pdf_id}.json")
-                        
-                    if os.path.exists(metadata_path):
-                        with open(metadata_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            metadata = data.get('metadata', {})
-                            
-                            pdf_list.append(PDFListResponse(
-                                id=pdf_id,
-                                title=metadata.get('title', 'Unknown'),
-                                author=metadata.get('author', 'Unknown'),
-                                number_of_pages=metadata.get('number_of_pages', 0)
-                            ))
-                    else:
-                        # If metadata file doesn't exist, add basic info
-                        pdf_list.append(PDFListResponse(
-                            id=pdf_id,
-                            title='Unknown',
-                            author='Unknown',
-                            number_of_pages=0
-                        ))
-                
+            documents, next_cursor = self.catalog.list(
+                limit=limit, cursor=cursor, sort=sort, order=order,
+                title=title, author=author, min_pages=min_pages, max_pages=max_pages
+            )
+            pdf_list = [
+                PDFListResponse(
+                    id=document.id,
+                    title=document.title,
+                    author=document.author,
+                    number_of_pages=document.number_of_pages
+                )
+                for document in documents
+            ]
             logger.info(f"Listed {len(pdf_list)} PDFs")
-            return pdf_list
+            return pdf_list, next_cursor
+        except catalog_service.InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             logger.error(f"Error listing PDFs: {str(e)}")
             raise HTTPException(status_code=500, detail="An error occurred while listing PDFs")    
             
     
-    async def get_pdf_text(self, pdf_id: str) -> str:
-        text_file_path = os.path.join(self.text_dir, f"{pdf_id}.json")
+    async def get_pdf_text(self, pdf_id: str, start_page: Optional[int] = None, end_page: Optional[int] = None) -> str:
+        """
+        Returns the extracted text of a PDF, optionally only pages start_page..end_page (1-based, inclusive).
+        Only the requested pages are read and decompressed.
+        """
         try:
-            if not os.path.exists(text_file_path):
+            if not self.text_store.exists(pdf_id):
                 logger.warning(f"No text found for PDF with id {pdf_id}")
                 raise HTTPException(status_code=404, detail="PDF not found")
             
-            with open(text_file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            start = start_page - 1 if start_page else 0
+            text = self.text_store.read_text(pdf_id, start, end_page)
             logger.info(f"Retrieved text for PDF {pdf_id}")
-            return data['text']
+            return text
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error retrieving text for PDF {pdf_id}: {str(e)}")
-            raise HTTPException(status_code=500, detail="Error retrieving PDF text")
\ No newline at end of file
+            raise HTTPException(status_code=500, detail="Error retrieving PDF text")
+
+    def iter_pages(self, pdf_id: str) -> Iterator[str]:
+        """
+        Returns a lazy iterator over the text of each page of a PDF, for indexing without loading the whole text.
+        """
+        if not self.text_store.exists(pdf_id):
+            logger.warning(f"No text found for PDF with id {pdf_id}")
+            raise HTTPException(status_code=404, detail="PDF not found")
+        return self.text_store.iter_pages(pdf_id)
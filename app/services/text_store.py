@@ -0,0 +1,141 @@
+import json
+import os
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+from app.utils.logger import logger
+
+
+class TextStore:
+    """
+    On-disk store for extracted PDF text and metadata.
+
+    For each PDF the store writes three files:
+
+    - ``<id>.meta.json``: small metadata record (title, author, page count)
+    - ``<id>.pages``: each page's text, zlib-compressed independently
+    - ``<id>.idx``: byte offsets of the compressed pages (uint64, one per page plus end)
+
+    Metadata can be scanned without touching the text, and any page range can
+    be read by decompressing only those pages. PDFs stored in the older
+    single-JSON format (``<id>.json``) are still readable.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, pdf_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{pdf_id}{suffix}")
+
+    def exists(self, pdf_id: str) -> bool:
+        return os.path.exists(self._path(pdf_id, ".meta.json")) or os.path.exists(self._path(pdf_id, ".json"))
+
+    def save(self, pdf_id: str, pages: Iterable[str], metadata: Dict) -> int:
+        """
+        Writes a PDF's pages, consuming them one at a time, and returns the number of pages written.
+
+        The files are written under temporary names and swapped in when complete,
+        ``.pages`` and ``.idx`` first and ``.meta.json`` last, so readers keep
+        seeing the previous text while a replacement is being extracted.
+        """
+        temporary = {suffix: self._path(pdf_id, suffix + ".tmp") for suffix in (".pages", ".idx", ".meta.json")}
+        try:
+            offsets = array("Q", [0])
+            characters = 0
+            with open(temporary[".pages"], "wb") as f:
+                for page in pages:
+                    block = zlib.compress(page.encode("utf-8"))
+                    f.write(block)
+                    offsets.append(offsets[-1] + len(block))
+                    characters += len(page)
+            with open(temporary[".idx"], "wb") as f:
+                offsets.tofile(f)
+            page_count = len(offsets) - 1
+            record = dict(metadata, number_of_pages=page_count, characters=characters)
+            with open(temporary[".meta.json"], "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False, separators=(",", ":"))
+            for suffix, path in temporary.items():
+                os.replace(path, self._path(pdf_id, suffix))
+        finally:
+            for path in temporary.values():
+                if os.path.exists(path):
+                    os.remove(path)
+        logger.info(f"Stored {page_count} pages for PDF {pdf_id} ({offsets[-1]} compressed bytes)")
+        return page_count
+
+    def load_metadata(self, pdf_id: str) -> Optional[Dict]:
+        meta_path = self._path(pdf_id, ".meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        legacy = self._load_legacy(pdf_id)
+        return legacy.get("metadata", {}) if legacy is not None else None
+
+    def page_count(self, pdf_id: str) -> int:
+        idx_path = self._path(pdf_id, ".idx")
+        if os.path.exists(idx_path):
+            return os.path.getsize(idx_path) // array("Q").itemsize - 1
+        return len(self.read_pages(pdf_id))
+
+    def iter_pages(self, pdf_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """
+        Yields the text of pages [start, end) one at a time, decompressing lazily.
+
+        Raises:
+            FileNotFoundError: If no text is stored for the PDF.
+        """
+        idx_path = self._path(pdf_id, ".idx")
+        if not os.path.exists(idx_path):
+            legacy = self._load_legacy(pdf_id)
+            if legacy is None:
+                raise FileNotFoundError(f"No text stored for PDF {pdf_id}")
+            pages = legacy["pages"] if "pages" in legacy else [legacy["text"]]
+            yield from pages[start:end]
+            return
+
+        for _ in range(3):
+            f = open(self._path(pdf_id, ".pages"), "rb")
+            offsets = self._offsets(idx_path, os.fstat(f.fileno()).st_size)
+            if offsets is not None:
+                break
+            # Opened between a save's swaps of .pages and .idx; the pair matches again right after
+            f.close()
+        else:
+            raise IOError(f"Stored text of PDF {pdf_id} does not match its page index")
+        with f:
+            page_total = len(offsets) - 1
+            end = page_total if end is None else min(end, page_total)
+            for page in range(start, end):
+                f.seek(offsets[page])
+                yield zlib.decompress(f.read(offsets[page + 1] - offsets[page])).decode("utf-8")
+
+    def read_pages(self, pdf_id: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+        return list(self.iter_pages(pdf_id, start, end))
+
+    def read_text(self, pdf_id: str, start: int = 0, end: Optional[int] = None) -> str:
+        return "\n".join(self.iter_pages(pdf_id, start, end))
+
+    def delete(self, pdf_id: str):
+        for suffix in (".meta.json", ".pages", ".idx", ".json"):
+            try:
+                os.remove(self._path(pdf_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _offsets(idx_path: str, pages_size: int) -> Optional[array]:
+        """
+        Reads the page offsets, or returns None if they do not describe a ``.pages`` file of ``pages_size`` bytes.
+        """
+        offsets = array("Q")
+        with open(idx_path, "rb") as f:
+            offsets.frombytes(f.read())
+        return offsets if offsets and offsets[-1] == pages_size else None
+
+    def _load_legacy(self, pdf_id: str) -> Optional[Dict]:
+        legacy_path = self._path(pdf_id, ".json")
+        if not os.path.exists(legacy_path):
+            return None
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return json.load(f)
@@ -1,14 +1,173 @@
-from cachetools import TTLCache, cached
+import re
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from cachetools import TTLCache
+from app.core.config import settings
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import logger
+from app.utils.metrics import ANSWER_CACHE_LOOKUPS
 
-# Create a cache with a time-to-live of 600 seconds and a maximum size of 100 items
-cache = TTLCache(maxsize=100, ttl=600)
+np = LazyImport("numpy")
 
-def cache_key(pdf_id: str, question: str) -> str:
-    return f"{pdf_id}:{question}"
+CONTRACTIONS = {
+    "what's": "what is",
+    "who's": "who is",
+    "where's": "where is",
+    "when's": "when is",
+    "how's": "how is",
+    "that's": "that is",
+    "there's": "there is",
+    "it's": "it is",
+    "isn't": "is not",
+    "aren't": "are not",
+    "doesn't": "does not",
+    "don't": "do not",
+    "can't": "can not",
+    "won't": "will not",
+}
+_CONTRACTION_PATTERN = re.compile(r"\b(" + "|".join(re.escape(c) for c in CONTRACTIONS) + r")\b")
 
-@cached(cache, key=cache_key)
-def get_cached_response(pdf_id: str, question: str) -> str:
-    return None
 
-def set_cached_response(pdf_id: str, question: str, response: str):
-    cache[cache_key(pdf_id, question)] = response
\ No newline at end of file
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question used as the exact cache key:
+    lower-cased, contractions expanded, punctuation and extra whitespace removed.
+    """
+    question = question.lower().replace("’", "'")
+    question = _CONTRACTION_PATTERN.sub(lambda match: CONTRACTIONS[match.group(1)], question)
+    return " ".join(re.sub(r"[^\w\s]", " ", question).split())
+
+
+class CachedAnswer(NamedTuple):
+    answer: str
+    vector: Optional["np.ndarray"]
+
+
+class CacheLookup(NamedTuple):
+    answer: Optional[str]
+    vector: Optional[List[float]]
+    version: int = 0
+
+
+class AnswerCache:
+    """
+    Per-PDF cache of generated answers.
+
+    A lookup first tries the normalized question as an exact key. On a miss
+    the question is embedded and compared against the cached questions of the
+    same PDF; the closest one is served if its cosine similarity reaches the
+    threshold. Entries expire after ``ttl`` seconds and are dropped when the
+    PDF is re-indexed.
+
+    Every invalidation bumps the PDF's version. A lookup returns the version
+    it saw, and ``set`` drops an answer whose PDF was re-indexed since then,
+    so an answer generated from the old index cannot outlive the new one.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None, similarity_threshold: Optional[float] = None):
+        self.entries: TTLCache = TTLCache(
+            maxsize=maxsize or settings.ANSWER_CACHE_MAXSIZE,
+            ttl=settings.ANSWER_CACHE_TTL if ttl is None else ttl,
+        )
+        self.similarity_threshold = settings.ANSWER_CACHE_SIMILARITY_THRESHOLD if similarity_threshold is None else similarity_threshold
+        self._keys_by_pdf: Dict[str, Set[Tuple[str, str]]] = {}
+        self._versions: Dict[str, int] = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    async def get(self, pdf_id: str, question: str, embed: Optional[Callable[[str], Awaitable[List[float]]]] = None) -> CacheLookup:
+        """
+        Looks up a cached answer for a question about a PDF.
+
+        Args:
+            pdf_id (str): The unique identifier of the PDF.
+            question (str): The user's question.
+            embed (Optional[Callable]): Async function embedding a question. Without it only exact matches are found.
+
+        Returns:
+            CacheLookup: The cached answer (None on a miss), the question's vector if it was embedded, and the PDF's version.
+        """
+        normalized = normalize_question(question)
+        version = self._versions.get(pdf_id, 0)
+        entry = self.entries.get((pdf_id, normalized))
+        if entry is not None:
+            self.exact_hits += 1
+            ANSWER_CACHE_LOOKUPS.inc(result="exact")
+            return CacheLookup(entry.answer, None, version)
+
+        vector = None
+        if embed is not None and self.similarity_threshold < 1:
+            try:
+                # The vector is reused as the retrieval query, so it embeds the question as asked, not the cache key
+                vector = await embed(question)
+            except Exception as e:
+                logger.warning(f"Could not embed question for answer cache lookup: {str(e)}")
+            if vector is not None:
+                answer = self._closest(pdf_id, np.asarray(vector, dtype=np.float32))
+                if answer is not None:
+                    self.semantic_hits += 1
+                    ANSWER_CACHE_LOOKUPS.inc(result="semantic")
+                    return CacheLookup(answer, vector, version)
+
+        self.misses += 1
+        ANSWER_CACHE_LOOKUPS.inc(result="miss")
+        return CacheLookup(None, vector, version)
+
+    def set(self, pdf_id: str, question: str, answer: str, vector: Optional[List[float]] = None, version: Optional[int] = None):
+        """
+        Caches an answer. With ``version`` (from the lookup made before
+        generating), the answer is dropped if the PDF was re-indexed meanwhile.
+        """
+        if version is not None and version != self._versions.get(pdf_id, 0):
+            logger.info(f"Not caching answer for PDF {pdf_id}: it was re-indexed while the answer was generated")
+            return
+        key = (pdf_id, normalize_question(question))
+        self.entries[key] = CachedAnswer(answer, _unit(vector) if vector is not None else None)
+        self._keys_by_pdf.setdefault(pdf_id, set()).add(key)
+
+    def invalidate(self, pdf_id: str):
+        """
+        Drops every cached answer for a PDF, e.g. because it was re-indexed.
+        """
+        self._versions[pdf_id] = self._versions.get(pdf_id, 0) + 1
+        for key in self._keys_by_pdf.pop(pdf_id, set()):
+            self.entries.pop(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def _closest(self, pdf_id: str, vector: "np.ndarray") -> Optional[str]:
+        keys = self._keys_by_pdf.get(pdf_id)
+        if not keys:
+            return None
+        candidates = []
+        for key in list(keys):
+            entry = self.entries.get(key)
+            if entry is None:
+                keys.discard(key)  # expired or evicted
+            elif entry.vector is not None:
+                candidates.append(entry)
+        if not candidates:
+            return None
+        similarities = np.stack([entry.vector for entry in candidates]) @ _unit(vector)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best].answer
+        return None
+
+
+def _unit(vector) -> "np.ndarray":
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,153 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+from app.utils.lazy_import import LazyImport
+from app.utils.logger import logger
+from app.utils.metrics import EMBEDDING_CACHE_LOOKUPS
+
+np = LazyImport("numpy")
+
+KEY_BYTES = 16
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed cache of embedding vectors.
+
+    Each entry is keyed by a hash of (embedding model, chunk text). Entries are
+    fixed-size records ``[key][float32 vector]`` appended to a single file
+    that is read through a memory map; only the key -> row index is held in
+    memory. Records are appended with one write per batch under an exclusive
+    file lock, so several worker processes can share a cache directory and
+    pick up each other's entries. A record torn by a crashed writer is
+    truncated away by the next append, so later records stay aligned.
+
+    Lookups and appends do file I/O; async callers run them in a thread.
+    """
+
+    def __init__(self, directory: str, model: str):
+        self.model = model
+        self.directory = os.path.join(directory, hashlib.sha1(model.encode("utf-8")).hexdigest()[:16])
+        self.records_path = os.path.join(self.directory, "vectors.bin")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._records = None
+        self._row_count = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+            self._refresh()
+            logger.info(f"Loaded embedding cache for {model} with {len(self._rows)} vectors")
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).digest()[:KEY_BYTES]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up vectors for the given texts.
+
+        Returns:
+            List[Optional[List[float]]]: The cached vector for each text, or None on a miss.
+        """
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            if self.dim is not None and any(key not in self._rows for key in keys):
+                self._refresh()
+            results = []
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    results.append(None)
+                else:
+                    results.append(self._records["vector"][row].tolist())
+            hits = sum(vector is not None for vector in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        EMBEDDING_CACHE_LOOKUPS.inc(hits, result="hit")
+        EMBEDDING_CACHE_LOOKUPS.inc(len(results) - hits, result="miss")
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """
+        Stores vectors for texts that are not cached yet.
+        """
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self._init_dim(matrix.shape[1])
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match cache dimension {self.dim}")
+
+            new_rows = {}
+            for text, vector in zip(texts, matrix):
+                key = self.key(text)
+                if key not in self._rows and key not in new_rows:
+                    new_rows[key] = vector
+            if not new_rows:
+                return
+            records = np.empty(len(new_rows), dtype=self._dtype())
+            records["key"] = [np.void(key) for key in new_rows]
+            records["vector"] = list(new_rows.values())
+            self._append(records.tobytes())
+            self._refresh()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _dtype(self) -> "np.dtype":
+        return np.dtype([("key", f"V{KEY_BYTES}"), ("vector", "<f4", (self.dim,))])
+
+    def _init_dim(self, dim: int):
+        self.dim = int(dim)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim}, f)
+
+    def _append(self, data: bytes):
+        fd = os.open(self.records_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # A writer that died mid-append leaves a partial record; appending after it would shift every later record
+            size = os.fstat(fd).st_size
+            torn = size % self._dtype().itemsize
+            if torn:
+                logger.warning(f"Truncating {torn} bytes of a partially written record from {self.records_path}")
+                os.ftruncate(fd, size - torn)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def _refresh(self):
+        """
+        Maps records appended since the last refresh, including those written
+        by other processes. A partially written trailing record is ignored.
+        """
+        if not os.path.exists(self.records_path):
+            return
+        dtype = self._dtype()
+        count = os.path.getsize(self.records_path) // dtype.itemsize
+        if count == self._row_count:
+            return
+        self._records = np.memmap(self.records_path, dtype=dtype, mode="r", shape=(count,))
+        keys = self._records["key"]
+        for row in range(self._row_count, count):
+            self._rows.setdefault(keys[row].tobytes(), row)
+        self._row_count = count
@@ -0,0 +1,63 @@
+import importlib
+import time
+from typing import Any, List, Optional
+from app.utils.startup import startup_report
+
+_pending: List["LazyImport"] = []
+
+
+class LazyImport:
+    """
+    Stand-in for a module, or one of its attributes, that imports it on first use.
+
+    Attribute access, calls and ``isinstance`` checks are forwarded to the
+    real object, so ``FAISS = LazyImport("langchain_community.vectorstores", "FAISS")``
+    can be used like the class itself, including in type hints. The proxy is
+    an ordinary module attribute, so tests can still patch it. Special
+    (dunder) attributes are not forwarded. Each module's import time is
+    added to the startup report.
+    """
+
+    def __init__(self, module: str, attribute: Optional[str] = None):
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+        _pending.append(self)
+
+    def resolve(self) -> Any:
+        target = self._target
+        if target is None:
+            # Timed including the attribute lookup, since packages like langchain_community import on attribute access
+            start = time.perf_counter()
+            module = importlib.import_module(self._module)
+            target = getattr(module, self._attribute) if self._attribute else module
+            startup_report.record_import(self._module, time.perf_counter() - start)
+            self._target = target
+        return target
+
+    def __getattr__(self, name: str) -> Any:
+        # Special attributes are looked up by typing (``List[Document]``), copy and pickle; answering them must not import
+        if name.startswith("__") or name in ("_module", "_attribute", "_target"):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.resolve()(*args, **kwargs)
+
+    def __instancecheck__(self, instance) -> bool:
+        return isinstance(instance, self.resolve())
+
+    def __subclasscheck__(self, subclass) -> bool:
+        return issubclass(subclass, self.resolve())
+
+    def __repr__(self) -> str:
+        name = f"{self._module}.{self._attribute}" if self._attribute else self._module
+        return f"<LazyImport {name}{'' if self._target is None else ' (loaded)'}>"
+
+
+def resolve_all():
+    """
+    Imports every module that is still deferred, e.g. to warm a worker up before it takes traffic.
+    """
+    for proxy in list(_pending):
+        proxy.resolve()
@@ -1,42 +1,138 @@
+import atexit
 import logging
-import json
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import orjson
 from app.core.config import settings
+from app.utils.metrics import registry
+
+LOG_RECORDS = registry.counter("log_records", "Log records written.", ("level",))
+LOG_BYTES = registry.counter("log_bytes", "Bytes of formatted log records.")
+LOG_DROPPED = registry.counter("log_records_dropped", "Log records not written.", ("reason",))
+LOG_TRUNCATED = registry.counter("log_records_truncated", "Log records whose payload was truncated.")
+
+
+def truncate(text: str, limit: int) -> str:
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
+
 
 class JSONFormatter(logging.Formatter):
+    def __init__(self, max_length: Optional[int] = None):
+        super().__init__()
+        self.max_length = settings.LOG_MAX_MESSAGE_LENGTH if max_length is None else max_length
+
     def format(self, record):
+        message = record.getMessage()
+        if 0 < self.max_length < len(message):
+            message = truncate(message, self.max_length)
+            LOG_TRUNCATED.inc()
         log_record = {
             "timestamp": datetime.utcnow().isoformat(),
             "level": record.levelname,
-            "message": record.getMessage(),
+            "message": message,
             "module": record.module,
             "function": record.funcName,
             "line": record.lineno
         }
-        return json.dumps(log_record)
+        if record.exc_info:
+            log_record["exception"] = truncate(self.formatException(record.exc_info), 4 * self.max_length)
+        return orjson.dumps(log_record).decode("utf-8")
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every ``1 / rate`` DEBUG records per logger name, so
+    high-volume debug logging can stay enabled in production.
+
+    Rates are keyed by the name passed to ``get_logger`` (e.g. "retrieval");
+    full logger names are accepted too.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default_rate: Optional[float] = None):
+        super().__init__()
+        self.rates = settings.LOG_SAMPLE_RATES if rates is None else rates
+        self.default_rate = settings.LOG_DEBUG_SAMPLE_RATE if default_rate is None else default_rate
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        name = record.name[len(__name__) + 1:] if record.name.startswith(f"{__name__}.") else record.name
+        rate = self.rates.get(name, self.rates.get(record.name, self.default_rate))
+        if rate >= 1:
+            return True
+        seen = self._seen.get(record.name, 0)
+        self._seen[record.name] = seen + 1
+        if rate > 0 and seen % round(1 / rate) == 0:
+            return True
+        LOG_DROPPED.inc(reason="sampled")
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Formats records in the calling thread and hands them to the listener
+    thread for I/O. When the queue is full the record is dropped and counted
+    instead of blocking the event loop.
+    """
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        LOG_RECORDS.inc(level=record.levelname)
+        LOG_BYTES.inc(len(record.msg))
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(reason="queue_full")
+
 
 # Remove all handlers associated with the root logger object
 root_logger = logging.getLogger()
 for handler in root_logger.handlers[:]:
     root_logger.removeHandler(handler)
 
-# create logger  
+# create logger
 logger = logging.getLogger(__name__)
 logger.setLevel(settings.LOG_LEVEL)
-logger.propagate = False 
+logger.propagate = False
 
 json_formatter = JSONFormatter()
+# Records reach the output handlers already formatted as JSON
+passthrough_formatter = logging.Formatter("%(message)s")
 
 # create file handler which logs even debug messages
 file_handler = logging.FileHandler(settings.LOG_FILE)
-file_handler.setFormatter(json_formatter)
+file_handler.setFormatter(passthrough_formatter)
 file_handler.setLevel(settings.LOG_LEVEL)
 
 # create console handler with a higher log level
 console_handler = logging.StreamHandler()
-console_handler.setFormatter(json_formatter)
+console_handler.setFormatter(passthrough_formatter)
 console_handler.setLevel(settings.LOG_LEVEL)
 
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
\ No newline at end of file
+# The event loop only formats and enqueues; a listener thread does the writing
+queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+queue_handler.setFormatter(json_formatter)
+queue_handler.addFilter(SamplingFilter())
+listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+# Add the handler to the logger
+logger.addHandler(queue_handler)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns a child of the application logger, e.g. ``get_logger("retrieval")``,
+    whose DEBUG records can be sampled separately via ``LOG_SAMPLE_RATES``,
+    keyed by the same name (``{"retrieval": 0.1}``).
+    """
+    return logger.getChild(name)
@@ -1,16 +1,224 @@
+import logging
+import threading
 import time
+from bisect import bisect_left
+from contextlib import contextmanager
 from functools import wraps
-from app.utils.logger import logger
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from app.utils.tokens import estimate_tokens
+
+# app.utils.logger records its own volume here, so look the logger up by name instead of importing it
+logger = logging.getLogger("app.utils.logger")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing value, e.g. the number of pages extracted."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}_total{self._format_labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. the ingestion queue depth."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}" for key, value in list(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in fixed buckets, from which p50/p99 can
+    be estimated. Observing is a bisect and three additions under a lock.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observes the wall time of the block, measured with the monotonic ``perf_counter``.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series is not None else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered in the Prometheus text exposition format.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"))
+FUNCTION_SECONDS = registry.histogram("function_duration_seconds", "Latency of functions decorated with PerformanceMetrics.measure_time.", ("function",))
+UPLOAD_BYTES = registry.histogram("pdf_upload_bytes", "Size of uploaded PDFs.", buckets=SIZE_BUCKETS)
+EXTRACTION_SECONDS = registry.histogram("pdf_extraction_duration_seconds", "Time to extract the text of a PDF.")
+PAGES_EXTRACTED = registry.counter("pdf_pages_extracted", "Pages extracted from PDFs.")
+CHUNKS_INDEXED = registry.counter("pdf_chunks", "Chunks produced by splitting PDF text.")
+EMBEDDING_BATCH_SECONDS = registry.histogram("embedding_batch_duration_seconds", "Latency of one embedding batch request.")
+EMBEDDED_TEXTS = registry.counter("embedding_texts", "Texts sent to the embedding model.")
+EMBEDDING_CACHE_LOOKUPS = registry.counter("embedding_cache_lookups", "Embedding cache lookups per chunk.", ("result",))
+RETRIEVAL_SECONDS = registry.histogram("retrieval_duration_seconds", "Latency of chunk retrieval for a question.", ("scope",))
+CONTEXT_TOKENS = registry.histogram("context_tokens", "Estimated tokens of retrieved context packed into a prompt.", ("scope",), buckets=TOKEN_BUCKETS)
+LLM_SECONDS = registry.histogram("llm_duration_seconds", "Latency of one LLM generation round.", ("mode",))
+LLM_TOKENS = registry.counter("llm_output_tokens", "Tokens generated by the LLM.", ("mode",))
+LLM_QUEUE_SECONDS = registry.histogram("llm_queue_wait_seconds", "Time an LLM call waited for a tenant and a global concurrency slot.")
+LLM_QUEUED_CALLS = registry.gauge("llm_queued_calls", "LLM calls waiting for a concurrency slot.")
+LLM_RETRIES = registry.counter("llm_retries", "Retried LLM calls, by HTTP status or transport error.", ("reason",))
+ANSWER_CACHE_LOOKUPS = registry.counter("answer_cache_lookups", "Answer cache lookups.", ("result",))
+COALESCED_CALLS = registry.counter("coalesced_calls", "Calls that joined an identical call already in flight.", ("operation",))
+INGEST_QUEUE_DEPTH = registry.gauge("ingest_queue_depth", "Ingestion jobs waiting for a worker.")
+INGEST_JOBS = registry.counter("ingest_jobs", "Finished ingestion jobs.", ("status",))
+IMPORT_SECONDS = registry.histogram("module_import_duration_seconds", "Time to import a module at start-up or, if deferred, on first use.", ("module",))
+SERVICE_INIT_SECONDS = registry.histogram("service_init_duration_seconds", "Time to build an application service.", ("service",))
+
+
+def count_tokens(message) -> int:
+    """
+    Output tokens of an LLM message, from its usage metadata when the model reports it.
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("output_tokens"):
+        return usage["output_tokens"]
+    return estimate_tokens(str(message.content))
+
 
 class PerformanceMetrics:
     @staticmethod
     def measure_time(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = time.perf_counter()
             result = await func(*args, **kwargs)
-            end_time = time.time()
-            execution_time = end_time - start_time
+            execution_time = time.perf_counter() - start_time
+            FUNCTION_SECONDS.observe(execution_time, function=func.__name__)
             logger.info(f"Function {func.__name__} took {execution_time:.4f} seconds to execute")
             return result
         return wrapper
@@ -18,4 +226,4 @@ class PerformanceMetrics:
     @staticmethod
     def log_response_length(response: str):
         response_length = len(response)
-        logger.info(f"Response length: {response_length} characters")
\ No newline at end of file
+        logger.info(f"Response length: {response_length} characters")
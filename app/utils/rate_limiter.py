@@ -0,0 +1,123 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from app.core.config import settings
+from app.utils.logger import logger
+
+
+class RateLimitBackend:
+    """
+    Storage for token buckets, one per client key.
+
+    ``acquire`` takes ``cost`` tokens from the client's bucket, which holds at
+    most ``capacity`` tokens and refills at ``refill_rate`` tokens per second.
+    It returns 0 when the request is allowed, otherwise the number of seconds
+    until enough tokens are available.
+    """
+
+    async def acquire(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        raise NotImplementedError
+
+
+def _take(tokens: float, updated: float, now: float, cost: float, capacity: float, refill_rate: float):
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / refill_rate
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets in an OrderedDict kept in last-use order, for a single process.
+
+    Each client costs two floats. Buckets idle for longer than ``idle_ttl``
+    are evicted from the front of the dict as requests come in. An evicted
+    bucket would have refilled completely anyway, so eviction never changes
+    a decision.
+    """
+
+    def __init__(self, idle_ttl: Optional[float] = None):
+        self.idle_ttl = settings.RATE_LIMIT_IDLE_TTL if idle_ttl is None else idle_ttl
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def acquire(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        now = time.monotonic()
+        self._evict_idle(now, max(self.idle_ttl, capacity / refill_rate))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now]
+        else:
+            self._buckets.move_to_end(key)
+        bucket[0], retry_after = _take(bucket[0], bucket[1], now, cost, capacity, refill_rate)
+        bucket[1] = now
+        return retry_after
+
+    def _evict_idle(self, now: float, idle_ttl: float):
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if now - oldest[1] < idle_ttl:
+                break
+            self._buckets.popitem(last=False)
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets in a SQLite file, shared by every worker process on the host.
+
+    Each decision is one short ``BEGIN IMMEDIATE`` transaction on the
+    client's row, run off the event loop. Idle rows are purged periodically.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: Optional[str] = None, idle_ttl: Optional[float] = None):
+        self.path = path or settings.RATE_LIMIT_SQLITE_PATH
+        self.idle_ttl = settings.RATE_LIMIT_IDLE_TTL if idle_ttl is None else idle_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    async def acquire(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        return await asyncio.to_thread(self._acquire, key, cost, capacity, refill_rate)
+
+    def _acquire(self, key: str, cost: float, capacity: float, refill_rate: float) -> float:
+        now = time.time()  # wall clock, since buckets are shared between processes
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, retry_after = _take(*(row or (capacity, now)), now, cost, capacity, refill_rate)
+                cursor.execute(
+                    "INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now),
+                )
+                self._calls += 1
+                if self._calls % self.PURGE_EVERY == 0:
+                    cursor.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - max(self.idle_ttl, capacity / refill_rate),))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return retry_after
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        logger.info(f"Using shared SQLite rate limit store at {settings.RATE_LIMIT_SQLITE_PATH}")
+        return SQLiteRateLimitBackend()
+    if settings.RATE_LIMIT_BACKEND != "memory":
+        raise ValueError(f"Unsupported rate limit backend: {settings.RATE_LIMIT_BACKEND}")
+    return InMemoryRateLimitBackend()
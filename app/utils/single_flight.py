@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+from app.utils.metrics import COALESCED_CALLS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller starts the work as a task; callers arriving while it is
+    in flight await the same task and receive its result or exception. The
+    key is forgotten as soon as the task finishes, so this deduplicates work
+    without caching results. A caller that is cancelled (e.g. its client
+    disconnected) does not cancel the work the others are waiting for.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._in_flight(key) is not None
+
+    async def wait(self, key: Hashable):
+        """
+        Waits until the call with the given key, if one is in flight, has finished, whatever its outcome.
+        """
+        task = self._in_flight(key)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs ``fn()`` unless a call with the same key is already in flight, and returns its result.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            fn (Callable[[], Awaitable[T]]): Starts the work; only called by the first caller.
+
+        Returns:
+            T: The result of the shared call.
+        """
+        task = self._in_flight(key)
+        if task is not None:
+            COALESCED_CALLS.inc(operation=self.name)
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _in_flight(self, key: Hashable) -> Optional[asyncio.Task]:
+        task = self._calls.get(key)
+        return task if task is not None and task.get_loop() is asyncio.get_running_loop() else None
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so a failure nobody awaited any more is not reported as unhandled
@@ -0,0 +1,52 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from app.utils.metrics import IMPORT_SECONDS, SERVICE_INIT_SECONDS
+
+
+class StartupReport:
+    """
+    Where a worker's start-up time goes: seconds spent importing each module
+    and building each service, in the order they happened.
+
+    Heavy modules and services are loaded on first use, so entries keep
+    arriving after the app is ready; the report shows what the first
+    requests (or the warm-up) paid for.
+    """
+
+    def __init__(self):
+        self.imports: Dict[str, float] = {}
+        self.services: Dict[str, float] = {}
+        self.ready_seconds = None
+        self._lock = threading.Lock()
+
+    def record_import(self, module: str, seconds: float):
+        with self._lock:
+            self.imports[module] = self.imports.get(module, 0.0) + seconds
+        IMPORT_SECONDS.observe(seconds, module=module)
+
+    @contextmanager
+    def time_service(self, name: str) -> Iterator[None]:
+        """
+        Records the wall time of building a service.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.services[name] = seconds
+            SERVICE_INIT_SECONDS.observe(seconds, service=name)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ready_seconds": None if self.ready_seconds is None else round(self.ready_seconds, 4),
+                "imports": {module: round(seconds, 4) for module, seconds in self.imports.items()},
+                "services": {name: round(seconds, 4) for name, seconds in self.services.items()},
+            }
+
+
+startup_report = StartupReport()
@@ -0,0 +1,36 @@
+import re
+
+# Words (including numbers) and individual punctuation marks
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _piece_tokens(piece: str) -> int:
+    # Common words are one token; longer words split into roughly 6-character pieces
+    return 1 + (len(piece) - 1) // 6
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of LLM tokens in a text without calling the model.
+
+    Subword tokenizers produce about one token per common word and per
+    punctuation mark, plus extra tokens for long words, which this counts
+    locally in a single pass.
+    """
+    return sum(_piece_tokens(match.group()) for match in PIECE_PATTERN.finditer(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts a text after the last piece that fits within ``max_tokens``.
+    """
+    used = 0
+    end = 0
+    for match in PIECE_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            break
+        end = match.end()
+    else:
+        return text
+    return text[:end]
@@ -0,0 +1,81 @@
+"""
+Compares the flat per-PDF FAISS index with the compact (int8 / product
+quantized) modes: resident bytes per chunk, bytes on disk, recall@5 against
+the flat index and search latency.
+
+    python -m benchmarks.bench_compact_index --chunks 5000 --dimension 768
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from app.core.config import settings
+from app.services.index_store import PDFIndexStore
+from tests.fakes import FakeEmbeddings
+
+WORDS = "refund shipping warranty invoice clause customer order delivery return policy period agreement".split()
+
+
+def _synthetic_chunks(count: int, dimension: int, seed: int = 0):
+    # Embeddings of real chunks cluster by topic, so draw vectors around a few hundred centres
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, count // 20), dimension)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), count)] + 0.3 * rng.standard_normal((count, dimension)).astype(np.float32)
+    texts = [f"Chunk {i}: " + " ".join(rng.choice(WORDS, 220)) for i in range(count)]
+    return texts, vectors
+
+
+def _directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _measure(store: PDFIndexStore, pdf_id: str, queries: np.ndarray, expected: np.ndarray, count: int) -> dict:
+    vectorstore = store.get(pdf_id)
+    start = time.perf_counter()
+    _, found = vectorstore.index.search(queries, 5)
+    elapsed = time.perf_counter() - start
+    # Positions are the same in every mode, since all are written from the same flat vectorstore
+    recall = np.mean([len(set(row) & set(truth)) / 5 for row, truth in zip(found, expected)])
+    return {
+        "resident_bytes_per_chunk": round(store.resident_bytes / count, 1),
+        "disk_bytes_per_chunk": round(_directory_bytes(store.index_dir(pdf_id)) / count, 1),
+        "recall_at_5": round(float(recall), 4),
+        "search_ms_per_query": round(1000 * elapsed / len(queries), 4),
+    }
+
+
+def run(chunks: int, dimension: int, queries: int, rerank_factor: int) -> dict:
+    embeddings = FakeEmbeddings(size=dimension)
+    texts, vectors = _synthetic_chunks(chunks, dimension)
+    vectorstore = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embeddings, metadatas=[{"source": "bench"}] * chunks)
+    query_vectors = vectors[np.random.default_rng(1).integers(0, chunks, queries)] + 0.1
+    _, expected = vectorstore.index.search(query_vectors, 5)
+
+    results = {"benchmark": "compact_index", "chunks": chunks, "dimension": dimension, "queries": queries, "modes": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, factor in (("flat", 0), ("sq8", 0), ("sq8", rerank_factor), ("pq", 0), ("pq", rerank_factor)):
+            settings.FAISS_RERANK_FACTOR = factor
+            name = mode if not factor else f"{mode}+rerank{factor}"
+            store = PDFIndexStore(embeddings, root_dir=os.path.join(tmp, name), mode=mode)
+            store.save("bench", vectorstore)
+            store.evict("bench")
+            results["modes"][name] = _measure(store, "bench", query_vectors, expected, chunks)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank-factor", type=int, default=settings.FAISS_RERANK_FACTOR)
+    args = parser.parse_args()
+    for chunks in args.chunks:
+        print(json.dumps(run(chunks, args.dimension, args.queries, args.rerank_factor)))
+
+
+if __name__ == "__main__":
+    main()
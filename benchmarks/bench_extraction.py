@@ -0,0 +1,59 @@
+"""
+Compares sequential and process-pool page extraction into the text store on synthetic PDFs.
+
+    python -m benchmarks.bench_extraction --pages 300 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.synthetic_pdf import make_pdf
+from app.core.config import settings
+from app.services.pdf_service import PDFService
+
+
+async def _time_extraction(service: PDFService, path: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await service.extract_to_store("bench", path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def run(pages: int, workers: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.PDF_STORAGE_DIR = os.path.join(tmp, "storage")
+        path = os.path.join(tmp, "bench.pdf")
+        make_pdf(path, pages)
+        sequential = await _time_extraction(PDFService(), path, repeat)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            service = PDFService(extract_executor=executor)
+            await service.extract_to_store("bench", path)  # spawn the worker processes before timing
+            parallel = await _time_extraction(service, path, repeat)
+    return {
+        "benchmark": "pdf_extraction",
+        "pages": pages,
+        "workers": workers,
+        "cpu_count": os.cpu_count(),
+        "sequential_seconds": round(sequential, 4),
+        "parallel_seconds": round(parallel, 4),
+        "speedup": round(sequential / parallel, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 500])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for pages in args.pages:
+        print(json.dumps(asyncio.run(run(pages, args.workers, args.repeat))))
+
+
+if __name__ == "__main__":
+    main()
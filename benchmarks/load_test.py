@@ -0,0 +1,253 @@
+"""
+Offline load test of the HTTP API with deterministic fake LLM and embedding
+backends, so it needs no API key or network.
+
+Uploads synthetic PDFs of varying size, waits for them to be indexed, then
+drives list, text and chat requests with a fixed number of concurrent users.
+Reports throughput and p50/p99 latency per scenario as JSON.
+
+    python -m benchmarks.load_test --pdfs 20 --pages 5 50 --concurrency 8 --output results.json
+    python -m benchmarks.load_test --compare baseline.json results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+import httpx
+import numpy as np
+
+os.environ.setdefault("GEMINI_API_KEY", "offline")  # the fakes replace every Gemini client
+
+from app.core.config import settings
+from app.utils.logger import logger
+from benchmarks.synthetic_pdf import make_pdf
+from tests.fakes import FakeChatModel, FakeEmbeddings
+
+Request = Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+
+
+@contextlib.contextmanager
+def _overridden_settings(**overrides) -> Iterator[None]:
+    previous = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(settings, name, value)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(latencies: List[float], statuses: List[int], elapsed: float) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 400),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2) if len(latencies) else None,
+        "mean_ms": round(float(latencies_ms.mean()), 2) if len(latencies) else None,
+    }
+
+
+async def _run_scenario(clients: List[httpx.AsyncClient], requests: List[Request]) -> Dict:
+    """
+    Sends the requests with one worker per client, each taking the next request when its previous one completes.
+    """
+    latencies, statuses, responses = [], [], [None] * len(requests)
+    pending = iter(enumerate(requests))
+
+    async def user(client: httpx.AsyncClient):
+        for i, request in pending:
+            start = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+            responses[i] = response
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(client) for client in clients))
+    return {"summary": _summarize(latencies, statuses, time.perf_counter() - start), "responses": responses}
+
+
+def _upload(path: str) -> Request:
+    async def request(client: httpx.AsyncClient) -> httpx.Response:
+        with open(path, "rb") as f:
+            return await client.post("/api/v1/pdf/upload", files={"file": (os.path.basename(path), f.read(), "application/pdf")})
+    return request
+
+
+async def _wait_indexed(client: httpx.AsyncClient, job_ids: List[str], timeout: float) -> int:
+    deadline = time.perf_counter() + timeout
+    remaining = set(job_ids)
+    failed = 0
+    while remaining and time.perf_counter() < deadline:
+        for job_id in list(remaining):
+            stage = (await client.get(f"/api/v1/pdf/jobs/{job_id}")).json()["stage"]
+            if stage in ("indexed", "failed"):
+                remaining.discard(job_id)
+                failed += stage == "failed"
+        await asyncio.sleep(0.05)
+    return failed + len(remaining)
+
+
+async def run(pdfs: int = 10, pages: List[int] = (5, 50), concurrency: int = 8, requests: int = 200, chat_requests: int = 50, llm_latency: float = 0.2, embedding_latency: float = 0.05, storage_dir: Optional[str] = None) -> dict:
+    """
+    Runs every scenario against an in-process app and returns the results.
+
+    Args:
+        pdfs (int): Number of synthetic PDFs to upload; their page counts cycle through ``pages``.
+        pages (List[int]): Page counts of the synthetic PDFs.
+        concurrency (int): Number of simulated users sending requests at the same time.
+        requests (int): Requests per list and text scenario.
+        chat_requests (int): Requests in the chat scenario, each with a distinct question.
+        llm_latency (float): Seconds per fake LLM call.
+        embedding_latency (float): Seconds per fake embedding batch.
+        storage_dir (Optional[str]): Where to keep PDFs and indexes; a temporary directory by default.
+    """
+    with contextlib.ExitStack() as stack:
+        root = storage_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(_overridden_settings(
+            PDF_STORAGE_DIR=os.path.join(root, "pdf_storage"),
+            FAISS_INDEX_PATH=os.path.join(root, "faiss_index"),
+            EMBEDDING_CACHE_DIR=os.path.join(root, "embedding_cache"),
+            RATE_LIMIT_SQLITE_PATH=os.path.join(root, "rate_limit.db"),
+            RATE_LIMIT_MAX_REQUESTS=10 ** 9,
+            PDF_EXTRACT_WORKERS=1,
+        ))
+        # Imported after the settings are in place, since the middleware reads them at import
+        from app.core.container import ServiceContainer
+        from app.main import app
+        from app.services.langchain_gemini_service import LangchainGeminiService
+
+        llm = FakeChatModel(latency=llm_latency)
+        container = ServiceContainer(langchain_service=LangchainGeminiService(llm=llm, embeddings=FakeEmbeddings(latency=embedding_latency)))
+        previous_container = getattr(app.state, "container", None)
+        app.state.container = container
+
+        paths = []
+        for i in range(pdfs):
+            paths.append(os.path.join(root, f"synthetic-{i}.pdf"))
+            make_pdf(paths[-1], pages[i % len(pages)], title=f"Synthetic document {i}", seed=i)
+
+        # Every simulated user has its own client address, so rate limits apply per user as in production
+        clients = [
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(f"10.0.{i // 250}.{i % 250 + 1}", 1000)), base_url="http://loadtest", timeout=None)
+            for i in range(concurrency)
+        ]
+        try:
+            results = {}
+            upload = await _run_scenario(clients, [_upload(path) for path in paths])
+            results["upload"] = upload["summary"]
+            job_ids = [response.json()["job_id"] for response in upload["responses"] if response.status_code == 202]
+            pdf_ids = [response.json()["id"] for response in upload["responses"] if response.status_code == 202]
+
+            start = time.perf_counter()
+            failed = await _wait_indexed(clients[0], job_ids, timeout=600)
+            ingest_seconds = time.perf_counter() - start
+            results["ingest"] = {
+                "pdfs": len(job_ids),
+                "pages": sum(pages[i % len(pages)] for i in range(pdfs)),
+                "failed": failed,
+                "seconds": round(ingest_seconds, 3),
+                "pages_per_second": round(sum(pages[i % len(pages)] for i in range(pdfs)) / ingest_seconds, 2) if ingest_seconds else None,
+            }
+
+            list_requests = [lambda client: client.get("/api/v1/pdf/list", params={"limit": 50})] * requests
+            results["list"] = (await _run_scenario(clients, list_requests))["summary"]
+
+            text_requests = [(lambda pdf_id: lambda client: client.get(f"/api/v1/pdf/{pdf_id}/text", params={"start_page": 1, "end_page": 3}))(pdf_ids[i % len(pdf_ids)]) for i in range(requests)]
+            results["text"] = (await _run_scenario(clients, text_requests))["summary"]
+
+            chat_calls = [
+                (lambda pdf_id, question: lambda client: client.post(f"/api/v1/chat/{pdf_id}", params={"question": question}))(pdf_ids[i % len(pdf_ids)], f"What does section {i} say about refunds?")
+                for i in range(chat_requests)
+            ]
+            results["chat"] = (await _run_scenario(clients, chat_calls))["summary"]
+            results["chat"]["llm_calls"] = llm.calls
+        finally:
+            for client in clients:
+                await client.aclose()
+            await container.shutdown()
+            app.state.container = previous_container
+
+    return {
+        "benchmark": "load_test",
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "pdfs": pdfs, "pages": list(pages), "concurrency": concurrency, "requests": requests, "chat_requests": chat_requests,
+            "llm_latency": llm_latency, "embedding_latency": embedding_latency, "cpu_count": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> dict:
+    """
+    Relative change of p50, p99 and throughput per scenario; p99 growing by
+    more than ``tolerance`` counts as a regression.
+    """
+    report = {"baseline": baseline.get("commit"), "current": current.get("commit"), "scenarios": {}, "regressions": []}
+    for name, stats in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None or "p99_ms" not in stats:
+            continue
+        changes = {
+            metric: round(stats[metric] / before[metric] - 1, 3)
+            for metric in ("p50_ms", "p99_ms", "throughput_rps")
+            if stats.get(metric) and before.get(metric)
+        }
+        report["scenarios"][name] = changes
+        if changes.get("p99_ms", 0) > tolerance:
+            report["regressions"].append(name)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=10)
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--chat-requests", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p99 increase when comparing")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        report = compare(baseline, current, args.tolerance)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["regressions"] else 0)
+
+    logger.setLevel(logging.WARNING)  # per-request INFO logging would dominate the measurements
+    results = asyncio.run(run(args.pdfs, args.pages, args.concurrency, args.requests, args.chat_requests, args.llm_latency, args.embedding_latency))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
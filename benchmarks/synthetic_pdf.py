@@ -0,0 +1,76 @@
+import random
+from typing import List, Optional
+
+WORDS = (
+    "agreement party clause section payment invoice delivery warranty liability notice term "
+    "termination renewal confidential service customer supplier refund policy schedule annex "
+    "obligation breach remedy fee period written consent effective date governing law dispute"
+).split()
+
+
+def page_lines(page_number: int, lines_per_page: int, rng: random.Random) -> List[str]:
+    lines = [f"Section {page_number}.1"]
+    for line_number in range(1, lines_per_page):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+        if line_number % 10 == 0:
+            words.append(f"SKU-{rng.randint(10000, 99999)}")
+        lines.append(" ".join(words).capitalize() + ".")
+    return lines
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 40, title: str = "Synthetic document", author: str = "Benchmark", seed: int = 0, page_texts: Optional[List[List[str]]] = None) -> List[List[str]]:
+    """
+    Writes a text-only PDF with the given number of pages and returns the lines of each page.
+
+    Args:
+        path (str): Where to write the PDF.
+        pages (int): Number of pages to generate.
+        lines_per_page (int): Lines of pseudo-random text per page.
+        title (str): Document title stored in the PDF info dictionary.
+        author (str): Document author stored in the PDF info dictionary.
+        seed (int): Seed for the text generator, so output is reproducible.
+        page_texts (Optional[List[List[str]]]): Explicit lines per page instead of generated text.
+
+    Returns:
+        List[List[str]]: The lines written on each page.
+    """
+    rng = random.Random(seed)
+    if page_texts is None:
+        page_texts = [page_lines(number, lines_per_page, rng) for number in range(1, pages + 1)]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Title ({_escape(title)}) /Author ({_escape(author)}) >>".encode("latin-1"),
+    ]
+    page_refs = []
+    for lines in page_texts:
+        stream = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        stream += [f"({_escape(line)}) Tj T*" for line in lines]
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>".encode("latin-1"))
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(out)
+    return page_texts
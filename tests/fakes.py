@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import numpy as np
+import orjson
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.core.config import settings
+
+
+def use_tmp_storage(monkeypatch, tmp_path):
+    """
+    Points every on-disk location in the settings at a temporary directory.
+    """
+    monkeypatch.setattr(settings, "PDF_STORAGE_DIR", str(tmp_path / "pdf_storage"))
+    monkeypatch.setattr(settings, "FAISS_INDEX_PATH", str(tmp_path / "faiss_index"))
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_DIR", str(tmp_path / "embedding_cache"))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local embedding backend with configurable latency.
+
+    Vectors are derived from a hash of the text, so identical texts always
+    embed identically. ``fail_times`` makes the first N calls raise.
+    """
+
+    def __init__(self, size: int = 32, latency: float = 0.0, fail_times: int = 0):
+        self.size = size
+        self.model = f"fake-embedding-{size}"
+        self.latency = latency
+        self.fail_times = fail_times
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).astype("float32").tolist()
+
+    def _record_call(self, texts: List[str]):
+        self.calls += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RuntimeError("fake embedding backend unavailable")
+        self.texts_embedded += len(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._record_call(texts)
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._record_call(texts)
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local chat model with configurable latency.
+
+    The answer is ``words`` words picked from a hash of the prompt, so the
+    same prompt always gets the same answer. A call takes ``latency`` seconds;
+    streaming spreads that time over the words.
+    """
+
+    latency: float = 0.0
+    words: int = 40
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "".join(str(message.content) for message in messages)
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little")
+        vocabulary = ("the", "refund", "policy", "applies", "within", "thirty", "days", "of", "delivery", "section")
+        rng = np.random.default_rng(seed)
+        return [vocabulary[i] for i in rng.integers(0, len(vocabulary), self.words)]
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(self._answer(messages))))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self.calls += 1
+        for word in self._answer(messages):
+            time.sleep(self.latency / self.words)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"{word} "))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self.calls += 1
+        for word in self._answer(messages):
+            await asyncio.sleep(self.latency / self.words)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"{word} "))
+
+
+class GeminiStub:
+    """
+    Local stand-in for the Gemini REST API, served in-process through ``httpx.ASGITransport``.
+
+    Answers ``generateContent`` with ``answer`` and ``streamGenerateContent``
+    with one server-sent event per word, after ``latency`` seconds. The
+    first ``fail_times`` calls get a 429 with ``Retry-After: 0``; with
+    ``error_status`` set every call fails with that status instead. Tracks
+    how many calls it got and the most it served at once.
+    """
+
+    def __init__(self, answer: str = "Stub answer.", latency: float = 0.0, fail_times: int = 0, error_status: Optional[int] = None):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse, StreamingResponse
+
+        self.answer = answer
+        self.latency = latency
+        self.fail_times = fail_times
+        self.error_status = error_status
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.app = FastAPI()
+
+        @self.app.post("/v1beta/models/{target}")
+        async def models(target: str, request: Request):
+            self.calls += 1
+            if self.error_status is not None:
+                return JSONResponse({"error": {"code": self.error_status}}, status_code=self.error_status)
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                return JSONResponse({"error": {"code": 429}}, status_code=429, headers={"Retry-After": "0"})
+            body = await request.json()
+            prompt_tokens = sum(len(part["text"].split()) for turn in body["contents"] for part in turn["parts"])
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                self.active -= 1
+            if target.endswith(":streamGenerateContent"):
+                return StreamingResponse(self._events(prompt_tokens), media_type="text/event-stream")
+            return JSONResponse(self._payload(self.answer, prompt_tokens))
+
+    def _payload(self, text: str, prompt_tokens: int) -> dict:
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": len(self.answer.split())},
+        }
+
+    async def _events(self, prompt_tokens: int) -> AsyncIterator[str]:
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            text = word if i == len(words) - 1 else f"{word} "
+            yield f"data: {orjson.dumps(self._payload(text, prompt_tokens)).decode()}\r\n\r\n"
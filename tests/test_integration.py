@@ -1,23 +1,377 @@
+import json
+import os
+import time
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
+from tests.fakes import FakeEmbeddings, use_tmp_storage
+from app.core.container import ServiceContainer
+from app.services.langchain_gemini_service import LangchainGeminiService
+from app.services.pdf_service import PDFService
 
 client = TestClient(app)
 
-def test_upload_pdf():
+@pytest.fixture(autouse=True)
+def tmp_storage(monkeypatch, tmp_path):
+    # Fresh storage and services per test, so nothing is written into the working tree
+    use_tmp_storage(monkeypatch, tmp_path)
+    monkeypatch.setattr(app.state, "container", None, raising=False)
+
+def test_upload_pdf(monkeypatch, tmp_path):
+    # Fresh storage, so an upload from an earlier run is not deduplicated
+    use_tmp_storage(monkeypatch, tmp_path)
+    monkeypatch.setattr(app.state, "container", None, raising=False)
     with open("tests/test_files/sample.pdf", "rb") as pdf_file:
         response = client.post(
             "/api/v1/pdf/upload",
             files={"file": ("sample.pdf", pdf_file, "application/pdf")}
         )
-    assert response.status_code == 200
+    assert response.status_code == 202
     assert "id" in response.json()
+    assert "job_id" in response.json()
+
+def test_oversized_upload_is_rejected_before_the_endpoint(monkeypatch, tmp_path):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "MAX_PDF_SIZE", 1024)
+    body = b"%PDF-1.4 " + b"x" * (128 * 1024)
+    response = client.post("/api/v1/pdf/upload", files={"file": ("large.pdf", body, "application/pdf")})
+    assert response.status_code == 413
+
+    # Without a Content-Length the body is counted as it arrives
+    boundary = "limit"
+    parts = [f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"large.pdf\"\r\nContent-Type: application/pdf\r\n\r\n".encode(), body, f"\r\n--{boundary}--\r\n".encode()]
+    response = client.post("/api/v1/pdf/upload", content=iter(parts), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    assert response.status_code == 413
+    assert not os.path.exists(settings.PDF_STORAGE_DIR) or not any(name.endswith(".pdf") for name in os.listdir(settings.PDF_STORAGE_DIR))
 
 def test_list_pdfs():
     response = client.get("/api/v1/pdf/list")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+def test_services_are_shared_across_requests(monkeypatch, tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    container = ServiceContainer(
+        langchain_service=LangchainGeminiService(
+            llm=FakeListChatModel(responses=["ok"]),
+            embeddings=FakeEmbeddings(),
+        )
+    )
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+
+    inits = []
+    original_init = PDFService.__init__
+
+    def counting_init(self, *args, **kwargs):
+        inits.append(self)
+        original_init(self, *args, **kwargs)
+
+    monkeypatch.setattr(PDFService, "__init__", counting_init)
+    for _ in range(2):
+        response = client.get("/api/v1/pdf/list")
+        assert response.status_code == 200
+        assert response.json() == []
+    assert len(inits) == 1  # built on first use, then shared
+
+def test_upload_runs_in_background_and_reports_progress(monkeypatch, tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    container = ServiceContainer(
+        langchain_service=LangchainGeminiService(
+            llm=FakeListChatModel(responses=["ok"]),
+            embeddings=FakeEmbeddings(),
+        )
+    )
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+    with TestClient(app) as local_client:
+        with open("tests/test_files/sample.pdf", "rb") as pdf_file:
+            response = local_client.post(
+                "/api/v1/pdf/upload",
+                files={"file": ("sample.pdf", pdf_file, "application/pdf")}
+            )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        for _ in range(200):
+            job = local_client.get(f"/api/v1/pdf/jobs/{job_id}").json()
+            if job["stage"] in ("indexed", "failed"):
+                break
+            time.sleep(0.05)
+        assert job["stage"] == "indexed"
+        assert job["done"] == job["total"] > 0
+        assert job["pdf_id"] in container.langchain_service.pdf_vectorstores
+        assert local_client.get("/api/v1/pdf/jobs/unknown").status_code == 404
+
+        full_text = local_client.get(f"/api/v1/pdf/{job['pdf_id']}/text").json()
+        first_page = local_client.get(f"/api/v1/pdf/{job['pdf_id']}/text", params={"start_page": 1, "end_page": 1}).json()
+        assert first_page and full_text.startswith(first_page) and len(first_page) < len(full_text)
+
+async def _call_asgi(method, path, query=""):
+    """
+    Calls the ASGI app directly and records when each body chunk is sent.
+    """
+    import asyncio
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": query.encode(), "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    disconnected = asyncio.Event()
+    request_sent = False
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append((time.perf_counter(), message["body"].decode()))
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    disconnected.set()
+    return start, chunks
+
+@pytest.mark.asyncio
+async def test_stream_chat_sends_sources_then_tokens(monkeypatch, tmp_path):
+    import json
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    answer = "Refunds are accepted within thirty days of purchase."
+    service = LangchainGeminiService(llm=FakeListChatModel(responses=[answer], sleep=0.01), embeddings=FakeEmbeddings())
+    await service.process_pdf("streamed", "Refund policy. Customers may return items within thirty days.")
+    monkeypatch.setattr(app.state, "container", ServiceContainer(langchain_service=service), raising=False)
+
+    start, chunks = await _call_asgi("POST", "/api/v1/chat/streamed/stream", "question=What+is+the+refund+policy")
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for _, chunk in chunks for block in chunk.strip().split("\n\n")
+    ]
+    assert events[0] == ("sources", {"sources": ["streamed:1"]})
+    assert "".join(data["text"] for kind, data in events if kind == "token") == answer
+    assert events[-1][0] == "done" and events[-1][1]["context_tokens"] > 0
+
+    first_token_at = next(at for at, chunk in chunks if "event: token" in chunk)
+    time_to_first_byte = first_token_at - start
+    total = chunks[-1][0] - start
+    assert time_to_first_byte < total / 4
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_questions_share_one_answer(monkeypatch, tmp_path):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=FakeListChatModel(responses=["First answer.", "Second answer."]), embeddings=FakeEmbeddings())
+    container = ServiceContainer(langchain_service=service)
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+    container.pdf_service.catalog.add("shared", tenant_id="default")
+    text_reads = []
+
+    def iter_pages(pdf_id):
+        text_reads.append(pdf_id)
+        return ["Refund policy. Customers may return items within thirty days."]
+
+    monkeypatch.setattr(container.pdf_service, "iter_pages", iter_pages)
+    questions = ["What is the refund policy?", "what's the refund policy", "What is the refund policy"] * 2
+    results = await asyncio.gather(*(
+        _call_asgi("POST", "/api/v1/chat/shared", f"question={question.replace(' ', '+')}") for question in questions
+    ))
+
+    bodies = {chunks[0][1] for _, chunks in results}
+    assert len(bodies) == 1 and "First answer." in bodies.pop()
+    assert text_reads == ["shared"]
+
+@pytest.mark.asyncio
+async def test_chat_embeds_the_question_once_and_not_for_unknown_pdfs(monkeypatch, tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    service = LangchainGeminiService(llm=FakeListChatModel(responses=["Within thirty days."]), embeddings=FakeEmbeddings())
+    await service.process_pdf("known", "Refund policy. Customers may return items within thirty days.")
+    monkeypatch.setattr(app.state, "container", ServiceContainer(langchain_service=service), raising=False)
+    embedded = []
+    embed_query = service.embeddings.aembed_query
+
+    async def counting_embed_query(text):
+        embedded.append(text)
+        return await embed_query(text)
+
+    monkeypatch.setattr(service.embeddings, "aembed_query", counting_embed_query)
+    _, chunks = await _call_asgi("POST", "/api/v1/chat/unknown", "question=What+is+the+refund+policy")
+    assert "not found" in chunks[0][1] and embedded == []
+
+    _, chunks = await _call_asgi("POST", "/api/v1/chat/known", "question=What+is+the+refund+policy")
+    assert "Within thirty days." in chunks[0][1] and len(embedded) == 1
+
+def test_chat_across_pdfs_searches_one_tenant_shard(monkeypatch, tmp_path):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=FakeListChatModel(responses=["Combined answer."]), embeddings=FakeEmbeddings())
+    container = ServiceContainer(langchain_service=service)
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+    documents = {
+        "refunds": ("acme", "Refund policy. Customers may return items within thirty days."),
+        "shipping": ("acme", "Shipping policy. Orders ship within two business days."),
+        "secrets": ("globex", "Internal memo. Quarterly numbers are confidential."),
+    }
+    for pdf_id, (tenant_id, text) in documents.items():
+        container.pdf_service.catalog.add(pdf_id, tenant_id=tenant_id)
+        asyncio.run(service.process_pdf(pdf_id, text, tenant_id=tenant_id))
+
+    headers = {"X-Tenant-ID": "acme"}
+    response = client.post("/api/v1/chat", params={"question": "What is the refund policy?", "pdf_ids": ["refunds"]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["response"] == "Answer: Combined answer.\n\nSources: ['refunds:1']"
+
+    response = client.post("/api/v1/chat", params={"question": "What are the store policies?"}, headers=headers)
+    assert response.status_code == 200
+    assert "refunds" in response.json()["response"] and "shipping" in response.json()["response"]
+    assert "secrets" not in response.json()["response"]
+
+    response = client.post("/api/v1/chat", params={"question": "What are the quarterly numbers?", "pdf_ids": ["secrets"]}, headers=headers)
+    assert response.status_code == 404
+
+def test_chat_goes_through_llm_gateway_to_stub_server(monkeypatch, tmp_path):
+    import asyncio
+    import httpx
+    from app.services.llm_gateway import LLMGateway
+    from tests.fakes import GeminiStub
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    stub = GeminiStub(answer="Refunds are accepted within thirty days.", fail_times=1)
+    gateway = LLMGateway(api_key="test", base_url="http://gemini.test", transport=httpx.ASGITransport(app=stub.app), retry_backoff=0)
+    container = ServiceContainer(llm_gateway=gateway, langchain_service=LangchainGeminiService(gateway=gateway, embeddings=FakeEmbeddings()))
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+    container.pdf_service.catalog.add("refunds", tenant_id="acme")
+    asyncio.run(container.langchain_service.process_pdf("refunds", "Refund policy. Customers may return items within thirty days.", tenant_id="acme"))
+
+    response = client.post("/api/v1/chat", params={"question": "What is the refund policy?", "pdf_ids": ["refunds"]}, headers={"X-Tenant-ID": "acme"})
+    assert response.status_code == 200
+    assert response.json()["response"] == "Answer: Refunds are accepted within thirty days.\n\nSources: ['refunds:1']"
+    assert stub.calls == 2
+
+    response = client.post("/api/v1/chat/refunds/stream", params={"question": "How long do I have to return items?"})
+    assert response.status_code == 200
+    assert "Refunds are accepted within thirty days." == "".join(
+        json.loads(line[len("data: "):])["text"] for line in response.text.splitlines() if line.startswith("data: ") and '"text"' in line
+    )
+
+def test_single_pdf_chats_count_against_the_owning_tenant(monkeypatch, tmp_path):
+    import asyncio
+    import httpx
+    from app.services.llm_gateway import LLMGateway
+    from tests.fakes import GeminiStub
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    stub = GeminiStub(answer="Refunds are accepted within thirty days.", latency=0.2)
+    gateway = LLMGateway(api_key="test", base_url="http://gemini.test", transport=httpx.ASGITransport(app=stub.app), retry_backoff=0, max_concurrency=4, max_concurrency_per_tenant=1)
+    container = ServiceContainer(llm_gateway=gateway, langchain_service=LangchainGeminiService(gateway=gateway, embeddings=FakeEmbeddings()))
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+
+    async def chat_concurrently():
+        for tenant in ("acme", "globex"):
+            container.pdf_service.catalog.add(f"{tenant}-refunds", tenant_id=tenant)
+            await container.langchain_service.process_pdf(f"{tenant}-refunds", "Refund policy. Customers may return items within thirty days.", tenant_id=tenant)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as local_client:
+            return await asyncio.gather(
+                local_client.post("/api/v1/chat/acme-refunds", params={"question": "What is the refund policy of acme?"}),
+                local_client.post("/api/v1/chat/globex-refunds/stream", params={"question": "What is the refund policy of globex?"}),
+            )
+
+    # Neither request sends X-Tenant-ID; each PDF's owner gets its own slot, so both answers are generated at once
+    responses = asyncio.run(chat_concurrently())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert stub.calls == 2 and stub.max_active == 2
+    assert responses[0].json()["context_tokens"] > 0
+
+def test_replace_and_delete_pdf(monkeypatch, tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from benchmarks.synthetic_pdf import make_pdf
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    container = ServiceContainer(
+        langchain_service=LangchainGeminiService(
+            llm=FakeListChatModel(responses=["ok"]),
+            embeddings=FakeEmbeddings(),
+        )
+    )
+    monkeypatch.setattr(app.state, "container", container, raising=False)
+    make_pdf(str(tmp_path / "v1.pdf"), pages=2, seed=1)
+    make_pdf(str(tmp_path / "v2.pdf"), pages=3, seed=1)
+
+    def wait_for(local_client, job_id):
+        for _ in range(200):
+            job = local_client.get(f"/api/v1/pdf/jobs/{job_id}").json()
+            if job["stage"] in ("indexed", "failed"):
+                return job
+            time.sleep(0.05)
+        return job
+
+    with TestClient(app) as local_client:
+        with open(tmp_path / "v1.pdf", "rb") as pdf_file:
+            upload = local_client.post("/api/v1/pdf/upload", files={"file": ("v1.pdf", pdf_file, "application/pdf")}).json()
+        assert wait_for(local_client, upload["job_id"])["stage"] == "indexed"
+        pdf_id = upload["id"]
+
+        with open(tmp_path / "v1.pdf", "rb") as pdf_file:
+            response = local_client.put(f"/api/v1/pdf/{pdf_id}", files={"file": ("v1.pdf", pdf_file, "application/pdf")})
+        assert response.status_code == 200 and response.json()["job_id"] is None
+
+        # The queue fills up while the new version is arriving: the stored PDF and its hash stay as they were
+        from app.services.ingestion_service import QueueFullError
+        checks = []
+        def check_capacity(tenant_id):
+            checks.append(tenant_id)
+            if len(checks) > 1:
+                raise QueueFullError("Ingestion queue is full, retry later")
+        original_hash = container.pdf_service.catalog.get(pdf_id).content_hash
+        monkeypatch.setattr(container.ingestion_queue, "check_capacity", check_capacity)
+        with open(tmp_path / "v2.pdf", "rb") as pdf_file:
+            response = local_client.put(f"/api/v1/pdf/{pdf_id}", files={"file": ("v2.pdf", pdf_file, "application/pdf")})
+        assert response.status_code == 503
+        assert container.pdf_service.catalog.get(pdf_id).content_hash == original_hash
+        assert "Section 3.1" not in local_client.get(f"/api/v1/pdf/{pdf_id}/text").json()
+        assert not any(name.endswith(".part") for name in os.listdir(container.pdf_service.pdf_dir))
+        monkeypatch.delattr(container.ingestion_queue, "check_capacity")
+
+        with open(tmp_path / "v2.pdf", "rb") as pdf_file:
+            response = local_client.put(f"/api/v1/pdf/{pdf_id}", files={"file": ("v2.pdf", pdf_file, "application/pdf")})
+        assert response.status_code == 202
+        assert wait_for(local_client, response.json()["job_id"])["stage"] == "indexed"
+        assert "Section 3.1" in local_client.get(f"/api/v1/pdf/{pdf_id}/text").json()
+
+        assert local_client.delete(f"/api/v1/pdf/{pdf_id}", headers={"X-Tenant-ID": "other"}).status_code == 404
+        assert local_client.delete(f"/api/v1/pdf/{pdf_id}").status_code == 204
+        assert local_client.delete(f"/api/v1/pdf/{pdf_id}").status_code == 404
+        assert local_client.get(f"/api/v1/pdf/{pdf_id}/text").status_code == 404
+        assert local_client.get("/api/v1/pdf/list").json() == []
+        assert pdf_id not in container.langchain_service.pdf_vectorstores
+        stored = os.listdir(container.pdf_service.pdf_dir) + os.listdir(container.pdf_service.text_dir)
+        assert not any(name.startswith(pdf_id) for name in stored)
+
+def test_metrics_endpoint_exposes_stage_histograms():
+    client.get("/api/v1/pdf/list")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/pdf/list",status="200"}' in response.text
+    for name in ("embedding_batch_duration_seconds", "retrieval_duration_seconds", "llm_duration_seconds", "pdf_pages_extracted", "ingest_queue_depth"):
+        assert f"# TYPE {name}" in response.text
+
 @pytest.mark.parametrize("endpoint", [
     "/api/v1/pdf/upload",
     "/api/v1/pdf/list",
@@ -27,4 +381,19 @@ def test_rate_limiting(endpoint):
     for _ in range(101):  # Rate limit is set to 100
         response = client.get(endpoint)
     assert response.status_code == 429
-    assert response.json() == {"detail": "Too many requests"}
\ No newline at end of file
+    assert response.json() == {"detail": "Too many requests"}
+@pytest.mark.asyncio
+async def test_offline_load_test_reports_every_scenario(tmp_path):
+    from benchmarks.load_test import compare, run
+
+    results = await run(pdfs=2, pages=[2, 4], concurrency=3, requests=6, chat_requests=3, llm_latency=0.0, embedding_latency=0.0, storage_dir=str(tmp_path))
+
+    scenarios = results["scenarios"]
+    assert set(scenarios) == {"upload", "ingest", "list", "text", "chat"}
+    assert scenarios["ingest"] == {**scenarios["ingest"], "pdfs": 2, "pages": 6, "failed": 0}
+    for name in ("upload", "list", "text", "chat"):
+        assert scenarios[name]["errors"] == 0 and scenarios[name]["p50_ms"] <= scenarios[name]["p99_ms"]
+    assert scenarios["chat"]["llm_calls"] == 3
+
+    slower = {**results, "scenarios": {**scenarios, "chat": {**scenarios["chat"], "p99_ms": scenarios["chat"]["p99_ms"] * 2}}}
+    assert compare(results, slower, tolerance=0.2)["regressions"] == ["chat"]
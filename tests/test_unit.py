@@ -1,47 +1,59 @@
+import asyncio
+import os
+import time
 import pytest
-from unittest.mock import patch, mock_open, AsyncMock, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from app.services.pdf_service import PDFService
 from app.services.langchain_gemini_service import LangchainGeminiService
 from app.utils.logger import logger, JSONFormatter
+from app.services.embedding_pipeline import EmbeddingPipeline
+from tests.fakes import FakeEmbeddings, use_tmp_storage
 
 @pytest.fixture
-def pdf_service():
+def pdf_service(monkeypatch, tmp_path):
+    use_tmp_storage(monkeypatch, tmp_path)
     return PDFService()
 
 @pytest.fixture
-def langchain_service():
+def langchain_service(monkeypatch, tmp_path):
+    use_tmp_storage(monkeypatch, tmp_path)
     return LangchainGeminiService()
 
-def test_pdf_text_extraction(pdf_service):
+@pytest.mark.asyncio
+async def test_pdf_text_extraction(pdf_service, tmp_path):
     mock_pdf_content = "This is a test PDF content"
-    with patch('builtins.open', mock_open(read_data=b'dummy content')):
-        with patch('app.services.pdf_service.PdfReader') as mock_pdf_reader:
-            mock_pdf_reader.return_value.pages = [type('obj', (object,), {'extract_text': lambda: mock_pdf_content})]
-            extracted_text, _ = pdf_service._extract_text_and_metadata("dummy_path.pdf")
-            assert extracted_text == mock_pdf_content
+    path = tmp_path / "dummy_path.pdf"
+    path.write_bytes(b'dummy content')
+    with patch('app.services.pdf_service.PdfReader') as mock_pdf_reader:
+        mock_pdf_reader.return_value.pages = [type('obj', (object,), {'extract_text': lambda: mock_pdf_content})]
+        mock_pdf_reader.return_value.metadata = None
+        metadata = await pdf_service.extract_to_store("dummy", str(path))
+    assert pdf_service.text_store.read_text("dummy") == mock_pdf_content
+    assert metadata["number_of_pages"] == 1
 
 @pytest.mark.asyncio
 async def test_langchain_process_pdf(langchain_service):
     mock_pdf_id = "test_pdf_id"
     mock_text = "This is a test PDF content"
-    with patch('app.services.langchain_gemini_service.FAISS') as mock_faiss:
-        mock_faiss.from_texts.return_value = AsyncMock()
+    with patch('app.services.langchain_gemini_service.FAISS') as mock_faiss, \
+            patch.object(langchain_service.embedding_pipeline, 'embeddings', FakeEmbeddings()):
+        mock_faiss.from_embeddings.return_value = MagicMock()
         await langchain_service.process_pdf(mock_pdf_id, mock_text)
         assert mock_pdf_id in langchain_service.pdf_vectorstores
-        mock_faiss.from_texts.assert_called_once()
+        mock_faiss.from_embeddings.assert_called_once()
 
 @pytest.mark.asyncio
 async def test_langchain_query_pdf(langchain_service):
     mock_pdf_id = "test_pdf_id"
     mock_query = "What is the content?"
-    mock_vectorstore = AsyncMock()
+    mock_vectorstore = MagicMock()
     langchain_service.pdf_vectorstores[mock_pdf_id] = mock_vectorstore
     
     with patch('app.services.langchain_gemini_service.RetrievalQA') as mock_qa:
-        mock_qa.from_chain_type.return_value.return_value = {
+        mock_qa.from_chain_type.return_value.ainvoke = AsyncMock(return_value={
             "result": "This is a test answer",
             "source_documents": [MagicMock(metadata={"source": mock_pdf_id})]
-        }
+        })
         response = await langchain_service.query_pdf(mock_pdf_id, mock_query)
         assert "Answer: This is a test answer" in response
         assert f"Sources: ['{mock_pdf_id}']" in response
@@ -50,4 +62,879 @@ def test_logger_json_format():
     with patch.object(JSONFormatter, 'format') as mock_format:
         mock_format.return_value = '{"level": "INFO", "message": "Test log"}'
         logger.info("Test log")
-        assert mock_format.call_count > 0 
\ No newline at end of file
+        assert mock_format.call_count > 0 
+
+def test_pdf_index_store_persists_and_evicts(tmp_path):
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from app.services.index_store import PDFIndexStore
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    store = PDFIndexStore(embeddings, root_dir=str(tmp_path), max_bytes=1)
+    store.save("pdf_a", FAISS.from_texts(["alpha", "beta"], embeddings))
+    store.save("pdf_b", FAISS.from_texts(["gamma"], embeddings))
+
+    # Budget only fits the most recently used index, but both stay on disk
+    assert len(store) == 1
+    assert "pdf_a" in store and "pdf_b" in store
+    assert store["pdf_a"].index.ntotal == 2
+    assert len(store) == 1
+    assert store.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_embedding_pipeline_throughput_scales_with_concurrency():
+    texts = [f"chunk {i}" for i in range(40)]
+    timings = {}
+    for concurrency in (1, 8):
+        pipeline = EmbeddingPipeline(FakeEmbeddings(latency=0.05), batch_size=5, max_concurrency=concurrency)
+        start = time.perf_counter()
+        vectors = await pipeline.embed(texts)
+        timings[concurrency] = time.perf_counter() - start
+        assert len(vectors) == len(texts)
+    assert timings[1] / timings[8] > 3
+
+
+@pytest.mark.asyncio
+async def test_embedding_pipeline_retries_and_keeps_order():
+    embeddings = FakeEmbeddings(fail_times=2)
+    pipeline = EmbeddingPipeline(embeddings, batch_size=3, max_concurrency=2, max_retries=3, retry_backoff=0)
+    texts = [f"chunk {i}" for i in range(10)]
+    vectors = await pipeline.embed(texts)
+    assert vectors == embeddings.embed_documents(texts)
+    assert embeddings.calls == 4 + 2 + 1
+
+    # The retried first batch finishes last, but ordered iteration still yields it first
+    embeddings.fail_times = 1
+    assert [start async for start, _, _ in pipeline.iter_batches(texts, ordered=True)] == [0, 3, 6, 9]
+
+
+@pytest.mark.asyncio
+async def test_process_pdf_does_not_block_event_loop(tmp_path, monkeypatch):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=FakeListChatModel(responses=["ok"]), embeddings=FakeEmbeddings(latency=0.02))
+    service.embedding_pipeline.batch_size = 2
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    text = " ".join(f"sentence {i}." for i in range(2000))
+    ticker_task = asyncio.create_task(ticker())
+    await service.process_pdf("pdf", text)
+    ticker_task.cancel()
+    assert service.pdf_vectorstores["pdf"].index.ntotal == len(service.text_splitter.split_text(text))
+    assert ticks > 5
+
+    # Saving and cold-loading an index run in a thread; concurrent retrievals of a cold PDF load it once
+    import threading
+    from app.services.index_store import PDFIndexStore
+    threads = []
+    for name in ("save", "_load"):
+        method = getattr(PDFIndexStore, name)
+        monkeypatch.setattr(PDFIndexStore, name, lambda self, *args, method=method: threads.append((method.__name__, threading.current_thread())) or method(self, *args))
+    await service.process_pdf("pdf", text + " sentence 2000.")
+    service.pdf_vectorstores.evict("pdf")
+    contexts = await asyncio.gather(*(service.retrieve_context("pdf", "sentence 7", query_vector=service.embeddings.embed_query("sentence 7")) for _ in range(3)))
+    assert all(context.documents for context in contexts)
+    assert [name for name, _ in threads] == ["save", "_load"]
+    assert all(thread is not threading.main_thread() for _, thread in threads)
+
+
+def test_embedding_cache_persists_vectors_and_counts_hits(tmp_path):
+    from app.utils.embedding_cache import EmbeddingCache
+
+    embeddings = FakeEmbeddings(size=8)
+    cache = EmbeddingCache(str(tmp_path), embeddings.model)
+    cache.put_many(["a", "b"], embeddings.embed_documents(["a", "b"]))
+
+    reopened = EmbeddingCache(str(tmp_path), embeddings.model)
+    assert len(reopened) == 2
+    vectors = reopened.get_many(["a", "c"])
+    assert vectors[0] == pytest.approx(embeddings.embed_query("a"))
+    assert vectors[1] is None
+    assert reopened.stats()["hits"] == 1 and reopened.stats()["misses"] == 1
+    # Same text under another model is a different entry
+    assert EmbeddingCache(str(tmp_path), "other-model").get_many(["a"]) == [None]
+
+    # A writer that crashed mid-record must not misalign the records appended after it
+    with open(cache.records_path, "ab") as f:
+        f.write(b"torn")
+    reopened.put_many(["c"], embeddings.embed_documents(["c"]))
+    vectors = EmbeddingCache(str(tmp_path), embeddings.model).get_many(["a", "b", "c"])
+    assert vectors == [pytest.approx(embeddings.embed_query(text)) for text in ("a", "b", "c")]
+
+
+@pytest.mark.asyncio
+async def test_embedding_pipeline_only_embeds_new_chunks(tmp_path):
+    from app.utils.embedding_cache import EmbeddingCache
+
+    embeddings = FakeEmbeddings()
+    pipeline = EmbeddingPipeline(embeddings, batch_size=4, cache=EmbeddingCache(str(tmp_path), embeddings.model))
+    await pipeline.embed([f"clause {i}" for i in range(10)])
+    vectors = await pipeline.embed([f"clause {i}" for i in range(5, 15)])
+    assert embeddings.texts_embedded == 15
+    assert vectors == embeddings.embed_documents([f"clause {i}" for i in range(5, 15)])
+
+
+@pytest.mark.asyncio
+async def test_ingestion_queue_applies_backpressure_per_tenant():
+    from app.services.ingestion_service import IngestionQueue, QueueFullError, JobStage
+
+    release = asyncio.Event()
+
+    class SlowPDFService:
+        async def ingest(self, pdf_id, file_path, job):
+            job.report(JobStage.EMBEDDING, 1, 2)
+            await release.wait()
+
+    queue = IngestionQueue(SlowPDFService(), workers=1, max_queue_size=10, max_pending_per_tenant=2)
+    first = queue.submit("a", "a.pdf", "tenant-a")
+    queue.submit("b", "b.pdf", "tenant-a")
+    with pytest.raises(QueueFullError):
+        queue.submit("c", "c.pdf", "tenant-a")
+    other = queue.submit("d", "d.pdf", "tenant-b")
+
+    await asyncio.sleep(0.01)
+    assert queue.get(first.id).stage == JobStage.EMBEDDING
+    assert queue.get(other.id).stage == JobStage.QUEUED
+    release.set()
+    await asyncio.sleep(0.01)
+    assert queue.get(other.id).stage == JobStage.INDEXED
+    assert not queue.pending_per_tenant
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_save_upload_streams_enforces_size_and_dedupes(tmp_path, monkeypatch):
+    import io
+    from fastapi import HTTPException, UploadFile
+    from app.core.config import settings
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(settings, "MAX_PDF_SIZE", 16)
+    service = PDFService()
+
+    first = await service.save_upload(UploadFile(io.BytesIO(b"%PDF-1.4 same")))
+    second = await service.save_upload(UploadFile(io.BytesIO(b"%PDF-1.4 same")))
+    assert not first.duplicate
+    assert second.duplicate and second.pdf_id == first.pdf_id
+
+    # Another tenant's copy of the same file is its own PDF, not a pointer to the first tenant's
+    other = await service.save_upload(UploadFile(io.BytesIO(b"%PDF-1.4 same")), tenant_id="other")
+    assert not other.duplicate and other.pdf_id != first.pdf_id
+    assert service.catalog.get(other.pdf_id).tenant_id == "other"
+    assert (await service.save_upload(UploadFile(io.BytesIO(b"%PDF-1.4 same")), tenant_id="other")).pdf_id == other.pdf_id
+
+    with pytest.raises(HTTPException) as exc_info:
+        await service.save_upload(UploadFile(io.BytesIO(b"x" * 17)))
+    assert exc_info.value.status_code == 413
+    assert sorted(name for name in os.listdir(service.pdf_dir) if ".pdf" in name) == sorted([f"{first.pdf_id}.pdf", f"{other.pdf_id}.pdf"])
+
+
+@pytest.mark.asyncio
+async def test_parallel_page_extraction_keeps_page_order(tmp_path, monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+    from app.core.config import settings
+    from benchmarks.synthetic_pdf import make_pdf
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    monkeypatch.setattr(settings, "PDF_EXTRACT_PAGES_PER_TASK", 3)
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, 10, lines_per_page=5, title="Ten pages")
+
+    monkeypatch.setattr(settings, "PDF_EXTRACT_WORKERS", 2)
+    sequential = PDFService()
+    sequential_metadata = await sequential.extract_to_store("sequential", path)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        service = PDFService(extract_executor=executor)
+        # Streaming into the text store keeps at most two page ranges in flight and writes them in page order
+        metadata = await service.extract_to_store("doc", path)
+    pages = service.text_store.read_pages("doc")
+    assert pages == sequential.text_store.read_pages("sequential") and metadata == sequential_metadata
+    assert [page.splitlines()[0] for page in pages] == [f"Section {i}.1" for i in range(1, 11)]
+    assert metadata == {"title": "Ten pages", "author": "Benchmark", "number_of_pages": 10}
+
+
+def test_text_store_reads_page_ranges_and_legacy_json(tmp_path):
+    import json
+    from app.services.text_store import TextStore
+
+    store = TextStore(str(tmp_path))
+    pages = [f"page {i} " * 50 for i in range(1, 6)]
+    store.save("doc", pages, {"title": "T", "author": "A", "number_of_pages": 5})
+
+    assert store.load_metadata("doc")["number_of_pages"] == 5
+    assert store.page_count("doc") == 5
+    assert store.read_pages("doc", 1, 3) == pages[1:3]
+    assert store.read_text("doc") == "\n".join(pages)
+    assert os.path.getsize(tmp_path / "doc.pages") < sum(len(page) for page in pages)
+
+    # A replacement is written aside: readers see the old pages until it is complete, and a failed one leaves them intact
+    def replacement(fail: bool):
+        for i in range(1, 4):
+            assert store.read_pages("doc") == pages and store.load_metadata("doc")["number_of_pages"] == 5
+            yield f"new page {i}"
+        if fail:
+            raise ValueError("extraction failed")
+
+    with pytest.raises(ValueError):
+        store.save("doc", replacement(fail=True), {"title": "T"})
+    assert store.read_pages("doc") == pages and not list(tmp_path.glob("*.tmp"))
+    assert store.save("doc", replacement(fail=False), {"title": "T"}) == 3
+    assert store.read_pages("doc") == ["new page 1", "new page 2", "new page 3"] and store.page_count("doc") == 3
+
+    with open(tmp_path / "old.json", "w", encoding="utf-8") as f:
+        json.dump({"text": "legacy text", "metadata": {"title": "Old"}}, f)
+    assert store.load_metadata("old") == {"title": "Old"}
+    assert store.read_text("old") == "legacy text"
+    assert not store.exists("missing")
+
+
+def test_catalog_cursor_pagination_sort_and_filters(tmp_path):
+    from app.services.catalog_service import PDFCatalog, InvalidCursorError
+
+    catalog = PDFCatalog(f"sqlite:///{tmp_path / 'catalog.db'}")
+    for i in range(25):
+        catalog.add(f"id-{i:02d}", metadata={"title": f"{'Contract' if i % 2 else 'handbook'} {i}", "author": "Ann", "number_of_pages": i})
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = catalog.list(limit=10, cursor=cursor, sort="number_of_pages", order="desc")
+        seen += [document.number_of_pages for document in page]
+        if cursor is None:
+            break
+    assert seen == list(range(24, -1, -1))
+
+    contracts, _ = catalog.list(title="contract", min_pages=5, max_pages=9, sort="title")
+    assert [document.id for document in contracts] == ["id-05", "id-07", "id-09"]
+    with pytest.raises(InvalidCursorError):
+        catalog.list(cursor=cursor or "bm90LWpzb24=", sort="title")
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_exact_semantic_and_invalidation():
+    from app.utils.cache import AnswerCache, normalize_question
+
+    vectors = {
+        "what is the refund policy": [1.0, 0.0, 0.0],
+        "how do refunds work": [0.95, 0.1, 0.0],
+        "who signed the contract": [0.0, 1.0, 0.0],
+    }
+
+    embedded = []
+
+    async def embed(text):
+        embedded.append(text)
+        return vectors.get(normalize_question(text), [0.0, 0.0, 1.0])
+
+    cache = AnswerCache(maxsize=10, ttl=60, similarity_threshold=0.9)
+    assert normalize_question("What's the refund policy?") == "what is the refund policy"
+
+    miss = await cache.get("pdf", "What is the refund policy?", embed)
+    assert miss.answer is None
+    cache.set("pdf", "What is the refund policy?", "30 days", miss.vector)
+
+    assert (await cache.get("pdf", "what's the refund policy")).answer == "30 days"
+    assert (await cache.get("pdf", "How do refunds work?", embed)).answer == "30 days"
+    assert (await cache.get("pdf", "Who signed the contract?", embed)).answer is None
+    assert (await cache.get("other", "what's the refund policy")).answer is None
+
+    cache.invalidate("pdf")
+    assert (await cache.get("pdf", "what's the refund policy", embed)).answer is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 4)
+    assert stats["hit_rate"] == pytest.approx(2 / 6)
+
+    # An answer generated while the PDF was re-indexed is not cached
+    lookup = await cache.get("pdf", "Who signed the contract?", embed)
+    cache.invalidate("pdf")
+    cache.set("pdf", "Who signed the contract?", "Stale answer", lookup.vector, version=lookup.version)
+    assert (await cache.get("pdf", "Who signed the contract?")).answer is None
+    lookup = await cache.get("pdf", "Who signed the contract?", embed)
+    cache.set("pdf", "Who signed the contract?", "Fresh answer", lookup.vector, version=lookup.version)
+    assert (await cache.get("pdf", "Who signed the contract?")).answer == "Fresh answer"
+
+    # The question is embedded as asked, since chat reuses the vector for retrieval
+    await cache.get("pdf", "Which order contains SKU-1234?", embed)
+    assert embedded[0] == "What is the refund policy?" and embedded[-1] == "Which order contains SKU-1234?"
+
+
+@pytest.mark.asyncio
+async def test_long_answer_retrieves_once_across_rounds(tmp_path, monkeypatch):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    first = " ".join(["refund"] * 120)
+    llm = FakeListChatModel(responses=[first, "Thirty days."])
+    service = LangchainGeminiService(llm=llm, embeddings=FakeEmbeddings())
+    await service.process_pdf("long", "Refund policy. Customers may return items within thirty days.")
+
+    searches = []
+    original_search = service._hybrid_search
+    prompts = []
+    original_prompt = service._round_prompt
+    monkeypatch.setattr(service, "_hybrid_search", lambda *args: searches.append(args) or original_search(*args))
+    monkeypatch.setattr(service, "_round_prompt", lambda *args: prompts.append(args) or original_prompt(*args))
+
+    result = await service.answer_long("long", "What is the refund policy?", max_iterations=5)
+
+    assert len(searches) == 1
+    assert result.iterations == 2
+    assert result.answer == f"{first} Thirty days."
+    assert result.sources == ["long:1"] and len(result.scores) == 1
+    assert prompts[1][2] == first
+    assert result.format() == f"Answer: {result.answer}\n\nSources: ['long:1']"
+
+
+def test_global_index_filters_by_source_and_switches_to_ann(tmp_path):
+    import numpy as np
+    from langchain_core.documents import Document
+    from app.services.global_index import GlobalIndex
+
+    rng = np.random.default_rng(0)
+    index = GlobalIndex(FakeEmbeddings(size=8), root_dir=str(tmp_path), ann_threshold=50, index_type="hnsw")
+    vectors = {source: rng.random((30, 8), dtype=np.float32) for source in ("a", "b", "c", "d")}
+    for source, source_vectors in vectors.items():
+        index.add("acme", source, [Document(page_content=f"{source}-{i}", metadata={"source": source}) for i in range(30)], source_vectors)
+
+    shard = index.shard("acme")
+    assert len(shard) == 120 and not shard.is_exact
+    # A selective filter is scored exactly, so the best chunk of that PDF is always found
+    query = vectors["b"][7] + 0.001
+    assert [doc.page_content for doc, _ in shard.search(query, 3, sources=["b"])][0] == "b-7"
+    assert {doc.metadata["source"] for doc, _ in shard.search(query, 10, sources=["a", "c"])} <= {"a", "c"}
+    assert len(shard.search(query, 5)) == 5
+
+    # Re-adding a source replaces its chunks without rebuilding the graph; shards persist per tenant
+    graph = shard.index
+    index.add("acme", "b", [Document(page_content="b-new", metadata={"source": "b"})], vectors["b"][:1])
+    assert shard.index is graph and len(shard.deleted) == 30
+    assert "b-3" not in [doc.page_content for doc, _ in shard.search(vectors["b"][3], 10)]
+    index.flush()
+    reloaded = GlobalIndex(FakeEmbeddings(size=8), root_dir=str(tmp_path)).shard("acme")
+    assert len(reloaded) == 91
+    assert [doc.page_content for doc, _ in reloaded.search(query, 5, sources=["b"])] == ["b-new"]
+    assert len(index.shard("globex")) == 0
+    with pytest.raises(ValueError):
+        index.shard("../escape")
+
+
+def test_global_index_saves_versions_and_evicts_shards(tmp_path):
+    import numpy as np
+    from langchain_core.documents import Document
+    from app.services.global_index import GlobalIndex
+
+    rng = np.random.default_rng(1)
+    index = GlobalIndex(FakeEmbeddings(size=8), root_dir=str(tmp_path), cache_bytes=500, save_delay=0)
+    for source in ("a", "b"):
+        index.add("acme", source, [Document(page_content=f"{source}-{i}", metadata={"source": source}) for i in range(20)], rng.random((20, 8), dtype=np.float32))
+    shard = index.shard("acme")
+    flat = shard.index
+    index.remove("acme", "a")
+    assert shard.index is flat and flat.ntotal == 20
+
+    # Each save is a new version directory behind one pointer; the unchanged source is linked, not rewritten
+    root = tmp_path / "acme"
+    current = (root / "CURRENT").read_text()
+    assert sorted(p.name for p in root.iterdir() if p.name.startswith("v")) == ["v000002", current]
+    (unchanged,) = (root / current / "sources").iterdir()
+    assert unchanged.stat().st_nlink == 2
+
+    # Clean shards past the byte cap are dropped from memory and reloaded on demand
+    index.add("globex", "c", [Document(page_content="c-0", metadata={"source": "c"})], rng.random((1, 8), dtype=np.float32))
+    assert index.stats() == {"globex": 1}
+    assert len(index.shard("acme")) == 20 and index.contains("acme", "b") and not index.contains("acme", "a")
+
+
+@pytest.mark.asyncio
+async def test_hybrid_retrieval_finds_exact_identifiers(tmp_path, monkeypatch):
+    from app.services.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+
+    assert tokenize("Clause 4.2.1 covers SKU-10432.") == ["clause", "4.2.1", "4", "2", "1", "covers", "sku-10432", "sku", "10432"]
+    assert [chunk_id for chunk_id, _ in reciprocal_rank_fusion([[1, 2, 3], [3, 1]])] == [1, 3, 2]
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings())
+    service.text_splitter._chunk_size, service.text_splitter._chunk_overlap = 80, 0
+    lines = [f"Line item {i}: part SKU-{10000 + i} ships from warehouse {i % 7}." for i in range(200)]
+    await service.process_pdf("catalog", "\n".join(lines))
+
+    # Hash-based fake embeddings carry no meaning, so only the keyword side can find the SKU
+    documents, scores = await service.retrieve("catalog", "Which warehouse ships SKU-10137?")
+    assert any("SKU-10137" in doc.page_content for doc in documents)
+    dense = await service.pdf_vectorstores.get("catalog").asimilarity_search("Which warehouse ships SKU-10137?", k=5)
+    assert not any("SKU-10137" in doc.page_content for doc in dense)
+    assert scores == sorted(scores, reverse=True)
+
+    # The keyword index is persisted next to the FAISS index and reloaded with it
+    service.pdf_vectorstores.evict("catalog")
+    assert service.pdf_vectorstores.keywords("catalog").search("sku-10137", 1)
+    assert os.path.exists(os.path.join(service.pdf_vectorstores.index_dir("catalog"), "keywords.npz"))
+
+    # Lexical search over 10k chunks stays within single-digit milliseconds
+    keywords = KeywordIndex.build(f"Section {i}.{i % 9} part SKU-{i:05d} ships from warehouse {i % 7} within {i % 30} days" for i in range(10000))
+    start = time.perf_counter()
+    for i in range(50):
+        assert keywords.search(f"What ships as SKU-{i * 37:05d}?", 20)[0][0] == i * 37
+    assert (time.perf_counter() - start) / 50 < 0.01
+
+
+@pytest.mark.asyncio
+async def test_reindexing_embeds_only_changed_chunks(tmp_path, monkeypatch):
+    from app.core.config import settings
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_ENABLED", False)
+    embeddings = FakeEmbeddings()
+    service = LangchainGeminiService(llm=MagicMock(), embeddings=embeddings)
+    service.text_splitter._chunk_size, service.text_splitter._chunk_overlap = 80, 0
+    paragraphs = [f"Paragraph {i} describes clause {i} of the agreement in detail." for i in range(20)]
+    await service.process_pdf("contract", "\n\n".join(paragraphs), tenant_id="acme")
+    assert embeddings.texts_embedded == 20
+
+    service.pdf_vectorstores.evict("contract")  # reload from disk (memory-mapped, read-only)
+    paragraphs[3] = "Paragraph 3 now says something entirely different."
+    del paragraphs[7]
+    await service.process_pdf("contract", "\n\n".join(paragraphs), tenant_id="acme")
+
+    assert embeddings.texts_embedded == 21
+    vectorstore = service.pdf_vectorstores.get("contract")
+    contents = sorted(doc.page_content for doc in vectorstore.docstore._dict.values())
+    assert vectorstore.index.ntotal == 19 and contents == sorted(paragraphs)
+    assert service.pdf_vectorstores.keywords("contract").chunk_count == 19
+    assert len(service.global_index.shard("acme")) == 19
+
+    service.delete_pdf("contract", "acme")
+    assert "contract" not in service.pdf_vectorstores
+    assert len(service.global_index.shard("acme")) == 0
+
+
+def test_metrics_registry_renders_prometheus_text():
+    from app.utils.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    latency = registry.histogram("stage_duration_seconds", "Stage latency.", ("stage",), buckets=(0.1, 1.0))
+    pages = registry.counter("pages", "Pages seen.")
+    depth = registry.gauge("queue_depth", "Queue depth.")
+    latency.observe(0.05, stage="embed")
+    latency.observe(0.5, stage="embed")
+    with latency.time(stage="llm"):
+        pass
+    pages.inc(3)
+    depth.set(7)
+
+    text = registry.render()
+    assert '# TYPE stage_duration_seconds histogram' in text
+    assert 'stage_duration_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'stage_duration_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'stage_duration_seconds_bucket{stage="embed",le="+Inf"} 2' in text
+    assert 'stage_duration_seconds_count{stage="embed"} 2' in text
+    assert 'stage_duration_seconds_count{stage="llm"} 1' in text
+    assert "pages_total 3" in text and "queue_depth 7" in text
+    with pytest.raises(ValueError):
+        registry.counter("pages", "Registered twice.")
+
+    # Recording stays cheap enough for per-chunk and per-request hot paths
+    start = time.perf_counter()
+    for _ in range(100000):
+        latency.observe(0.2, stage="embed")
+    assert (time.perf_counter() - start) / 100000 < 20e-6
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_backends_use_token_buckets(tmp_path):
+    from app.utils.rate_limiter import InMemoryRateLimitBackend, SQLiteRateLimitBackend
+
+    memory = InMemoryRateLimitBackend(idle_ttl=0)
+    assert [await memory.acquire("a", 4, 10, 0.001) for _ in range(3)][:2] == [0, 0]
+    assert await memory.acquire("a", 4, 10, 0.001) > 0
+    assert await memory.acquire("a", 1, 10, 0.001) == 0
+
+    # Buckets that would have refilled completely are evicted, so memory stays bounded
+    fast = InMemoryRateLimitBackend(idle_ttl=0)
+    for i in range(1000):
+        await fast.acquire(f"client-{i}", 1, 1, 1e9)
+    assert len(fast) == 1
+
+    # Two backends on the same file (e.g. two uvicorn workers) share the buckets
+    path = str(tmp_path / "limits.db")
+    first, second = SQLiteRateLimitBackend(path), SQLiteRateLimitBackend(path)
+    assert await first.acquire("ip", 3, 5, 0.001) == 0
+    assert await second.acquire("ip", 3, 5, 0.001) > 0
+    assert await second.acquire("ip", 2, 5, 0.001) == 0
+
+
+def test_rate_limit_middleware_charges_per_route():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.middleware.rate_limit import RateLimitMiddleware
+    from app.utils.rate_limiter import InMemoryRateLimitBackend
+
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, max_requests=10, window=600, backend=InMemoryRateLimitBackend(), route_costs={"/chat": 4})
+
+    @app.post("/chat/{pdf_id}")
+    async def chat(pdf_id: str):
+        return {"ok": True}
+
+    @app.get("/pdf/list")
+    async def list_pdfs():
+        return []
+
+    client = TestClient(app)
+    assert [client.post("/chat/a").status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.post("/chat/a")
+    assert limited.json() == {"detail": "Too many requests"} and int(limited.headers["Retry-After"]) > 0
+    assert [client.get("/pdf/list").status_code for _ in range(3)] == [200, 200, 429]
+
+
+def test_logging_runs_through_queue_with_sampling_and_truncation():
+    import logging
+    from app.utils.logger import JSONFormatter, LOG_DROPPED, SamplingFilter, listener, queue_handler
+
+    assert logger.handlers == [queue_handler] and listener._thread is not None
+
+    record = logging.LogRecord("app.utils.logger", logging.INFO, __file__, 1, "x" * 50, None, None)
+    formatted = JSONFormatter(max_length=10).format(record)
+    assert '"message":"xxxxxxxxxx... [truncated 40 chars]"' in formatted
+
+    sampling = SamplingFilter(rates={"app.utils.logger.retrieval": 0.25}, default_rate=1.0)
+    dropped = LOG_DROPPED.value(reason="sampled")
+    debug = [logging.LogRecord("app.utils.logger.retrieval", logging.DEBUG, __file__, 1, "detail", None, None) for _ in range(8)]
+    assert sum(sampling.filter(r) for r in debug) == 2
+    assert LOG_DROPPED.value(reason="sampled") == dropped + 6
+    warning = logging.LogRecord("app.utils.logger.retrieval", logging.WARNING, __file__, 1, "kept", None, None)
+    assert sampling.filter(warning)
+
+    # Rates are keyed by the name given to get_logger
+    from app.utils.logger import get_logger
+    sampler = next(f for f in queue_handler.filters if isinstance(f, SamplingFilter))
+    retrieval_logger = get_logger("retrieval")
+    level = retrieval_logger.level
+    retrieval_logger.setLevel(logging.DEBUG)
+    try:
+        with patch.dict(sampler.rates, {"retrieval": 0}):
+            dropped = LOG_DROPPED.value(reason="sampled")
+            for _ in range(3):
+                retrieval_logger.debug("detail")
+            assert LOG_DROPPED.value(reason="sampled") == dropped + 3
+    finally:
+        retrieval_logger.setLevel(level)
+
+
+def test_context_builder_packs_relevant_diverse_chunks_within_budget():
+    import numpy as np
+    from langchain_core.documents import Document
+    from app.services.context_builder import ContextBuilder
+    from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+    assert estimate_tokens("Refunds take 30 days, see clause 4.2.") == 12
+    assert estimate_tokens("internationalization") == 4
+    assert truncate_to_tokens("one two three four", 2) == "one two"
+
+    paragraph = " ".join(["refund"] * 60)
+    documents = [
+        Document(page_content=paragraph, metadata={"chunk_hash": "a"}),
+        Document(page_content=paragraph, metadata={"chunk_hash": "a"}),  # exact duplicate
+        Document(page_content=paragraph + " again", metadata={"chunk_hash": "b"}),  # near duplicate
+        Document(page_content=" ".join(["ship"] * 60), metadata={"chunk_hash": "c"}),
+        Document(page_content=" ".join(["repair"] * 60), metadata={"chunk_hash": "d"}),
+        Document(page_content="unrelated", metadata={"chunk_hash": "e"}),
+    ]
+    scores = [1.0, 1.0, 0.95, 0.8, 0.7, 0.1]
+    vectors = np.array([[1, 0, 0], [1, 0, 0], [1, 0.01, 0], [0, 1, 0], [0, 0, 1], [0.5, 0.5, 0]], dtype=np.float32)
+
+    context = ContextBuilder(max_tokens=150, max_chunks=8, min_relevance=0.3, mmr_lambda=0.7, dedup_similarity=0.95).pack(documents, scores, vectors)
+    # Duplicates and the low-scoring chunk are dropped; the budget fits two of the three distinct chunks
+    assert [doc.metadata["chunk_hash"] for doc in context.documents] == ["a", "c"]
+    assert context.scores == [1.0, 0.8]
+    assert context.tokens == estimate_tokens(context.text) == 120
+
+    # A single chunk larger than the budget is truncated rather than dropped
+    context = ContextBuilder(max_tokens=10).pack(documents[:1], scores[:1])
+    assert context.tokens == 10 and context.documents[0].page_content == " ".join(["refund"] * 10)
+
+
+
+def test_hybrid_retrieval_drops_weak_candidates_despite_rank_fusion():
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from app.services.context_builder import ContextBuilder
+    from app.services.keyword_index import KeywordIndex
+
+    texts = ["Refunds for SKU-10137 are issued within thirty days.", "Shipping rates for parcels.", "Office opening hours."]
+    vectors = [[1.0, 0.1, 0.0], [0.6, 0.8, 0.0], [-0.5, 0.0, 0.9]]
+    vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), FakeEmbeddings(size=3))
+    keywords = KeywordIndex.from_vectorstore(vectorstore)
+
+    documents, scores, candidate_vectors, relevance = LangchainGeminiService._hybrid_search(vectorstore, keywords, "refund policy for SKU-10137", [1.0, 0.0, 0.0], 3)
+    # Every chunk is in the dense ranking, so relative fused scores alone keep all of them
+    assert len(documents) == 3 and min(scores) / max(scores) > 0.3
+    assert len(ContextBuilder(min_relevance=0.3).pack(documents, scores, candidate_vectors).documents) == 3
+    # Calibrated on cosine similarity and BM25, the chunk pointing away from the question and sharing no terms with it is dropped
+    context = ContextBuilder(min_relevance=0.3).pack(documents, scores, candidate_vectors, relevance)
+    assert [doc.page_content for doc in context.documents] == texts[:2]
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    from app.utils.single_flight import SingleFlight
+
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "bad":
+            raise ValueError("failed")
+        return value
+
+    results = await asyncio.gather(*(flight.do("key", lambda: work("ok")) for _ in range(10)))
+    assert results == ["ok"] * 10 and calls == ["ok"] and len(flight) == 0
+
+    # Failures reach every waiter; finished keys run again
+    outcomes = await asyncio.gather(*(flight.do("key", lambda: work("bad")) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes) and calls == ["ok", "bad"]
+
+    # Cancelling the first caller does not cancel the work others are waiting for
+    first = asyncio.ensure_future(flight.do("slow", lambda: work("slow")))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(flight.do("slow", lambda: work("other")))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "slow"
+
+
+
+@pytest.mark.asyncio
+async def test_ingestion_and_lazy_indexing_share_one_run(tmp_path, monkeypatch):
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings(latency=0.05))
+    runs = []
+    original_process = service.process_pdf
+    monkeypatch.setattr(service, "process_pdf", lambda pdf_id, pages, **kwargs: runs.append(list(pages)) or original_process(pdf_id, runs[-1], **kwargs))
+
+    # A question arriving while the upload job indexes the PDF joins that run instead of starting another
+    await asyncio.gather(
+        service.index_pdf("doc", lambda: ["Refunds take thirty days."], fresh=True),
+        service.index_pdf("doc", lambda: ["Refunds take thirty days."]),
+    )
+    assert len(runs) == 1
+
+    # New content never joins a run that may have read the old text; it waits for it and indexes again
+    await asyncio.gather(
+        service.index_pdf("doc", lambda: ["Refunds take thirty days."]),
+        service.index_pdf("doc", lambda: ["Refunds take sixty days."], fresh=True),
+    )
+    assert runs[1:] == [["Refunds take thirty days."], ["Refunds take sixty days."]]
+    documents, _ = await service.retrieve("doc", "How long do refunds take?")
+    assert "sixty" in documents[0].page_content
+
+@pytest.mark.asyncio
+async def test_compact_index_keeps_text_on_disk_and_matches_flat_results(tmp_path, monkeypatch):
+    import numpy as np
+    from app.core.config import settings
+    from app.services.compact_index import ChunkStore, CompactIndex
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    lines = [f"Line item {i}: part SKU-{10000 + i} ships from warehouse {i % 7}." for i in range(300)]
+    flat = LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings(size=64))
+    flat.text_splitter._chunk_size, flat.text_splitter._chunk_overlap = 80, 0
+    await flat.process_pdf("catalog", "\n".join(lines))
+    flat_bytes = flat.pdf_vectorstores._estimate_bytes(flat.pdf_vectorstores.get("catalog"))
+
+    monkeypatch.setattr(settings, "FAISS_INDEX_PATH", str(tmp_path / "compact_index"))
+    monkeypatch.setattr(settings, "FAISS_INDEX_MODE", "sq8")
+    compact = LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings(size=64))
+    compact.text_splitter._chunk_size, compact.text_splitter._chunk_overlap = 80, 0
+    await compact.process_pdf("catalog", "\n".join(lines))
+    compact.pdf_vectorstores.evict("catalog")
+    vectorstore = compact.pdf_vectorstores.get("catalog")
+    assert isinstance(vectorstore.index, CompactIndex) and isinstance(vectorstore.docstore, ChunkStore)
+    assert compact.pdf_vectorstores._estimate_bytes(vectorstore) < flat_bytes / 4
+
+    # Exact re-ranking over the quantized candidates returns the flat index's top 5
+    queries = np.random.default_rng(0).standard_normal((20, 64)).astype(np.float32)
+    def top5(store):
+        _, positions = store.index.search(queries, 5)
+        return [[store.docstore.search(store.index_to_docstore_id[p]).page_content for p in row] for row in positions]
+    assert top5(vectorstore) == top5(flat.pdf_vectorstores.get("catalog"))
+    documents, _ = await compact.retrieve("catalog", "Which warehouse ships SKU-10137?")
+    assert any("SKU-10137" in doc.page_content for doc in documents)
+
+    # Re-indexing edits a flat copy and writes the compact form again
+    lines[5] = "Line item 5 was discontinued."
+    await compact.process_pdf("catalog", "\n".join(lines))
+    documents, _ = await compact.retrieve("catalog", "Which item was discontinued?")
+    assert any("discontinued" in doc.page_content for doc in documents)
+    assert isinstance(compact.pdf_vectorstores.get("catalog").docstore, ChunkStore)
+
+
+@pytest.mark.asyncio
+async def test_page_chunker_keeps_pages_and_headings_for_citations(tmp_path, monkeypatch):
+    import tracemalloc
+    from langchain_core.documents import Document
+    from app.services.chunking import PageChunker, create_text_splitter
+    from app.services.langchain_gemini_service import _citations
+
+    chunker = PageChunker(create_text_splitter(chunk_size=70, chunk_overlap=20))
+    pages = [
+        "1. Scope\nThis agreement covers the supply of parts.\n2. Payment\nInvoices are due within thirty days of delivery.",
+        "TERMINATION\nEither party may end the agreement with notice. " * 3,
+    ]
+    chunks = list(chunker.iter_chunks(pages))
+    assert {chunk.page for chunk in chunks} == {1, 2}
+    assert all(pages[chunk.page - 1][chunk.start:chunk.end] == chunk.text for chunk in chunks)
+    assert [chunk.text for chunk in chunks if chunk.page == 1] == [
+        "1. Scope\nThis agreement covers the supply of parts.", "2. Payment\nInvoices are due within thirty days of delivery.",
+    ]
+
+    # A short piece at the end of a page joins the next page's first chunk, which then cites both pages
+    continued = ["Intro paragraph that fills most of the first chunk on this page.\nThe warranty", "lasts two years from delivery.\nReturns are accepted within thirty days."]
+    chunks = list(chunker.iter_chunks(continued))
+    assert [(chunk.text, chunk.page, chunk.last_page) for chunk in chunks] == [
+        ("Intro paragraph that fills most of the first chunk on this page.", 1, 1),
+        ("The warranty\nlasts two years from delivery.", 1, 2),
+        ("Returns are accepted within thirty days.", 2, 2),
+    ]
+    assert continued[0][chunks[1].start:] + "\n" + continued[1][:chunks[1].end] == chunks[1].text
+
+    # The carry also joins the next page when that page is longer than a chunk
+    long_page = "lasts two years from delivery.\nReturns are accepted within thirty days of the invoice date.\n" * 3
+    chunks = list(chunker.iter_chunks([continued[0], long_page]))
+    assert chunks[1].text == "The warranty\nlasts two years from delivery." and (chunks[1].page, chunks[1].last_page) == (1, 2)
+    assert all(len(chunk.text) >= chunker.min_chunk_size for chunk in chunks)
+    default = PageChunker()
+    chunks = list(default.iter_chunks(["Terms apply. " * 140 + "\n\nThe payment is due within thirty", "days of delivery. " * 110]))
+    assert [chunk.text for chunk in chunks if "thirty" in chunk.text][0].startswith("The payment is due within thirty\ndays")
+    assert all(len(chunk.text) >= default.min_chunk_size for chunk in chunks)
+
+    # Pages are consumed one at a time, so memory does not grow with the document
+    generated = ("Section %d\n" % i + "Lorem ipsum dolor sit amet. " * 100 for i in range(2000))
+    tracemalloc.start()
+    count = sum(1 for _ in chunker.iter_chunks(generated))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert count > 2000 and peak < 1024 * 1024
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    service = LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings())
+    await service.process_pdf("contract", pages)
+    documents = list(service.pdf_vectorstores.get("contract").docstore._dict.values())
+    assert _citations(documents + [Document(page_content="", metadata={"source": "notes"})]) == ["contract:1", "contract:2", "notes"]
+
+
+def test_app_import_defers_heavy_modules_until_first_use(tmp_path, monkeypatch):
+    import subprocess
+    import sys
+    from app.core.container import ServiceContainer
+    from app.utils.lazy_import import LazyImport
+    from app.utils.startup import startup_report
+
+    probe = "import sys, app.main; print(sorted(m for m in ('langchain', 'langchain_core', 'langchain_community', 'langchain_google_genai', 'google.generativeai', 'pypdf', 'faiss', 'numpy', 'sqlalchemy') if m in sys.modules))"
+    env = dict(os.environ, GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "test"))
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+    ordered_dict = LazyImport("collections", "OrderedDict")
+    assert isinstance(ordered_dict(), ordered_dict) and ordered_dict.fromkeys("a") == {"a": None}
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    container = ServiceContainer(langchain_service=LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings()))
+    assert not container.is_built("pdf_service")
+    container.warm_up()
+    assert all(container.is_built(name) for name in ServiceContainer.SERVICES)
+    report = startup_report.as_dict()
+    assert {"pdf_service", "ingestion_queue"} <= set(report["services"]) and "langchain_google_genai" in report["imports"]
+
+
+@pytest.mark.asyncio
+async def test_request_dependencies_build_services_off_the_event_loop(tmp_path, monkeypatch):
+    import threading
+    from app.api.deps import get_pdf_service
+    from app.core import container as container_module
+    from app.core.container import ServiceContainer
+
+    use_tmp_storage(monkeypatch, tmp_path)
+    threads = []
+    original = container_module.PDFService
+    monkeypatch.setattr(container_module, "PDFService", lambda *args: threads.append(threading.current_thread()) or original(*args))
+    container = ServiceContainer(langchain_service=LangchainGeminiService(llm=MagicMock(), embeddings=FakeEmbeddings()))
+
+    pdf_service = await get_pdf_service(container)
+    assert threads and threads[0] is not threading.main_thread()
+    assert await get_pdf_service(container) is pdf_service and len(threads) == 1
+
+
+@pytest.mark.asyncio
+async def test_llm_gateway_limits_concurrency_per_tenant_and_retries():
+    import httpx
+    from app.services.llm_gateway import LLMGateway, LLMGatewayError
+    from app.utils.metrics import LLM_QUEUE_SECONDS, LLM_RETRIES
+    from tests.fakes import GeminiStub
+
+    def gateway_for(stub, **kwargs):
+        return LLMGateway(api_key="test", base_url="http://gemini.test", transport=httpx.ASGITransport(app=stub.app), retry_backoff=0, **kwargs)
+
+    # Three calls of one tenant and one of another: at most one per tenant and two overall run at once
+    stub = GeminiStub(answer="Refunds within thirty days.", latency=0.05)
+    gateway = gateway_for(stub, max_concurrency=2, max_concurrency_per_tenant=1)
+    waits = LLM_QUEUE_SECONDS.count()
+    results = await asyncio.gather(*(
+        gateway.generate("gemini-1.5-flash", "What is the refund policy?", tenant_id=tenant) for tenant in ("a", "a", "a", "b")
+    ))
+    assert [result.text for result in results] == ["Refunds within thirty days."] * 4
+    assert results[0].input_tokens == 5 and results[0].output_tokens == 4
+    assert stub.max_active == 2
+    assert LLM_QUEUE_SECONDS.count() == waits + 4
+
+    chunks = [generation.text async for generation in gateway.stream("gemini-1.5-flash", "What is the refund policy?")]
+    assert "".join(chunks) == "Refunds within thirty days." and len(chunks) == 4
+    await gateway.aclose()
+
+    # Rate limited twice, then answered
+    stub = GeminiStub(fail_times=2)
+    retries = LLM_RETRIES.value(reason="429")
+    assert (await gateway_for(stub).generate("gemini-1.5-flash", "Hello")).text == "Stub answer."
+    assert stub.calls == 3 and LLM_RETRIES.value(reason="429") == retries + 2
+
+    # Client errors are not retried
+    stub = GeminiStub(error_status=400)
+    with pytest.raises(LLMGatewayError) as error:
+        await gateway_for(stub).generate("gemini-1.5-flash", "Hello")
+    assert error.value.status_code == 400 and stub.calls == 1
+
+
+def test_llm_gateway_keeps_one_client_per_event_loop():
+    import httpx
+    from app.services.gateway_chat_model import GatewayChatModel
+    from app.services.llm_gateway import LLMGateway
+    from tests.fakes import GeminiStub
+
+    stub = GeminiStub(answer="Refunds within thirty days.")
+    gateway = LLMGateway(api_key="test", base_url="http://gemini.test", transport=httpx.ASGITransport(app=stub.app), retry_backoff=0)
+    model = GatewayChatModel(gateway=gateway)
+
+    # Synchronous calls outside a loop run on a temporary loop whose pool is closed afterwards
+    assert model.invoke("What is the refund policy?").content == "Refunds within thirty days."
+    assert len(gateway._bindings) == 0
+
+    async def on_one_loop():
+        with pytest.raises(RuntimeError, match="ainvoke"):
+            model.invoke("What is the refund policy?")
+        assert (await model.ainvoke("What is the refund policy?")).content == "Refunds within thirty days."
+        binding = gateway._bind()
+        await gateway.aclose()
+        return binding
+
+    first, second = asyncio.run(on_one_loop()), asyncio.run(on_one_loop())
+    assert first.client is not second.client
+    assert first.client.is_closed and second.client.is_closed
+    assert stub.calls == 3